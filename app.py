@@ -1,14 +1,14 @@
 # app.py
 
 import os
+import sqlite3
 import time
-from datetime import datetime, date, datetime as dt
+from datetime import datetime, date, datetime as dt, timedelta
 
 import altair as alt
 import pandas as pd
 import streamlit as st
 from pathlib import Path
-from streamlit.components.v1 import html as st_html
 
 # ------- (optional) auto refresh -------
 try:
@@ -18,7 +18,53 @@ except Exception:
         return None
 
 # ------- DB functions (ใช้ db.py เดิม) -------
-from db import init_db, get_all_status, get_stock_by_blood, adjust_stock, reset_all_stock
+from db import (
+    init_db,
+    get_all_status,
+    get_stock_by_blood,
+    adjust_stock,
+    reset_all_stock,
+    issue_order,
+    InsufficientStockError,
+    READ_ONLY,
+    get_stock_version,
+    UNIT_COLS,
+    UnitsConflictError,
+    get_units,
+    get_units_version,
+    insert_units,
+    replace_units,
+    update_unit_status,
+    import_units,
+    search_stock_log,
+    search_units,
+    get_level_history,
+    get_backend,
+    find_units,
+    UI_TO_DB,
+    DB_TO_UI,
+)
+from coherence import CoherentCache, DataVersionWatcher
+from fefo import FefoIndex, AVAILABLE_STATUSES, IN_STOCK_STATUSES
+from compat import COMPAT, rank_candidates, plan_order
+from isbt import parse_scan, normalize_unit_number
+from webassets import stylesheet_tag, dashboard_grid
+from scheduler import default_scheduler
+import reports
+import profiling
+import importer
+from lttb import lttb
+from bagsvg import BAG_MAX, CRITICAL_MAX, YELLOW_MAX, compute_bag, bag_color
+
+# โปรไฟล์ rerun นี้ถ้าเปิดไว้ (env BLOOD_PROFILE_RERUNS หรือปุ่มในเมนู ดู profiling.py) เริ่มก่อนโค้ดส่วนอื่น
+# ที่ค้างจาก rerun ก่อน (จบด้วย exception / ถูกขัดจังหวะ) ทิ้งไป
+if "_profile" in st.session_state:
+    profiling.abandon(st.session_state.pop("_profile")[0])
+_prof, _prof_src = profiling.begin(st.session_state.get("profile_left", 0))
+if _prof is not None:
+    if _prof_src == "session":
+        st.session_state["profile_left"] -= 1
+    st.session_state["_profile"] = (_prof, _prof_src)
 
 
 # ==========================================
@@ -30,405 +76,22 @@ st.set_page_config(
     layout="wide",
 )
 
-# --------- CSS หลัก (โทนชมพู/ขาว + Sidebar มืด) ---------
-st.markdown(
-    """
-<style>
-/* พื้นหลังหลัก */
-body {
-    background: radial-gradient(circle at 0% 0%, #ffe4e6 0, #fff1f2 28%, #fdf2f8 52%, #ffffff 100%);
-    font-family: system-ui,-apple-system,BlinkMacSystemFont,"Segoe UI",sans-serif;
-}
-.block-container {
-    padding-top: 1.7rem;
-    padding-bottom: 2.5rem;
-    max-width: 1240px;
-}
-
-/* หัวเรื่อง */
-h1, h2, h3 {
-    letter-spacing: .03em;
-}
-
-/* ปุ่ม Streamlit ทั่วไป */
-.stButton>button {
-    border-radius: 999px;
-    font-weight: 600;
-    border: 1px solid #e5e7eb;
-    padding-top: .4rem;
-    padding-bottom: .4rem;
-}
-
-/* ---------- Sidebar ---------- */
-[data-testid="stSidebar"] {
-    background: #020617;
-}
-[data-testid="stSidebar"] > div {
-    padding-top: 1.2rem;
-}
-[data-testid="stSidebar"] .sidebar-title {
-    color: #e5e7eb;
-    font-weight: 800;
-    font-size: 1.02rem;
-    margin: 0 0 0.7rem 0.2rem;
-}
-[data-testid="stSidebar"] .stButton>button {
-    width: 100%;
-    justify-content: center;
-    border-radius: 999px;
-    border: 1px solid rgba(248,113,113,0.25);
-    background: transparent;
-    color: #e5e7eb;
-    font-weight: 600;
-}
-[data-testid="stSidebar"] .stButton>button:hover {
-    border-color: rgba(248,113,113,0.8);
-    background: rgba(248, 113, 113, 0.08);
-}
-
-/* ---------- Badge Legend ---------- */
-.badge {
-    display: inline-flex;
-    align-items: center;
-    gap: .4rem;
-    padding: .25rem .6rem;
-    border-radius: 999px;
-    background: #f3f4f6;
-    font-size: .82rem;
-    color: #374151;
-}
-.legend-dot {
-    width: .7rem;
-    height: .7rem;
-    border-radius: 999px;
-    display: inline-block;
-}
-
-/* ---------- Flash message (มุมขวาบน) ---------- */
-.flash {
-    position: fixed;
-    top: 90px;
-    right: 24px;
-    z-index: 9999;
-    color: #fff;
-    padding: .7rem 1rem;
-    border-radius: 12px;
-    font-weight: 700;
-    box-shadow: 0 14px 30px rgba(0,0,0,.2);
-    font-size: .9rem;
-}
-.flash.success { background:#16a34a; }
-.flash.info    { background:#0ea5e9; }
-.flash.warning { background:#f59e0b; }
-.flash.error   { background:#ef4444; }
-
-/* ---------- แบนเนอร์วันหมดอายุ ---------- */
-#expiry-banner {
-    border-radius: 14px;
-    margin: 10px 0 12px 0;
-    padding: 12px 14px;
-    border: 2px solid #991b1b;
-    background: linear-gradient(180deg,#fee2e2,#ffffff);
-    box-shadow: 0 10px 24px rgba(153,27,27,.12);
-}
-#expiry-banner .title {
-    font-weight: 900;
-    font-size: 1.02rem;
-    color: #7f1d1d;
-}
-#expiry-banner .chip {
-    display:inline-flex;
-    align-items:center;
-    gap:.35rem;
-    padding:.18rem .55rem;
-    border-radius:999px;
-    font-weight:800;
-    background:#ef4444;
-    color:#fff;
-    margin-left:.45rem;
-    font-size:.82rem;
-}
-#expiry-banner .chip.warn { background:#f59e0b; }
-
-/* ---------- Landing hero (หน้าแรก) ---------- */
-.landing-shell {
-    margin-top: 1.0rem;
-}
-.landing-hero-card {
-    position: relative;
-    border-radius: 26px;
-    padding: 24px 28px;
-    background: radial-gradient(circle at 0% 0%, #fee2e2 0, #ffe4e6 36%, #fef2f2 100%);
-    box-shadow: 0 26px 60px rgba(248,113,113,0.25);
-    display: grid;
-    grid-template-columns: minmax(0, 1.1fr) minmax(0, .9fr);
-    gap: 24px;
-}
-.landing-hero-pill {
-    display:inline-flex;
-    align-items:center;
-    gap:.45rem;
-    font-size:.80rem;
-    padding:.25rem .8rem;
-    border-radius:999px;
-    background:#fee2e2;
-    color:#b91c1c;
-    font-weight:700;
-    margin-bottom:.4rem;
-}
-.landing-hero-pill span {
-    font-size: 1rem;
-}
-.landing-hero-title {
-    font-size: 1.7rem;
-    font-weight: 900;
-    color: #111827;
-    margin-bottom: .3rem;
-}
-.landing-hero-sub {
-    font-size: .96rem;
-    color: #374151;
-    margin-bottom: .7rem;
-}
-.landing-hero-list {
-    padding-left: 1.15rem;
-    margin-bottom: .9rem;
-}
-.landing-hero-list li {
-    margin-bottom: .25rem;
-    font-size: .9rem;
-    color: #374151;
-}
-.landing-btn-row {
-    display:flex;
-    flex-wrap:wrap;
-    gap:.65rem;
-}
-.landing-btn-primary,
-.landing-btn-ghost {
-    display:inline-flex;
-    align-items:center;
-    justify-content:center;
-    border-radius:999px;
-    padding:.55rem 1.4rem;
-    font-size:.92rem;
-    font-weight:700;
-    text-decoration:none;
-    border: 1px solid transparent;
-    box-shadow: 0 14px 34px rgba(248,113,113,0.45);
-}
-.landing-btn-primary {
-    background: linear-gradient(135deg,#fb7185,#f97316);
-    color:#fff;
-}
-.landing-btn-primary:hover {
-    filter: brightness(1.05);
-}
-.landing-btn-ghost {
-    background:#fff;
-    color:#111827;
-    box-shadow:none;
-    border-color:#fed7d7;
-}
-.landing-hero-illu-wrap {
-    display:flex;
-    align-items:center;
-    justify-content:center;
-}
-.landing-hero-illu {
-    width: 260px;
-    max-width: 100%;
-    border-radius: 26px;
-    background: radial-gradient(circle at 30% 0%, #fecaca 0, #f97373 40%, #b91c1c 100%);
-    box-shadow: 0 32px 70px rgba(248,113,113,0.85);
-    padding: 32px 26px;
-    position: relative;
-}
-.landing-hero-illu-inner {
-    background:#fef2f2;
-    border-radius: 20px;
-    padding: 22px 18px;
-    box-shadow: 0 16px 32px rgba(220,38,38,0.65);
-}
-.landing-hero-illu-chart {
-    height: 78px;
-    border-radius: 14px;
-    background: linear-gradient(135deg,#fee2e2,#fecaca);
-    margin-bottom: 18px;
-    position: relative;
-    overflow:hidden;
-}
-.landing-hero-illu-chart::before,
-.landing-hero-illu-chart::after {
-    content:"";
-    position:absolute;
-    inset: 18px 10px auto 10px;
-    border-radius: 999px;
-    border: 2px solid rgba(248,113,113,0.15);
-}
-.landing-hero-illu-bag-row {
-    display:flex;
-    justify-content:flex-end;
-    gap: 10px;
-}
-.landing-hero-illu-bag {
-    width: 34px;
-    height: 60px;
-    border-radius: 16px;
-    background:#ef4444;
-    position:relative;
-    box-shadow: 0 8px 18px rgba(127,29,29,0.55);
-}
-.landing-hero-illu-bag::before {
-    content:"";
-    position:absolute;
-    top:-8px; left:8px; right:8px;
-    height:8px;
-    border-radius:999px;
-    background:#fecaca;
-}
-.landing-hero-illu-bag::after {
-    content:"";
-    position:absolute;
-    inset: 18px 4px 6px 4px;
-    border-radius: 10px;
-    background: linear-gradient(180deg,#fee2e2,#f97373);
-}
-
-/* กล่องข้อมูลด้านล่างหน้าแรก */
-.landing-info-row {
-    margin-top: 1.4rem;
-    display: grid;
-    grid-template-columns: minmax(0,1fr) minmax(0,1fr);
-    gap: 16px;
-}
-.landing-card {
-    border-radius: 20px;
-    background:#ffffff;
-    box-shadow: 0 18px 40px rgba(15,23,42,0.10);
-    padding: 18px 20px 16px;
-    border: 1px solid #fee2e2;
-}
-.landing-card h3 {
-    font-size: 1.02rem;
-    margin-bottom: .4rem;
-}
-.landing-card small {
-    display:block;
-    color:#6b7280;
-    font-size:.8rem;
-    margin-bottom:.7rem;
-}
-
-/* ---------- Login Page (แบบกล่องสีขาวตรงกลาง) ---------- */
-
-/* container ที่เราจะเติม class login-card-box ด้วย JS */
-.login-card-box {
-    max-width: 480px;
-    margin: 80px auto 40px auto;
-    padding: 32px 32px 28px;
-    border-radius: 30px;
-    background: #f9fafb;
-    box-shadow: 0 32px 90px rgba(15,23,42,.85);
-    border: 1px solid rgba(148,163,184,.4);
-}
-
-/* title / subtitle ในกล่อง */
-.login-title {
-    text-align:center;
-    font-size: 1.8rem;
-    font-weight: 900;
-    color: #111827;
-    margin-bottom: .15rem;
-}
-.login-subtitle {
-    text-align:center;
-    font-size: .9rem;
-    color: #6b7280;
-    margin-bottom: 1.1rem;
-}
-
-/* input ในกล่อง */
-.login-card-box .stTextInput>div>div>input {
-    background: #ffffff;
-    border-radius: 999px;
-    border: 1px solid #d1d5db;
-    color: #111827;
-    padding: .55rem 1rem;
-}
-.login-card-box .stTextInput>div>div>input::placeholder {
-    color: #9ca3af;
-}
-.login-card-box .stTextInput>label>div>p {
-    color: #111827;
-    font-weight: 600;
-    font-size: .86rem;
-}
-
-/* note ใต้ช่อง password */
-.login-note {
-    font-size: .78rem;
-    color: #6b7280;
-    margin: .35rem 0 1.1rem 0;
-}
-
-/* ปุ่มในกล่อง login (ใส่ class ให้ปุ่มด้วย JS) */
-button.login-btn-primary,
-button.login-btn-ghost {
-    border-radius: 999px !important;
-    font-weight: 700 !important;
-    padding-top: .45rem !important;
-    padding-bottom: .45rem !important;
-}
-button.login-btn-primary {
-    background: linear-gradient(135deg,#fb7185,#f97316) !important;
-    border: none !important;
-    color: #fff !important;
-    box-shadow: 0 18px 42px rgba(248,113,113,.7) !important;
-}
-button.login-btn-primary:hover {
-    filter: brightness(1.05);
-}
-button.login-btn-ghost {
-    background: #f9fafb !important;
-    border:1px solid #cbd5f5 !important;
-    color:#111827 !important;
-}
-button.login-btn-ghost:hover {
-    background:#e5e7eb !important;
-}
-
-/* ตาราง / DataFrame */
-[data-testid="stDataFrame"] table {
-    font-size: 13px;
-}
-[data-testid="stDataFrame"] th {
-    font-size: 13px;
-    font-weight: 700;
-    color: #111827;
-}
-</style>
-""",
-    unsafe_allow_html=True,
-)
+# --------- CSS หลัก (โทนชมพู/ขาว + Sidebar มืด) : frontend/app.css ---------
+# เบราว์เซอร์โหลดไฟล์ครั้งเดียวแล้ว cache ไว้ ทุก rerun ส่งแค่แท็ก <link>
+st.markdown(stylesheet_tag("app.css"), unsafe_allow_html=True)
 
 
 # ==========================================
 # CONFIG / CONSTANTS
 # ==========================================
-BAG_MAX = 20
-CRITICAL_MAX = 4
-YELLOW_MAX = 15
+# BAG_MAX / CRITICAL_MAX / YELLOW_MAX อยู่ใน bagsvg.py (ใช้ร่วมกับ signage.py)
 AUTH_PASSWORD = "1234"
 FLASH_SECONDS = 2.5
+KIOSK_REFRESH_MS = 60_000  # kiosk: เช็กเวอร์ชันสต็อกทุก 1 นาที (วาดใหม่เฉพาะเมื่อยอดเปลี่ยน)
+# กราฟยอดย้อนหลัง: จำนวนจุดรวมทุกเส้นไม่เกินนี้ (ขนาดข้อมูลที่ส่งให้เบราว์เซอร์คงที่ทุกช่วงเวลา)
+HISTORY_POINTS = 600
+HISTORY_RANGES = {"7 วัน": 7, "30 วัน": 30, "90 วัน": 90, "1 ปี": 365, "ทั้งหมด": None}
 
-REN_TO_UI = {"Plasma": "FFP", "Platelets": "PC"}
-UI_TO_DB = {
-    "LPRC": "LPRC",
-    "PRC": "PRC",
-    "FFP": "Plasma",
-    "PC": "Platelets",
-}
 ALL_PRODUCTS_UI = ["LPRC", "PRC", "FFP", "Cryo", "PC"]
 
 ENTRY_COLS = [
@@ -438,11 +101,20 @@ ENTRY_COLS = [
     "Group",
     "Blood Components",
     "Status",
-    "สถานะ(สี)",
     "บันทึก",
 ]
+# เก็บเป็น datetime64 ใน DataFrame (แปลงครั้งเดียวตอนรับข้อมูลเข้า)
+ENTRY_DATE_COLS = ["created_at", "Exp date"]
 
 STATUS_OPTIONS = ["ว่าง", "จอง", "จ่ายแล้ว", "Exp", "หลุดจอง"]
+# เก็บเป็น Categorical (รหัสจำนวนเต็ม + dictionary ร่วมทุกเซสชัน) แทน string object ทีละแถว
+ENTRY_CATEGORIES = {
+    "Group": pd.CategoricalDtype(["A", "B", "O", "AB"]),
+    "Blood Components": pd.CategoricalDtype(["LPRC", "PRC", "FFP", "PC"]),
+    "Status": pd.CategoricalDtype(STATUS_OPTIONS),
+}
+# ปุ่มลัด 1 ตัวอักษรในโหมดสแกน
+SCAN_KEYS = {"I": "จ่ายแล้ว", "B": "จอง", "X": "Exp", "A": "ว่าง"}
 STATUS_COLOR = {
     "ว่าง": "🟢 ว่าง",
     "จอง": "🟠 จอง",
@@ -473,6 +145,12 @@ else:
     URL_LOGGED = False
     URL_GO = None
 
+# ?kiosk=1 (st.query_params ไม่ใช่ dict แต่มี .get)
+_kiosk = _raw_qp.get("kiosk") if hasattr(_raw_qp, "get") else None
+if isinstance(_kiosk, list):
+    _kiosk = _kiosk[0] if _kiosk else None
+URL_KIOSK = str(_kiosk) == "1"
+
 
 def set_auth_query(logged: bool):
     """อัปเดต query parameter 'auth' เพื่อให้ล็อกอินอยู่ได้หลัง F5"""
@@ -491,6 +169,35 @@ def set_auth_query(logged: bool):
 # ==========================================
 # STATE INITIALIZATION
 # ==========================================
+def coerce_entry_types(df):
+    """
+    แปลงคอลัมน์ของ entries เป็นชนิดที่เก็บจริง (แก้ df เดิมแล้วคืน df เดิม คอลัมน์ที่ถูกชนิดแล้วไม่แตะ)
+    - วันที่ -> datetime64
+    - Group / Blood Components / Status -> Categorical; ค่านอกรายการ (เช่นจากไฟล์นำเข้า) ต่อท้าย categories ไม่หายเป็น NaN
+    """
+    for c in ENTRY_DATE_COLS:
+        if c in df.columns and not pd.api.types.is_datetime64_any_dtype(df[c]):
+            df[c] = pd.to_datetime(df[c], errors="coerce", format="mixed").dt.normalize()
+    for c, dtype in ENTRY_CATEGORIES.items():
+        if c not in df.columns:
+            continue
+        col = df[c]
+        if isinstance(col.dtype, pd.CategoricalDtype) and (
+            col.dtype == dtype or list(col.cat.categories[: len(dtype.categories)]) == list(dtype.categories)
+        ):
+            continue
+        vals = col.astype("string").str.strip()
+        extra = sorted(set(vals.dropna()) - set(dtype.categories))
+        if extra:
+            dtype = pd.CategoricalDtype(list(dtype.categories) + extra)
+        df[c] = pd.Categorical(vals, dtype=dtype)
+    return df
+
+
+def fmt_date(d) -> str:
+    return "" if pd.isna(d) else pd.Timestamp(d).strftime("%Y/%m/%d")
+
+
 def _init_state():
     ss = st.session_state
     ss.setdefault("logged_in", URL_LOGGED)
@@ -499,15 +206,20 @@ def _init_state():
     ss.setdefault("page", default_page)
     ss.setdefault("selected_bt", None)
     ss.setdefault("flash", None)
-    ss.setdefault("last_upload_token", None)
+    ss.setdefault("upload_tokens", set())  # hash ของไฟล์ที่นำเข้าแล้วในเซสชันนี้
+    ss.setdefault("upload_fids", {})  # file_id ของ uploader -> hash (ไม่ต้อง hash ซ้ำทุก rerun)
 
     if "entries" not in ss:
-        ss["entries"] = pd.DataFrame(columns=ENTRY_COLS)
+        ss["entries"] = coerce_entry_types(pd.DataFrame(columns=ENTRY_COLS))
     else:
-        for c in ENTRY_COLS:
-            if c not in ss["entries"].columns:
-                ss["entries"][c] = ""
-        ss["entries"] = ss["entries"][ENTRY_COLS].copy()
+        df = ss["entries"]
+        # คอลัมน์ตรงแล้วแก้ชนิดใน object เดิม: index ที่ผูกกับ entries ไม่ต้องสร้างใหม่ทุก rerun
+        if list(df.columns) != ENTRY_COLS:
+            for c in ENTRY_COLS:
+                if c not in df.columns:
+                    df[c] = ""
+            df = df[ENTRY_COLS].copy()
+        ss["entries"] = coerce_entry_types(df)
 
     if "activity" not in ss:
         ss["activity"] = []
@@ -525,7 +237,16 @@ elif URL_GO == "dashboard":
 # ==========================================
 # HELPER FUNCTIONS
 # ==========================================
+def _profile_end():
+    """ปิดโปรไฟล์ของ rerun นี้ (ถ้ามี) เก็บสรุปไว้แสดงในเมนู เรียกก่อนสคริปต์จบทุกทาง (จบปกติ / stop / rerun)"""
+    item = st.session_state.pop("_profile", None)
+    if item is not None:
+        prof, src = item
+        st.session_state["profile_last"] = profiling.end(prof, label=src)
+
+
 def _safe_rerun():
+    _profile_end()
     try:
         st.rerun()
     except Exception:
@@ -553,314 +274,154 @@ def show_flash():
     )
 
 
-def compute_bag(total: int, max_cap=BAG_MAX):
-    t = max(0, int(total))
-    if t <= CRITICAL_MAX:
-        status, label = "red", "วิกฤตใกล้หมด"
-    elif t <= YELLOW_MAX:
-        status, label = "yellow", "เพียงพอ"
-    else:
-        status, label = "green", "ปกติ"
-    pct = max(0, min(100, int(round(100 * min(t, max_cap) / max_cap))))
-    return status, label, pct
-
-
-def bag_color(status: str) -> str:
-    return {"green": "#22c55e", "yellow": "#f59e0b", "red": "#ef4444"}[status]
-
-
 def normalize_products(rows):
     d = {name: 0 for name in ALL_PRODUCTS_UI}
     for r in rows:
         name = str(r.get("product_type", "")).strip()
-        ui = REN_TO_UI.get(name, name)
+        ui = DB_TO_UI.get(name, name)
         if ui in d and ui != "Cryo":
             d[ui] += int(r.get("units", 0))
     return d
 
 
+@st.cache_resource(show_spinner=False)
+def _read_cache(db_path: str):
+    # ยอดสต็อกที่อ่านแล้ว ใช้ร่วมทุกเซสชันใน process; หมดอายุทันทีที่ DB มี commit ใหม่จาก process ใดก็ตาม
+    return CoherentCache(DataVersionWatcher(db_path))
+
+
+def _cached_read(key, loader):
+    """อ่านผ่าน cache ระดับ process (ดู coherence.py); backend อื่นที่ไม่ใช่ SQLite อ่านตรงทุกครั้ง"""
+    if get_backend() is not None:
+        return loader()
+    return _read_cache(os.environ.get("BLOOD_DB_PATH", "blood.db")).get(key, loader)
+
+
+def _stock_by_blood(bt):
+    return _cached_read(("stock_by_blood", bt), lambda: get_stock_by_blood(bt))
+
+
 def get_global_cryo():
     total = 0
     for bt in ["A", "B", "O", "AB"]:
-        rows = get_stock_by_blood(bt)
+        rows = _stock_by_blood(bt)
         for r in rows:
             name = str(r.get("product_type", "")).strip()
-            ui = REN_TO_UI.get(name, name)
+            ui = DB_TO_UI.get(name, name)
             if ui != "Cryo":
                 total += int(r.get("units", 0))
     return total
 
 
-def bag_svg(blood_type: str, total: int) -> str:
-    status, _label, pct = compute_bag(total, BAG_MAX)
-    fill = bag_color(status)
-    letter_fill = {
-        "A": "#facc15",
-        "B": "#f472b6",
-        "O": "#60a5fa",
-        "AB": "#ffffff",
-    }.get(blood_type, "#ffffff")
-
-    inner_h = 148.0
-    inner_y0 = 40.0
-    water_h = inner_h * pct / 100.0
-    water_y = inner_y0 + (inner_h - water_h)
-    gid = f"g_{blood_type}"
-
-    base_y = 20.0
-    amp1 = 5 + 6 * (pct / 100.0)
-    amp2 = amp1 * 0.6
-
-    wave1_d = (
-        f"M0 {base_y:.1f} "
-        f"Q20 {base_y-amp1:.1f} 40 {base_y:.1f} "
-        f"T80 {base_y:.1f} T120 {base_y:.1f} T160 {base_y:.1f} "
-        "V40 H0 Z"
-    )
-    wave2_d = (
-        f"M0 {base_y+2:.1f} "
-        f"Q20 {base_y+2-amp2:.1f} 40 {base_y+2:.1f} "
-        f"T80 {base_y+2:.1f} T120 {base_y+2:.1f} T160 {base_y+2:.1f} "
-        "V42 H0 Z"
-    )
+def totals_overview():
+    ov = _cached_read("all_status", get_all_status)
+    return {d["blood_type"]: int(d.get("total", 0)) for d in ov}
 
-    wave_speed1 = 5.0
-    wave_speed2 = 7.5
-
-    if total <= 0:
-        water_y = inner_y0 + inner_h - 1
-
-    return f"""
-<div>
-  <style>
-    .bag-wrap{{display:flex;flex-direction:column;align-items:center;gap:10px;
-               font-family:ui-sans-serif,system-ui,"Segoe UI",Roboto,Arial}}
-    .bag{{transition:transform .18s ease, filter .18s ease}}
-    .bag:hover{{transform:translateY(-2px);
-                filter:drop-shadow(0 10px 22px rgba(0,0,0,.12));}}
-    .wave-layer{{mix-blend-mode:screen;opacity:.92}}
-    @keyframes wave-move-1{{0%{{transform:translateX(0);}}
-                            100%{{transform:translateX(-80px);}}}}
-    @keyframes wave-move-2{{0%{{transform:translateX(0);}}
-                            100%{{transform:translateX(-60px);}}}}
-  </style>
-  <div class="bag-wrap">
-    <svg class="bag" width="170" height="230" viewBox="0 0 168 206"
-         xmlns="http://www.w3.org/2000/svg">
-      <defs>
-        <clipPath id="clip-{gid}">
-          <path d="M24,40 C24,24 38,14 58,14 L110,14 C130,14 144,24 144,40
-                   L144,172 C144,191 128,202 108,204 L56,204 C36,202 24,191 24,172 Z"/>
-        </clipPath>
-        <linearGradient id="liquid-{gid}" x1="0" y1="0" x2="0" y2="1">
-          <stop offset="0%"  stop-color="{fill}" stop-opacity=".98"/>
-          <stop offset="55%" stop-color="{fill}" stop-opacity=".94"/>
-          <stop offset="100%" stop-color="{fill}" stop-opacity=".88"/>
-        </linearGradient>
-        <linearGradient id="liquid-soft-{gid}" x1="0" y1="0" x2="0" y2="1">
-          <stop offset="0%"  stop-color="{fill}" stop-opacity=".75"/>
-          <stop offset="100%" stop-color="{fill}" stop-opacity=".6"/>
-        </linearGradient>
-        <path id="wave1-{gid}" d="{wave1_d}" />
-        <path id="wave2-{gid}" d="{wave2_d}" />
-      </defs>
-
-      <!-- หูถุง -->
-      <circle cx="84" cy="10" r="7.5"
-              fill="#eef2ff" stroke="#dbe0ea" stroke-width="3"/>
-      <rect x="77.5" y="14" width="13" height="8" rx="3" fill="#e5e7eb"/>
-
-      <!-- ตัวถุง -->
-      <path d="M16,34 C16,18 32,8 52,8 L116,8 C136,8 152,18 152,34
-               L152,176 C152,195 136,206 116,206 L52,206 C32,206 16,195 16,176 Z"
-            fill="#ffffff" stroke="#800000" stroke-width="3"/>
-
-      <!-- ของเหลว + คลื่น -->
-      <g clip-path="url(#clip-{gid})">
-        <g transform="translate(24,{water_y:.1f})">
-          <g class="wave-layer" style="animation:wave-move-1 {wave_speed1}s linear infinite;">
-            <use href="#wave1-{gid}" fill="url(#liquid-{gid})" x="0"/>
-            <use href="#wave1-{gid}" fill="url(#liquid-{gid})" x="80"/>
-            <use href="#wave1-{gid}" fill="url(#liquid-{gid})" x="160"/>
-          </g>
-          <g class="wave-layer" style="animation:wave-move-2 {wave_speed2}s linear infinite;">
-            <use href="#wave2-{gid}" fill="url(#liquid-soft-{gid})" x="0"/>
-            <use href="#wave2-{gid}" fill="url(#liquid-soft-{gid})" x="80"/>
-            <use href="#wave2-{gid}" fill="url(#liquid-soft-{gid})" x="160"/>
-          </g>
-          <rect y="{base_y+4:.1f}" width="220" height="220" fill="url(#liquid-{gid})"/>
-        </g>
-      </g>
-
-      <!-- ป้าย max -->
-      <rect x="98" y="24" rx="10" ry="10" width="54" height="22"
-            fill="#ffffff" stroke="#e5e7eb"/>
-      <text x="125" y="40" text-anchor="middle"
-            font-size="12" fill="#374151">{BAG_MAX} max</text>
-
-      <!-- ตัวอักษรกำกับกรุ๊ปเลือด -->
-      <text x="84" y="126" text-anchor="middle" font-size="32" font-weight="900"
-            style="paint-order: stroke fill"
-            stroke="#111827" stroke-width="4"
-            fill="{letter_fill}">{blood_type}</text>
-    </svg>
-  </div>
-</div>
-"""
+
+def products_of(bt):
+    return normalize_products(_stock_by_blood(bt))
 
 
-def mini_bar_panel_html(dist: dict) -> str:
+def level_history(bt, days):
     """
-    HTML มินิกราฟแท่งแยกตามผลิตภัณฑ์ (ใช้ภายในการ์ดถุงเลือด)
-    dist: dict {'LPRC':จำนวน, 'PRC':จำนวน, ...}
+    ยอดคงเหลือย้อนหลังของกรุ๊ป (ทุกผลิตภัณฑ์) คืน (DataFrame[ts, product, units], จำนวนจุดก่อนลด)
+    ลดจุดด้วย LTTB ฝั่งเซิร์ฟเวอร์ให้รวมไม่เกิน HISTORY_POINTS (ยอดแหลม / ดิ่งวูบยังอยู่)
+    ผลเก็บใน cache ระดับ process จนกว่าจะมี commit ใหม่ (ช่วงเวลานับจากต้นวัน key จึงคงที่ทั้งวัน)
     """
-    ordered = [p for p in ALL_PRODUCTS_UI if p in dist]
-    if not ordered:
-        return ""
+    since = date.today() - timedelta(days=days) if days else None
+
+    def load():
+        hist = get_level_history(bt, since)
+        series = {pt: h for pt, h in hist.items() if h["ts"] or h["start"]}
+        budget = max(HISTORY_POINTS // max(len(series), 1), 3)
+        frames, n_raw = [], 0
+        for pt, h in series.items():
+            ts, units = h["ts"], h["units"]
+            if since is not None:
+                # จุดต้นช่วง = ยอดก่อนความเคลื่อนไหวแรกในช่วง (เส้นเริ่มที่ขอบซ้ายของกราฟ)
+                ts = [int(datetime.combine(since, datetime.min.time()).timestamp())] + ts
+                units = [h["start"]] + units
+            n_raw += len(ts)
+            xs, ys = lttb(ts, units, budget)
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "ts": [datetime.fromtimestamp(int(t)) for t in xs],
+                        "product": DB_TO_UI.get(pt, pt),
+                        "units": ys.astype(int),
+                    }
+                )
+            )
+        if not frames:
+            return pd.DataFrame(columns=["ts", "product", "units"]), 0
+        return pd.concat(frames, ignore_index=True), n_raw
 
-    max_units = max([int(dist[p]) for p in ordered] + [1])
+    return _cached_read(("level_history", bt, days, str(since)), load)
 
-    bars_html = ""
-    for p in ordered:
-        units = int(dist.get(p, 0))
-        if max_units <= 0:
-            height_px = 4
-        else:
-            ratio = min(1.0, units / max_units)
-            height_px = int(round(4 + 52 * ratio))  # สูงสุดประมาณ 56px
-
-        # สีตามระดับ
-        if units <= CRITICAL_MAX:
-            color = "#ef4444"
-        elif units <= YELLOW_MAX:
-            color = "#f59e0b"
-        else:
-            color = "#22c55e"
-
-        bars_html += f"""
-        <div class="mini-bar-col">
-          <div class="mini-bar-inner-wrap">
-            <div class="mini-bar-inner" style="height:{height_px}px;background:{color};"></div>
-          </div>
-          <div class="mini-bar-val">{units}</div>
-          <div class="mini-bar-label">{p}</div>
-        </div>
-        """
 
-    return f"""
-    <div class="mini-bar-panel">
-      <div class="mini-bar-title">จำนวนแยกตามผลิตภัณฑ์</div>
-      <div class="mini-bar-bars">
-        {bars_html}
-      </div>
-    </div>
+def dashboard_snapshot(totals: dict, blood_types) -> dict:
+    """
+    ข้อมูลสำหรับ dashboard_grid (ค่าล้วน ไม่มี HTML) ส่งให้ component ทุก rerun
     """
+    cryo = get_global_cryo()
+    bags = []
+    for bt in blood_types:
+        total = int(totals.get(bt, 0))
+        status, _label, pct = compute_bag(total, BAG_MAX)
+        dist = products_of(bt)
+        dist["Cryo"] = cryo
+        bags.append(
+            {"bt": bt, "total": total, "pct": pct, "status": status, "color": bag_color(status), "dist": dist}
+        )
+    return {
+        "bags": bags,
+        "bag_max": BAG_MAX,
+        "critical_max": CRITICAL_MAX,
+        "yellow_max": YELLOW_MAX,
+        "products": ALL_PRODUCTS_UI,
+    }
 
 
-def bag_card_html(bt: str, total: int) -> str:
+def kiosk_snapshot() -> dict:
     """
-    การ์ดถุงเลือด + มินิกราฟแท่ง (Overlay ทับหน้าถุงเวลา hover)
+    snapshot ของโหมด kiosk: อ่านยอดทุกกรุ๊ปใหม่เฉพาะเมื่อ get_stock_version() เปลี่ยน
+    rerun จาก autorefresh ที่ค่าเท่าเดิมจึงส่ง snapshot เดิม (component ไม่วาดใหม่)
     """
-    bag_html = bag_svg(bt, total)
-
-    # ดึงจำนวนแยกตาม product ของกรุ๊ปนั้น ๆ
-    dist_bt = products_of(bt)
-    dist_bt["Cryo"] = get_global_cryo()
-    mini_panel = mini_bar_panel_html(dist_bt)
-
-    return f"""
-<style>
-.bag-card {{
-    position: relative;
-    display: flex;
-    flex-direction: column;
-    align-items: center;
-    margin-bottom: 4px;
-    font-family: system-ui, -apple-system, BlinkMacSystemFont, "Segoe UI", sans-serif;
-}}
-.bag-card .bag-wrap {{
-    position: relative;
-    z-index: 1;
-}}
-.mini-bar-panel {{
-    position: absolute;
-    left: 50%;
-    top: 118px;  /* ให้ทับช่วงล่างของถุงเลือด */
-    transform: translateX(-50%) translateY(14px) scale(0.96);
-    width: 82%;
-    max-width: 210px;
-    background: rgba(255,255,255,0.98);
-    border-radius: 18px;
-    padding: 6px 10px 8px;
-    box-shadow: 0 18px 40px rgba(15,23,42,0.22);
-    opacity: 0;
-    pointer-events: none;
-    transition: opacity .18s ease, transform .18s ease;
-    z-index: 3;
-}}
-.bag-card:hover .mini-bar-panel {{
-    opacity: 1;
-    transform: translateX(-50%) translateY(0px) scale(1);
-}}
-.mini-bar-title {{
-    font-size: 0.68rem;
-    color: #4b5563;
-    text-align: center;
-    letter-spacing: .04em;
-    font-weight: 600;
-}}
-.mini-bar-bars {{
-    margin-top: 4px;
-    display: flex;
-    align-items: flex-end;
-    justify-content: space-between;
-    gap: 6px;
-}}
-.mini-bar-col {{
-    flex: 1;
-    display: flex;
-    flex-direction: column;
-    align-items: center;
-}}
-.mini-bar-inner-wrap {{
-    width: 16px;
-    height: 56px;
-    border-radius: 999px;
-    background: #f3f4f6;
-    display: flex;
-    align-items: flex-end;
-    overflow: hidden;
-}}
-.mini-bar-inner {{
-    width: 100%;
-    border-radius: 999px 999px 0 0;
-}}
-.mini-bar-val {{
-    margin-top: 2px;
-    font-size: 0.65rem;
-    font-weight: 600;
-    color: #111827;
-}}
-.mini-bar-label {{
-    font-size: 0.62rem;
-    color: #6b7280;
-}}
-</style>
-
-<div class="bag-card">
-  {bag_html}
-  {mini_panel}
-</div>
-"""
+    ss = st.session_state
+    ver = get_stock_version()
+    if ss.get("kiosk_snap") is None or ss.get("kiosk_version") != ver:
+        snap = dashboard_snapshot(totals_overview(), ["A", "B", "O", "AB"])
+        ss["kiosk_snap"] = dict(snap, kiosk=True)
+        ss["kiosk_version"] = ver
+        ss["kiosk_changed_at"] = datetime.now()
+    return ss["kiosk_snap"]
 
 
-def totals_overview():
-    ov = get_all_status()
-    return {d["blood_type"]: int(d.get("total", 0)) for d in ov}
+def stock_snapshot():
+    """
+    snapshot สำหรับ substitution engine
+    คืน (levels {(group, component_ui): units}, earliest_exp {(group, component_ui): date})
+    """
+    levels, earliest = {}, {}
+    idx = fefo_index()
+    for bt in ["A", "B", "O", "AB"]:
+        for comp, units in products_of(bt).items():
+            if comp not in COMPAT:
+                continue
+            levels[(bt, comp)] = units
+            top = idx.suggest(bt, comp, k=1)
+            if top:
+                earliest[(bt, comp)] = top[0][1]
+    return levels, earliest
 
 
-def products_of(bt):
-    return normalize_products(get_stock_by_blood(bt))
+def render_substitution_plan(lines):
+    """แสดงแผนจ่ายด้วยกรุ๊ปทดแทนสำหรับ lines [(group, component_ui, qty)]"""
+    levels, earliest = stock_snapshot()
+    for p in plan_order(lines, levels, earliest):
+        alloc = ", ".join(f"{g} × {n}" for g, n in p["allocations"]) or "-"
+        short = f" — ยังขาด {p['short']}" if p["short"] else ""
+        st.markdown(f"- **{p['group']} {p['component']} × {p['qty']}** → {alloc}{short}")
 
 
 def apply_stock_change(group, component_ui, qty, note, actor):
@@ -869,6 +430,21 @@ def apply_stock_change(group, component_ui, qty, note, actor):
     adjust_stock(group, UI_TO_DB[component_ui], qty, actor=actor, note=note)
 
 
+def apply_stock_order(lines, note, actor):
+    """
+    จ่ายออกหลายรายการแบบ all-or-nothing
+    lines: list ของ (group, component_ui, qty) -> คืน {(group, component_ui): คงเหลือ}
+    """
+    if any(comp == "Cryo" for _g, comp, _q in lines):
+        raise ValueError("Cryo cannot be directly adjusted.")
+    left = issue_order(
+        [(g, UI_TO_DB[comp], q) for g, comp, q in lines],
+        actor=actor,
+        note=note,
+    )
+    return {(g, DB_TO_UI.get(pt, pt)): units for (g, pt), units in left.items()}
+
+
 def add_activity(action, bt, product_ui, qty, note):
     st.session_state["activity"].insert(
         0,
@@ -884,26 +460,198 @@ def add_activity(action, bt, product_ui, qty, note):
     )
 
 
-def auto_update_booking_to_release():
+# ------- entries <-> ตาราง units ใน DB (ใช้ร่วมทุกเซสชัน, ปล่อยจอง / ตั้ง Exp โดย scheduler.py) -------
+# คอลัมน์ units (db.UNIT_COLS) -> คอลัมน์ entries
+_UNIT_FIELDS = dict(zip(UNIT_COLS, ["created_at", "Exp date", "Unit number", "Group", "Blood Components", "Status", "บันทึก"]))
+
+
+def entries_from_units(rows):
+    """แถวจาก get_units() -> entries (index = id ของแถวใน DB)"""
+    df = pd.DataFrame(rows, columns=["id", *UNIT_COLS]).set_index("id").rename(columns=_UNIT_FIELDS)
+    df.index.name = None
+    df["Unit number"] = df["Unit number"].fillna("")
+    df["บันทึก"] = df["บันทึก"].fillna("")
+    return coerce_entry_types(df[ENTRY_COLS])
+
+
+def units_from_entries(df, with_id: bool = False):
+    """
+    entries -> list ของ tuple ตามลำดับ db.UNIT_COLS (วันที่เป็น ISO, ค่าว่างเป็น None)
+    with_id: นำ index (id ใน DB, None/NaN = แถวใหม่) ขึ้นหน้า tuple สำหรับ replace_units
+    """
+    out = pd.DataFrame({u: df[e] for u, e in _UNIT_FIELDS.items()})
+    for c in ("created_at", "exp_date"):
+        out[c] = out[c].dt.strftime("%Y-%m-%d")
+    out = out.astype(object)
+    out = out.where(out.notna(), None)
+    if with_id:
+        out.insert(0, "id", [None if pd.isna(i) else int(i) for i in df.index])
+    return list(out.itertuples(index=False, name=None))
+
+
+def load_entries(force: bool = False):
+    """โหลด entries จาก DB เมื่อเวอร์ชันเปลี่ยน (เซสชันอื่นบันทึก / scheduler ปล่อยจอง / ตั้ง Exp)"""
+    ss = st.session_state
+    try:
+        ver = _cached_read("units_version", get_units_version)
+        if force or ss.get("entries_ver") != ver:
+            ver, rows = get_units()
+            ss["entries"] = entries_from_units(rows)
+            ss["entries_ver"] = ver
+    except sqlite3.OperationalError:
+        # replica จาก DB รุ่นเก่าที่ยังไม่มีตาราง units: ใช้ entries ของเซสชันไปก่อน
+        pass
+
+
+def _track_version(ver):
+    """หลังเขียนเอง: version +1 พอดี = ไม่มีใครเขียนแทรก ไม่ต้องโหลดใหม่ ไม่เช่นนั้นโหลดใหม่รอบถัดไป"""
+    ss = st.session_state
+    ss["entries_ver"] = ver if ss.get("entries_ver") == ver - 1 else None
+
+
+def save_entries(df, check: bool = True) -> bool:
+    """
+    บันทึก entries ทั้งตาราง (แก้ในตาราง / นำเข้าไฟล์) แล้วโหลดกลับ (แถวใหม่ได้ id)
+    index ของ df = id ใน DB (None / NaN = แถวใหม่)
+    check: ถ้ามีผู้อื่นแก้ตั้งแต่โหลดมา จะไม่เขียนทับ โหลดข้อมูลล่าสุดแทนแล้วคืน False
+    """
+    try:
+        replace_units(units_from_entries(df, with_id=True), expected_version=st.session_state.get("entries_ver") if check else None)
+    except UnitsConflictError:
+        load_entries(force=True)
+        flash("ตารางถูกแก้จากที่อื่นระหว่างนี้ โหลดข้อมูลล่าสุดแล้ว กรุณาแก้ไขอีกครั้ง", "error")
+        return False
+    load_entries(force=True)
+    return True
+
+
+def fefo_index():
+    """FEFO index ของเซสชัน (สร้างใหม่เมื่อ entries ถูกแทนที่ด้วย DataFrame ใหม่)"""
+    ss = st.session_state
+    if ss.get("fefo") is None or ss.get("fefo_src") is not ss["entries"]:
+        ss["fefo"] = FefoIndex.from_entries(ss["entries"])
+        ss["fefo_src"] = ss["entries"]
+    return ss["fefo"]
+
+
+def _set_entries(df):
+    """แทนที่ entries โดยไม่ต้องสร้าง FEFO index ใหม่ (ผู้เรียกอัปเดต index เองแล้ว)"""
+    st.session_state["entries"] = df
+    st.session_state["fefo_src"] = df
+
+
+def _mark_units_status(unit_numbers, group, component_ui, status):
+    """เปลี่ยนสถานะแถวที่ (Unit number, กรุ๊ป, ผลิตภัณฑ์) ตรงกัน คืน (entries ใหม่, จำนวนแถวที่เปลี่ยน)"""
+    df = st.session_state["entries"].copy()
+    mask = (
+        df["Unit number"].map(normalize_unit_number).isin([normalize_unit_number(u) for u in unit_numbers])
+        & (df["Group"] == group)
+        & (df["Blood Components"] == component_ui)
+    )
+    if mask.any():
+        _track_version(update_unit_status(df.index[mask], status))
+    df.loc[mask, "Status"] = status
+    return df, int(mask.sum())
+
+
+def issue_fefo_units(group, component_ui, qty, note, actor):
+    """
+    จ่ายออก qty หน่วยโดยเลือกหน่วยที่หมดอายุก่อน (FEFO) จาก index
+    ตัดสต็อก แล้วเปลี่ยนสถานะหน่วยเหล่านั้นในตารางเป็น "จ่ายแล้ว"
+    คืน list ของ Unit number ที่จ่าย หรือ [] ถ้าหน่วยพร้อมจ่ายไม่พอ
+    """
+    idx = fefo_index()
+    picked = []
+    for _ in range(int(qty)):
+        u = idx.reserve(group, component_ui)
+        if u is None:
+            break
+        picked.append(u)
+
+    def _put_back():
+        for unit, exp in picked:
+            idx.add(unit, group, component_ui, exp)
+
+    if len(picked) < int(qty):
+        _put_back()
+        return []
+    units = [u for u, _exp in picked]
+    try:
+        apply_stock_change(group, component_ui, -len(units), note or f"FEFO: {', '.join(units)}", actor)
+    except Exception:
+        _put_back()
+        raise
+    _set_entries(_mark_units_status(units, group, component_ui, "จ่ายแล้ว")[0])
+    return units
+
+
+def scan_matches(unit_number, group=None):
+    """
+    index ของแถวใน entries ที่ Unit number ตรงกัน (ค้นจาก idx_units_unit_key ใน DB ไม่ไล่ทั้งตาราง)
+    DIN เดียวกันมีได้หลาย component: ถ้าระบุ group (จากฉลาก) จะกรองด้วยกรุ๊ปก่อน
+    ไม่มีแถวไหนกรุ๊ปตรงเลย -> คืนทุกแถว ให้หน้าจอแจ้งว่ากรุ๊ปบนฉลากไม่ตรง
+    """
     df = st.session_state["entries"]
-    if df.empty:
-        return
-    today = date.today()
-    updated_any = False
-    for i, row in df.iterrows():
-        try:
-            if str(row.get("Status", "")) == "จอง":
-                d = pd.to_datetime(row.get("created_at", ""), errors="coerce")
-                if pd.isna(d):
-                    continue
-                if (today - d.date()).days >= 3:
-                    df.at[i, "Status"] = "หลุดจอง"
-                    df.at[i, "สถานะ(สี)"] = STATUS_COLOR["หลุดจอง"]
-                    updated_any = True
-        except Exception:
-            pass
-    if updated_any:
-        st.session_state["entries"] = df
+    ids = [r["id"] for r in find_units(unit_number) if r["id"] in df.index]
+    if group:
+        ids = [i for i in ids if str(df.at[i, "Group"]) == group] or ids
+    return ids
+
+
+def transition_unit(unit_id, new_status, actor):
+    """
+    เปลี่ยนสถานะหน่วยเลือดรายหน่วย (โหมดสแกน) พร้อมปรับสต็อกตามการเข้า/ออกจากคลัง (IN_STOCK_STATUSES)
+    unit_id = index ของแถวใน entries (id ใน DB) แก้แถวแบบ in-place (O(1)) คืน (สถานะเดิม, แถวหลังแก้)
+    """
+    df = st.session_state["entries"]
+    if unit_id not in df.index:
+        raise KeyError(f"ไม่พบหน่วยเลือด id {unit_id}")
+    i = unit_id
+    idx = fefo_index()
+    key = normalize_unit_number(df.at[i, "Unit number"])
+    old = str(df.at[i, "Status"])
+    group, comp = str(df.at[i, "Group"]), str(df.at[i, "Blood Components"])
+    if old == new_status:
+        return old, df.loc[i]
+
+    # จอง / หลุดจอง ไม่ย้ายสต็อก (เหมือนฟอร์มบันทึกและ release_stale_bookings) ปรับเฉพาะเข้า / ออกจากคลัง
+    delta = int(new_status in IN_STOCK_STATUSES) - int(old in IN_STOCK_STATUSES)
+    if delta:
+        apply_stock_change(group, comp, delta, f"{key}: {old} → {new_status}", actor)
+    _track_version(update_unit_status([i], new_status))
+    df.at[i, "Status"] = new_status
+    if new_status in AVAILABLE_STATUSES:
+        idx.add(df.at[i, "Unit number"], group, comp, df.at[i, "Exp date"])
+    else:
+        idx.discard(df.at[i, "Unit number"], group, comp)
+    add_activity("SCAN", group, comp, delta, f"{key}: {old} → {new_status}")
+    return old, df.loc[i]
+
+
+def _scan_transition(new_status):
+    ss = st.session_state
+    info = parse_scan(ss.get("scan_code", ""))
+    try:
+        matches = scan_matches(info["unit_number"], info["group"])
+        if not matches:
+            raise KeyError(f"ไม่พบ Unit number {info['unit_number']}")
+        # DIN เดียวกันหลาย component: ใช้หน่วยที่เลือกไว้บนหน้าจอ
+        unit_id = matches[0] if len(matches) == 1 else ss.get("scan_pick")
+        if unit_id not in matches:
+            raise KeyError(f"{info['unit_number']} มีหลายหน่วย กรุณาเลือกหน่วยก่อน")
+        old, _row = transition_unit(unit_id, new_status, ss.get("username") or "admin")
+        flash(f"{info['unit_number']}: {old} → {new_status} ✅")
+        ss["scan_code"] = ""
+    except Exception as e:
+        flash(f"เปลี่ยนสถานะไม่สำเร็จ: {e}", "error")
+
+
+def _on_scan_cmd():
+    ss = st.session_state
+    cmd = (ss.get("scan_cmd") or "").strip().upper()[:1]
+    ss["scan_cmd"] = ""
+    if cmd in SCAN_KEYS:
+        _scan_transition(SCAN_KEYS[cmd])
 
 
 def left_days_safe(d):
@@ -960,8 +708,37 @@ def render_minimal_banner(df):
 # ==========================================
 # INIT DB
 # ==========================================
-if not os.path.exists(os.environ.get("BLOOD_DB_PATH", "blood.db")):
+@st.cache_resource(show_spinner=False)
+def _init_db_once(db_path: str):
+    # ต้องรันกับ DB เดิมด้วย (เพิ่มคอลัมน์ version ให้ตาราง stock) แต่ครั้งเดียวต่อ process
     init_db()
+    return True
+
+
+@st.cache_resource(show_spinner=False)
+def _start_scheduler(db_path: str):
+    # thread เดียวต่อ process: ปล่อยจองเกิน 3 วัน / ตั้ง Exp (แทนการวนตรวจทุกเซสชันตอน render)
+    return default_scheduler().start()
+
+
+if not READ_ONLY:
+    _init_db_once(os.environ.get("BLOOD_DB_PATH", "blood.db"))
+    _start_scheduler(os.environ.get("BLOOD_DB_PATH", "blood.db"))
+
+
+# ==========================================
+# KIOSK (?kiosk=1): จอแสดงผลติดผนัง ไม่มีเมนู / ไม่มี animation
+# ==========================================
+if URL_KIOSK:
+    st_autorefresh(interval=KIOSK_REFRESH_MS, key="kiosk_refresh")
+    _snap = kiosk_snapshot()
+    st.title("Blood Stock Real-time Monitor")
+    st.caption(f"ยอดเปลี่ยนล่าสุด: {st.session_state['kiosk_changed_at'].strftime('%d/%m/%Y %H:%M:%S')}")
+    dashboard_grid(_snap, key="kiosk_grid", clickable=False)
+    _profile_end()
+    st.stop()
+
+load_entries()
 
 
 # ==========================================
@@ -979,6 +756,9 @@ with st.sidebar:
     if st.button("กรอกเลือด", key="nav_entry"):
         st.session_state["page"] = "กรอกเลือด"
         _safe_rerun()
+    if st.button("รายงาน", key="nav_reports"):
+        st.session_state["page"] = "รายงาน"
+        _safe_rerun()
 
     if not st.session_state["logged_in"]:
         if st.button("เข้าสู่ระบบ", key="nav_login"):
@@ -993,6 +773,22 @@ with st.sidebar:
             flash("ออกจากระบบแล้ว", "info")
             _safe_rerun()
 
+        with st.expander("โปรไฟล์ความเร็ว"):
+            n_prof = st.number_input("จำนวน rerun", min_value=1, max_value=50, value=3, key="profile_n")
+            if st.button("โปรไฟล์ rerun ถัดไป", key="profile_start"):
+                st.session_state["profile_left"] = int(n_prof)
+                _safe_rerun()
+            if st.session_state.get("profile_left", 0) > 0:
+                st.caption(f"เหลืออีก {st.session_state['profile_left']} rerun")
+            _last = st.session_state.get("profile_last")
+            if _last:
+                _b = _last["buckets"]
+                st.caption(
+                    f"ล่าสุด {_last['wall_s'] * 1000:.0f} ms · db {_b['db'] * 1000:.0f} · "
+                    f"render {_b['render'] * 1000:.0f} · app {_b['app'] * 1000:.0f} · อื่น ๆ {_b['other'] * 1000:.0f} ms"
+                )
+                st.caption(f"ไฟล์: {_last['path']}.prof / .folded / .txt")
+
 
 # ==========================================
 # HEADER (ซ่อนเวลาหน้าเข้าสู่ระบบ)
@@ -1187,6 +983,8 @@ if (btns.length >= 2) {
 elif st.session_state["page"] == "กรอกเลือด":
     if not st.session_state["logged_in"]:
         st.warning("ต้องเข้าสู่ระบบก่อนจึงจะใช้งานเมนูนี้ได้")
+    elif READ_ONLY:
+        st.info("อินสแตนซ์นี้เป็นจอแสดงผล (replica อ่านอย่างเดียว) — บันทึก/ปรับคลังได้ที่ระบบหลัก")
     else:
         st.subheader("กรอกข้อมูลถุงเลือด / นำเข้าข้อมูลจากไฟล์")
 
@@ -1208,23 +1006,48 @@ elif st.session_state["page"] == "กรอกเลือด":
                 note = st.text_input("บันทึก")
             submitted = st.form_submit_button("บันทึกรายการ", use_container_width=True)
 
-        if submitted:
+        if submitted and status == "จ่ายแล้ว" and not unit_number.strip() and fefo_index().suggest(group, component):
+            # ไม่ระบุ Unit number: จ่ายหน่วยที่หมดอายุก่อน (FEFO) จากหน่วยที่มีอยู่ในตาราง
+            try:
+                issued = issue_fefo_units(
+                    group, component, 1, note, st.session_state.get("username") or "admin"
+                )
+                add_activity("OUTBOUND", group, component, -1, f"FEFO {issued[0]} {note}".strip())
+                flash(f"จ่ายหน่วย {issued[0]} (FEFO) แล้ว ✅")
+            except Exception as e:
+                st.error(f"ปรับคลังไม่สำเร็จ: {e}")
+            _safe_rerun()
+
+        elif submitted:
+            idx = fefo_index()
             new_row = {
-                "created_at": datetime.now().strftime("%Y/%m/%d"),
-                "Exp date": exp_date.strftime("%Y/%m/%d"),
+                "created_at": pd.Timestamp(date.today()),
+                "Exp date": pd.Timestamp(exp_date),
                 "Unit number": unit_number,
                 "Group": group,
                 "Blood Components": component,
                 "Status": status,
-                "สถานะ(สี)": STATUS_COLOR.get(status, status),
                 "บันทึก": note,
             }
-            st.session_state["entries"] = pd.concat(
-                [st.session_state["entries"], pd.DataFrame([new_row])],
-                ignore_index=True,
-            )
+            existing = False
+            if status not in AVAILABLE_STATUSES and (unit_number, group, component) in idx:
+                # หน่วยนี้ (Unit number + กรุ๊ป + ผลิตภัณฑ์) มีอยู่ในตารางแล้ว: เปลี่ยนสถานะแถวเดิมแทนการเพิ่มแถวซ้ำ
+                marked, n = _mark_units_status([unit_number], group, component, status)
+                existing = n > 0
+                if existing:
+                    idx.discard(unit_number, group, component)
+                    _set_entries(marked)
+            if not existing:
+                if status in AVAILABLE_STATUSES:
+                    idx.add(unit_number, group, component, exp_date)
+                new_df = coerce_entry_types(pd.DataFrame([new_row]))
+                ids, ver = insert_units(units_from_entries(new_df))
+                new_df.index = ids
+                _set_entries(coerce_entry_types(pd.concat([st.session_state["entries"], new_df])))
+                _track_version(ver)
             try:
-                if status in ["ว่าง", "หลุดจอง"]:
+                # แถวใหม่ที่อยู่ในคลัง (รวมหน่วยที่รับเข้าแล้วจองทันที) = รับเข้า; จองหน่วยเดิมไม่กระทบคลัง
+                if status in IN_STOCK_STATUSES and not existing:
                     apply_stock_change(
                         group, component, +1, note or "inbound", st.session_state.get("username") or "admin"
                     )
@@ -1241,8 +1064,139 @@ elif st.session_state["page"] == "กรอกเลือด":
                 st.error(f"ปรับคลังไม่สำเร็จ: {e}")
             _safe_rerun()
 
+        st.markdown("### 🧊 หน่วยที่ควรจ่ายก่อน (FEFO)")
+        fc1, fc2, fc3 = st.columns([1, 1, 2])
+        with fc1:
+            fefo_group = st.selectbox("Group", ["A", "B", "O", "AB"], key="fefo_group")
+        with fc2:
+            fefo_comp = st.selectbox("Blood Components", ["LPRC", "PRC", "FFP", "PC"], key="fefo_comp")
+        fefo_top = fefo_index().suggest(fefo_group, fefo_comp, k=5)
+        with fc3:
+            if fefo_top:
+                st.dataframe(
+                    pd.DataFrame(
+                        [
+                            {"Unit number": u, "Exp date": e, "เหลือ (วัน)": (e - date.today()).days}
+                            for u, e in fefo_top
+                        ]
+                    ),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+            else:
+                st.info("ไม่มีหน่วยพร้อมจ่ายสำหรับกรุ๊ป/ผลิตภัณฑ์นี้")
+        if fefo_top and st.button(
+            f"จ่ายหน่วยแรก {fefo_top[0][0]} (FEFO)", key="fefo_issue_btn", use_container_width=True
+        ):
+            try:
+                issued = issue_fefo_units(
+                    fefo_group, fefo_comp, 1, "", st.session_state.get("username") or "admin"
+                )
+                add_activity("OUTBOUND", fefo_group, fefo_comp, -1, f"FEFO {issued[0]}")
+                flash(f"จ่ายหน่วย {issued[0]} (FEFO) แล้ว ✅")
+                _safe_rerun()
+            except Exception as e:
+                st.error(f"ปรับคลังไม่สำเร็จ: {e}")
+        n_expired = len(fefo_index().expired())
+        if n_expired:
+            st.warning(f"มี {n_expired} หน่วยที่เลยวันหมดอายุแต่สถานะยังพร้อมจ่าย — ควรเปลี่ยนเป็น Exp")
+
+        st.markdown("### 🔫 สแกนบาร์โค้ดหน่วยเลือด")
+        sc1, sc2 = st.columns([3, 1])
+        with sc1:
+            scan_code = st.text_input("สแกน / พิมพ์ Unit number (รองรับ ISBT 128)", key="scan_code")
+        with sc2:
+            st.text_input(
+                "คำสั่ง (I/B/X/A)",
+                key="scan_cmd",
+                max_chars=1,
+                on_change=_on_scan_cmd,
+                help="I = จ่ายแล้ว, B = จอง, X = Exp, A = ว่าง",
+            )
+        if scan_code.strip():
+            scan = parse_scan(scan_code)
+            matches = scan_matches(scan["unit_number"], scan["group"])
+            row_i = matches[0] if matches else None
+            if len(matches) > 1:
+                ent = st.session_state["entries"]
+                row_i = st.radio(
+                    "Unit number นี้มีหลายหน่วย เลือกหน่วยที่สแกน",
+                    matches,
+                    format_func=lambda i: f"{ent.at[i, 'Blood Components']} · กรุ๊ป {ent.at[i, 'Group']} · "
+                    f"Exp {fmt_date(ent.at[i, 'Exp date'])} · {ent.at[i, 'Status']}",
+                    key="scan_pick",
+                    horizontal=True,
+                )
+            if row_i is None:
+                st.warning(f"ไม่พบ Unit number {scan['unit_number']} ในตาราง")
+            else:
+                row = st.session_state["entries"].loc[row_i]
+                days = left_days_safe(row["Exp date"])
+                st.markdown(
+                    f"**{row['Unit number']}** — กรุ๊ป **{row['Group']}** · {row['Blood Components']} · "
+                    f"Exp {fmt_date(row['Exp date'])} ({expiry_label(days) or '-'}) · สถานะ **{STATUS_COLOR.get(row['Status'], row['Status'])}**"
+                )
+                if scan["group"] and scan["group"] != str(row["Group"]):
+                    st.error(f"กรุ๊ปบนฉลาก ({scan['group']}) ไม่ตรงกับในระบบ ({row['Group']})")
+                btn_cols = st.columns(len(SCAN_KEYS))
+                for bc, (k, stt) in zip(btn_cols, SCAN_KEYS.items()):
+                    with bc:
+                        st.button(
+                            f"{stt} [{k}]",
+                            key=f"scan_btn_{k}",
+                            on_click=_scan_transition,
+                            args=(stt,),
+                            use_container_width=True,
+                        )
+
+        st.markdown("### 📦 เบิกหลายรายการในคำสั่งเดียว (Cross-match / MTP)")
+        with st.form("issue_order_form", clear_on_submit=True):
+            oc1, oc2 = st.columns(2)
+            with oc1:
+                order_group = st.selectbox("Group", ["A", "B", "O", "AB"], key="order_group")
+            with oc2:
+                order_note = st.text_input("บันทึก (เช่น ward / HN)", key="order_note")
+            qty_cols = st.columns(4)
+            order_qty = {}
+            for qc, comp in zip(qty_cols, ["LPRC", "PRC", "FFP", "PC"]):
+                with qc:
+                    order_qty[comp] = st.number_input(comp, min_value=0, step=1, value=0, key=f"order_{comp}")
+            order_submitted = st.form_submit_button("จ่ายออกทั้งคำสั่ง", use_container_width=True)
+
+        if order_submitted:
+            lines = [(order_group, comp, int(q)) for comp, q in order_qty.items() if q]
+            if not lines:
+                st.warning("ยังไม่ได้ระบุจำนวนที่จะจ่าย")
+            else:
+                try:
+                    left = apply_stock_order(
+                        lines, order_note or "order", st.session_state.get("username") or "admin"
+                    )
+                    for g, comp, q in lines:
+                        add_activity("OUTBOUND", g, comp, -q, order_note or "order")
+                    summary = ", ".join(f"{comp} เหลือ {left[(g, comp)]}" for g, comp, _q in lines)
+                    flash(f"จ่ายออกทั้งคำสั่งแล้ว ✅ ({order_group}: {summary})")
+                    _safe_rerun()
+                except InsufficientStockError as e:
+                    st.error(
+                        "สต็อกไม่พอ ไม่มีการตัดยอดใด ๆ: "
+                        + ", ".join(
+                            f"{bt} {DB_TO_UI.get(pt, pt)} ต้องการ {req} มี {avail}"
+                            for bt, pt, req, avail in e.shortages
+                        )
+                    )
+                    st.markdown("**แผนจ่ายด้วยกรุ๊ปที่เข้ากันได้ (ABO)**")
+                    render_substitution_plan(lines)
+                except Exception as e:
+                    st.error(f"ปรับคลังไม่สำเร็จ: {e}")
+
         st.markdown("### 📁 นำเข้าจาก Excel/CSV (อัปโหลดแล้วลงตารางอัตโนมัติ)")
-        up = st.file_uploader("เลือกไฟล์ (.xlsx, .xls, .csv)", type=["xlsx", "xls", "csv"], key="uploader_file")
+        ups = st.file_uploader(
+            "เลือกไฟล์ (.xlsx, .xls, .csv) เลือกได้หลายไฟล์",
+            type=["xlsx", "xls", "csv"],
+            accept_multiple_files=True,
+            key="uploader_file",
+        )
         mode_merge = st.radio(
             "โหมดนำเข้า",
             ["รวมกับตาราง (merge/update)", "แทนที่ทั้งหมด (replace)"],
@@ -1251,133 +1205,80 @@ elif st.session_state["page"] == "กรอกเลือด":
             key="uploader_mode",
         )
 
-        if up is not None:
-            token = (up.name, up.size)
-            if st.session_state.get("last_upload_token") != token:
-                st.session_state["last_upload_token"] = token
-
+        if ups:
+            # ตัวตนของไฟล์ = hash ของเนื้อหา; ไฟล์ที่ยังค้างใน uploader (file_id เดิม) ไม่ต้อง hash ซ้ำทุก rerun
+            fids = st.session_state["upload_fids"]
+            pending = []
+            for up in ups:
+                fid = getattr(up, "file_id", None)
+                digest = fids.get(fid) if fid is not None else None
+                if digest is None:
+                    digest = importer.hash_upload(up)
+                    if fid is not None:
+                        fids[fid] = digest
+                if digest not in st.session_state["upload_tokens"]:
+                    pending.append((up, digest))
+
+            if pending:
+                st.session_state["upload_tokens"].update(d for _up, d in pending)
                 try:
-                    if up.name.lower().endswith(".csv"):
-                        df_file = pd.read_csv(up)
-                    else:
-                        try:
-                            df_file = pd.read_excel(up)
-                        except Exception as e:
-                            st.error(
-                                "อ่าน Excel ไม่ได้ (อาจขาด openpyxl). "
-                                "แนะนำเพิ่ม openpyxl ใน requirements.txt หรืออัปโหลด CSV แทน"
-                            )
-                            st.info(str(e))
-                            df_file = pd.DataFrame()
-
-                    if not df_file.empty:
-                        col_map = {
-                            "created_at": "created_at",
-                            "Created": "created_at",
-                            "Created at": "created_at",
-                            "Exp date": "Exp date",
-                            "Exp": "Exp date",
-                            "exp_date": "Exp date",
-                            "Unit": "Unit number",
-                            "Unit number": "Unit number",
-                            "Group": "Group",
-                            "Blood Components": "Blood Components",
-                            "Components": "Blood Components",
-                            "Status": "Status",
-                            "Note": "บันทึก",
-                            "Remarks": "บันทึก",
-                            "บันทึก": "บันทึก",
-                        }
-                        df_file = df_file.rename(
-                            columns={c: col_map.get(str(c).strip(), c) for c in df_file.columns}
-                        )
-
-                        status_map_en2th = {
-                            "Available": "ว่าง",
-                            "ReadyToIssue": "จอง",
-                            "Released": "จ่ายแล้ว",
-                            "Expired": "Exp",
-                            "ReleasedExpired": "Exp",
-                            "Out": "จ่ายแล้ว",
-                        }
-                        if "Status" in df_file.columns:
-                            df_file["Status"] = df_file["Status"].map(
-                                lambda s: status_map_en2th.get(str(s).strip(), str(s).strip())
-                            )
-
-                        for c in ["created_at", "Exp date", "Unit number", "Group",
-                                  "Blood Components", "Status", "บันทึก"]:
-                            if c not in df_file.columns:
-                                df_file[c] = ""
-                        df_file = df_file[
-                            ["created_at", "Exp date", "Unit number", "Group",
-                             "Blood Components", "Status", "บันทึก"]
-                        ].copy()
-
-                        df_file["สถานะ(สี)"] = df_file["Status"].map(
-                            lambda s: STATUS_COLOR.get(str(s), str(s))
+                    # ไฟล์ที่เคยอ่านแล้ว (เซสชันไหนก็ได้) มาจาก cache ที่เหลือ parse พร้อมกันใน process pool
+                    results = importer.load_many(
+                        [(up.name, up.getvalue()) for up, _d in pending],
+                        digests=[d for _up, d in pending],
+                    )
+                    bad = [(name, err) for name, _d, err, _hit in results if isinstance(err, Exception)]
+                    if any(importer.file_kind(name) == "excel" for name, _err in bad):
+                        st.error(
+                            "อ่าน Excel ไม่ได้ (อาจขาด openpyxl). "
+                            "แนะนำเพิ่ม openpyxl ใน requirements.txt หรืออัปโหลด CSV แทน"
                         )
+                    for name, err in bad:
+                        st.info(f"{name}: {err}")
+
+                    # รวมทุกไฟล์เป็นชุดเดียว (เรียงตามชื่อไฟล์ แถว key ซ้ำเก็บแถวหลังสุด)
+                    batch, n_raw = importer.merge_batch(results)
+                    if not batch.empty:
+                        # parse วันที่ทั้งคอลัมน์ครั้งเดียว (ไม่มี created_at = วันนี้)
+                        batch = coerce_entry_types(batch)
+                        batch["created_at"] = batch["created_at"].fillna(pd.Timestamp(date.today()))
+                        for c, default in (("Group", "A"), ("Blood Components", "LPRC"), ("Status", "ว่าง")):
+                            col = batch[c].astype("string").str.strip().fillna("")
+                            batch[c] = col.mask(col == "", default)
+                        batch["บันทึก"] = batch["บันทึก"].astype("string").str.strip().fillna("")
+                        batch["Unit number"] = batch["Unit number"].fillna("").astype(str)
+                        new_df = coerce_entry_types(batch[ENTRY_COLS].copy())
+
+                        # หน่วยที่อยู่ในคลัง (รวมหน่วยที่จองไว้) รับเข้าสต็อก รวมต่อกรุ๊ป/ผลิตภัณฑ์ (Cryo / ผลิตภัณฑ์ที่ไม่รู้จักปรับไม่ได้)
+                        inbound = new_df[new_df["Status"].isin(IN_STOCK_STATUSES)]
+                        counts = inbound.groupby(["Group", "Blood Components"], observed=True).size()
+                        stock_in, failed = {}, 0
+                        for (g, comp), n in counts.items():
+                            if comp in UI_TO_DB:
+                                stock_in[(g, UI_TO_DB[comp])] = int(n)
+                            else:
+                                failed += int(n)
+                        applied = len(new_df) - failed
 
                         replace_mode = mode_merge.startswith("แทนที่")
+                        actor = st.session_state.get("username") or "admin"
+                        # หน่วย + สต็อก + log ทั้งชุดใน transaction เดียว
+                        import_units(
+                            units_from_entries(new_df),
+                            stock_in,
+                            actor=actor,
+                            note=f"import {len(pending)} ไฟล์",
+                            replace=replace_mode,
+                        )
                         if replace_mode:
-                            st.session_state["entries"] = pd.DataFrame(columns=ENTRY_COLS)
                             st.session_state["activity"] = []
-                            reset_all_stock(st.session_state.get("username", "admin"))
-
-                        new_rows = []
-                        applied = failed = 0
-
-                        for _, r in df_file.iterrows():
-                            g = str(r["Group"]).strip() or "A"
-                            comp = str(r["Blood Components"]).strip() or "LPRC"
-                            stt = str(r["Status"]).strip() or "ว่าง"
-                            nt = str(r["บันทึก"]).strip()
-
-                            row_dict = {
-                                "created_at": str(
-                                    r["created_at"] or datetime.now().strftime("%Y/%m/%d")
-                                ),
-                                "Exp date": str(r["Exp date"] or ""),
-                                "Unit number": str(r["Unit number"] or ""),
-                                "Group": g,
-                                "Blood Components": comp,
-                                "Status": stt,
-                                "สถานะ(สี)": STATUS_COLOR.get(stt, stt),
-                                "บันทึก": nt,
-                            }
-                            new_rows.append(row_dict)
-
-                            try:
-                                if stt in ["ว่าง", "หลุดจอง"]:
-                                    apply_stock_change(
-                                        g, comp, +1, nt or "import", st.session_state.get("username") or "admin"
-                                    )
-                                    add_activity("INBOUND", g, comp, +1, f"import: {nt}")
-                                elif stt in ["จ่ายแล้ว"]:
-                                    add_activity("OUTBOUND", g, comp, 0, f"import: {nt}")
-                                else:
-                                    add_activity("INFO", g, comp, 0, f"import: {nt}")
-                                applied += 1
-                            except Exception:
-                                failed += 1
-
-                        new_df = pd.DataFrame(new_rows, columns=ENTRY_COLS)
-
-                        if replace_mode:
-                            st.session_state["entries"] = new_df
-                        else:
-                            combined = pd.concat(
-                                [st.session_state["entries"], new_df],
-                                ignore_index=True,
-                            )
-                            combined = combined.drop_duplicates(
-                                subset=["Unit number", "Group", "Blood Components"],
-                                keep="last",
-                            )
-                            st.session_state["entries"] = combined
+                        for (g, pt), n in stock_in.items():
+                            add_activity("INBOUND", g, DB_TO_UI.get(pt, pt), n, f"import {len(pending)} ไฟล์")
+                        load_entries(force=True)
 
                         flash(
-                            f"นำเข้าเสร็จสิ้น ✅ สำเร็จ {applied} รายการ"
+                            f"นำเข้าเสร็จสิ้น ✅ {len(pending) - len(bad)} ไฟล์ สำเร็จ {applied} รายการ"
+                            f"{' (ซ้ำ '+str(n_raw - len(new_df))+')' if n_raw > len(new_df) else ''}"
                             f"{' (ล้มเหลว '+str(failed)+')' if failed else ''}"
                         )
 
@@ -1387,12 +1288,14 @@ elif st.session_state["page"] == "กรอกเลือด":
         st.markdown("### ตารางสรุป (แก้ไขได้)")
         df_vis = st.session_state["entries"].copy(deep=True)
 
-        parsed = pd.to_datetime(df_vis["Exp date"], errors="coerce")
-        df_vis["Exp date"] = parsed.dt.date
-
-        df_vis["_exp_days"] = df_vis["Exp date"].apply(left_days_safe)
+        # Exp date เป็น datetime64 อยู่แล้ว: นับวันแบบ vectorized ไม่ต้อง parse ทีละแถว
+        df_vis["_exp_days"] = (df_vis["Exp date"] - pd.Timestamp(date.today())).dt.days.astype("Int64")
         df_vis["วันหมดอายุนับถอยหลัง (วัน)"] = df_vis["_exp_days"]
-        df_vis["สถานะวันหมดอายุ"] = df_vis["_exp_days"].apply(expiry_label)
+        df_vis["สถานะวันหมดอายุ"] = df_vis["_exp_days"].map(
+            lambda d: expiry_label(None if pd.isna(d) else int(d))
+        )
+        # ป้ายสีคำนวณตอนแสดงผล (Categorical.map แปลงต่อ category ไม่ใช่ต่อแถว)
+        df_vis["สถานะ(สี)"] = df_vis["Status"].map(lambda s: STATUS_COLOR.get(s, s)).astype(str)
 
         render_minimal_banner(df_vis)
 
@@ -1408,13 +1311,15 @@ elif st.session_state["page"] == "กรอกเลือด":
             "สถานะ(สี)",
             "บันทึก",
         ]
-        df_vis = df_vis.reindex(columns=cols_show)
+        # id ใน DB เก็บในคอลัมน์ซ่อน: data_editor เพิ่มแถวได้เฉพาะเมื่อ index เป็น RangeIndex
+        df_vis["_id"] = df_vis.index
+        df_vis = df_vis.reindex(columns=cols_show + ["_id"]).reset_index(drop=True)
 
         df_vis.insert(0, "ลำดับ", range(1, len(df_vis) + 1))
 
         col_cfg = {
             "ลำดับ": st.column_config.NumberColumn("ลำดับ", disabled=True),
-            "created_at": st.column_config.TextColumn("Created at (YYYY/MM/DD)"),
+            "created_at": st.column_config.DateColumn("Created at", format="YYYY/MM/DD"),
             "Exp date": st.column_config.DateColumn("Exp date", format="YYYY/MM/DD"),
             "วันหมดอายุนับถอยหลัง (วัน)": st.column_config.NumberColumn(
                 "วันหมดอายุนับถอยหลัง (วัน)", disabled=True
@@ -1436,6 +1341,7 @@ elif st.session_state["page"] == "กรอกเลือด":
             use_container_width=True,
             hide_index=True,
             column_config=col_cfg,
+            column_order=["ลำดับ"] + cols_show,
             key="entries_editor",
         )
 
@@ -1443,26 +1349,10 @@ elif st.session_state["page"] == "กรอกเลือด":
             out = edited.copy()
             if "ลำดับ" in out.columns:
                 out = out.drop(columns=["ลำดับ"])
-
-            def _d2str(x):
-                try:
-                    if pd.isna(x):
-                        return ""
-                except Exception:
-                    pass
-                if isinstance(x, (datetime, pd.Timestamp)):
-                    return x.date().strftime("%Y/%m/%d")
-                if isinstance(x, date):
-                    return x.strftime("%Y/%m/%d")
-                try:
-                    return pd.to_datetime(x, errors="coerce").date().strftime("%Y/%m/%d")
-                except Exception:
-                    return str(x)
-
-            out["Exp date"] = out["Exp date"].apply(_d2str)
             keep = ENTRY_COLS
-            st.session_state["entries"] = out[keep].reset_index(drop=True)
-            flash("อัปเดตตารางแล้ว ✅")
+            out = out.set_index("_id")
+            if save_entries(coerce_entry_types(out[keep])):
+                flash("อัปเดตตารางแล้ว ✅")
             _safe_rerun()
 
 
@@ -1470,8 +1360,6 @@ elif st.session_state["page"] == "กรอกเลือด":
 # PAGE: แดชบอร์ดคลังเลือด
 # ==========================================
 elif st.session_state["page"] == "แดชบอร์ดคลังเลือด":
-    auto_update_booking_to_release()
-
     c1, c2, _ = st.columns(3)
     c1.markdown(
         '<span class="badge"><span class="legend-dot" style="background:#ef4444"></span> วิกฤตใกล้หมด 0–4</span>',
@@ -1484,14 +1372,18 @@ elif st.session_state["page"] == "แดชบอร์ดคลังเลื
 
     totals = totals_overview()
     blood_types = ["A", "B", "O", "AB"]
-    cols = st.columns(4)
 
+    # การ์ดทั้ง 4 กรุ๊ปอยู่ใน component เดียว (คลิกการ์ดเพื่อดูรายละเอียด)
+    snap = dashboard_snapshot(totals, blood_types)
+    clicked = dashboard_grid(snap, key="dashboard_grid")
+    if clicked and clicked.get("ts") != st.session_state.get("grid_click_ts"):
+        st.session_state["grid_click_ts"] = clicked.get("ts")
+        st.session_state["selected_bt"] = clicked.get("bt")
+        _safe_rerun()
+
+    cols = st.columns(4)
     for i, bt in enumerate(blood_types):
         with cols[i]:
-            st.markdown(f"### ถุงเลือดกรุ๊ป **{bt}**")
-            card_html = bag_card_html(bt, totals.get(bt, 0))
-            st_html(card_html, height=320, scrolling=False)
-
             if st.button(f"ดูรายละเอียดกรุ๊ป {bt}", key=f"btn_{bt}"):
                 st.session_state["selected_bt"] = bt
                 _safe_rerun()
@@ -1501,11 +1393,29 @@ elif st.session_state["page"] == "แดชบอร์ดคลังเลื
     st.subheader(f"รายละเอียดกรุ๊ป {sel}")
     _L, _M, _R = st.columns([1, 1, 1])
     with _M:
-        st_html(bag_svg(sel, totals.get(sel, 0)), height=270, scrolling=False)
+        sel_bag = [b for b in snap["bags"] if b["bt"] == sel]
+        dashboard_grid(dict(snap, bags=sel_bag), key="detail_bag", clickable=False)
 
     dist_sel = products_of(sel)
     dist_sel["Cryo"] = get_global_cryo()
 
+    low_comps = [c for c in COMPAT if dist_sel.get(c, 0) <= CRITICAL_MAX]
+    if low_comps:
+        with st.expander(f"🔁 กรุ๊ปทดแทนที่เข้ากันได้สำหรับกรุ๊ป {sel} (ผลิตภัณฑ์ที่วิกฤต)", expanded=True):
+            levels, earliest = stock_snapshot()
+            for comp in low_comps:
+                cands = [c for c in rank_candidates(sel, comp, levels, 1, earliest) if not c["identical"]]
+                if cands:
+                    txt = ", ".join(
+                        f"{c['group']} ({c['units']}"
+                        + (f", หมดอายุเร็วสุด {c['earliest_exp']:%Y/%m/%d}" if c["earliest_exp"] else "")
+                        + ")"
+                        for c in cands
+                    )
+                else:
+                    txt = "ไม่มีกรุ๊ปทดแทนที่มีของ"
+                st.markdown(f"- **{comp}** (มี {dist_sel.get(comp, 0)}) → {txt}")
+
     df = pd.DataFrame([{"product_type": k, "units": int(v)} for k, v in dist_sel.items()])
     df["product_type"] = pd.Categorical(df["product_type"], categories=ALL_PRODUCTS_UI, ordered=True)
 
@@ -1549,6 +1459,33 @@ elif st.session_state["page"] == "แดชบอร์ดคลังเลื
         hide_index=True,
     )
 
+    st.markdown("### ยอดคงเหลือย้อนหลัง")
+    range_label = st.radio("ช่วงเวลา", list(HISTORY_RANGES), index=1, horizontal=True, key="history_range")
+    try:
+        df_hist, n_hist = level_history(sel, HISTORY_RANGES[range_label])
+    except sqlite3.OperationalError:
+        # replica จาก DB รุ่นเก่าที่ยังไม่มี stock_log
+        df_hist, n_hist = pd.DataFrame(), 0
+    if df_hist.empty:
+        st.info("ยังไม่มีความเคลื่อนไหวในช่วงนี้")
+    else:
+        # ต่อเส้นถึงปัจจุบันด้วยยอดล่าสุด (ไม่อยู่ใน cache จึงไม่ทำให้ cache หมดอายุ)
+        last = df_hist.groupby("product", sort=False).tail(1).assign(ts=pd.Timestamp(datetime.now()))
+        df_hist = pd.concat([df_hist, last], ignore_index=True)
+        hist_chart = (
+            alt.Chart(df_hist)
+            .mark_line(interpolate="step-after")
+            .encode(
+                x=alt.X("ts:T", title="เวลา"),
+                y=alt.Y("units:Q", title="จำนวนหน่วย (unit)", scale=alt.Scale(domainMin=0)),
+                color=alt.Color("product:N", sort=ALL_PRODUCTS_UI, title="ผลิตภัณฑ์"),
+                tooltip=[alt.Tooltip("ts:T", title="เวลา", format="%Y/%m/%d %H:%M"), "product", "units"],
+            )
+            .properties(height=300)
+        )
+        st.altair_chart(hist_chart, use_container_width=True)
+        st.caption(f"แสดง {len(df_hist):,} จุด จากความเคลื่อนไหว {n_hist:,} จุด (LTTB)")
+
     st.markdown("### รายการบันทึกความเคลื่อนไหว (Activity Log)")
     if st.session_state["activity"]:
         st.dataframe(pd.DataFrame(st.session_state["activity"]), use_container_width=True, hide_index=True)
@@ -1556,15 +1493,100 @@ elif st.session_state["page"] == "แดชบอร์ดคลังเลื
         st.info("ยังไม่มีรายการความเคลื่อนไหว")
 
 
+# ==========================================
+# PAGE: รายงาน (QA รายเดือน)
+# ==========================================
+elif st.session_state["page"] == "รายงาน":
+    if not st.session_state["logged_in"]:
+        st.warning("ต้องเข้าสู่ระบบก่อนจึงจะใช้งานเมนูนี้ได้")
+    else:
+        st.subheader("รายงานการใช้เลือดและการสูญเสีย (รายเดือน)")
+        this_year = date.today().year
+        year = st.selectbox("ปี (ค.ศ.)", list(range(this_year, this_year - 5, -1)), key="report_year")
+        # เดือนที่ปิดแล้วอ่านจาก report_cache เดือนปัจจุบันคำนวณใหม่จาก unit_log / stock_log
+        rep, rep_stats = reports.monthly_report(f"{year}-01", f"{year}-12")
+        if rep.empty:
+            st.info("ยังไม่มีข้อมูลในปีที่เลือก")
+        else:
+            summary = reports.summarize(rep)
+            st.markdown("#### สรุปทั้งปี ตามกรุ๊ปและผลิตภัณฑ์")
+            st.dataframe(summary, use_container_width=True, hide_index=True)
+            st.markdown("#### รายเดือน")
+            st.dataframe(rep, use_container_width=True, hide_index=True)
+            st.caption(
+                f"จ่าย = จ่ายแล้ว, Exp = หมดอายุทิ้ง, ปล่อยจอง = จอง -> หลุดจอง · "
+                f"ใช้ผลที่เก็บไว้ {rep_stats['cached']} เดือน / คำนวณใหม่ {rep_stats['computed']} เดือน"
+            )
+            d1, d2 = st.columns(2)
+            d1.download_button(
+                "ดาวน์โหลด CSV",
+                reports.to_csv_bytes(rep),
+                file_name=f"blood_report_{year}.csv",
+                mime="text/csv",
+                use_container_width=True,
+            )
+            try:
+                xlsx = reports.to_excel_bytes({"summary": summary, "monthly": rep})
+            except ImportError:
+                d2.caption("ต้องติดตั้ง openpyxl เพื่อส่งออก Excel")
+            else:
+                d2.download_button(
+                    "ดาวน์โหลด Excel",
+                    xlsx,
+                    file_name=f"blood_report_{year}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True,
+                )
+
+        # ---------- ค้นหาประวัติ (FTS5 บน stock_log.actor/note และ units.unit_number/note) ----------
+        st.markdown("#### ค้นหาบันทึกความเคลื่อนไหว")
+        q_text = st.text_input("ข้อความ (ผู้ทำรายการ / หมายเหตุ / Unit number / บันทึก)", key="search_text")
+        f1, f2, f3 = st.columns(3)
+        q_range = f1.date_input(
+            "ช่วงวันที่",
+            value=(date.today().replace(day=1), date.today()),
+            key="search_range",
+        )
+        q_group = f2.selectbox("กรุ๊ป", ["ทั้งหมด", "A", "B", "O", "AB"], key="search_group")
+        q_prod = f3.selectbox("ผลิตภัณฑ์", ["ทั้งหมด"] + ALL_PRODUCTS_UI, key="search_prod")
+        # date_input แบบช่วงคืน tuple 1 ค่าระหว่างที่ผู้ใช้ยังเลือกไม่ครบ
+        q_since = q_range[0] if len(q_range) > 0 else None
+        q_until = (q_range[-1] + timedelta(days=1)) if len(q_range) > 0 else None
+        bt = None if q_group == "ทั้งหมด" else q_group
+        prod = None if q_prod == "ทั้งหมด" else q_prod
+
+        log_hits = search_stock_log(
+            q_text,
+            since=q_since,
+            until=q_until,
+            blood_type=bt,
+            product_type=None if prod is None else UI_TO_DB.get(prod, prod),
+        )
+        unit_hits = search_units(q_text, since=q_since, until=q_until, blood_group=bt, component=prod)
+        st.caption(f"พบความเคลื่อนไหว {len(log_hits)} รายการ · หน่วยเลือด {len(unit_hits)} หน่วย (แสดงสูงสุด 200)")
+        if log_hits:
+            df_hits = pd.DataFrame(log_hits).drop(columns=["id"])
+            df_hits["product_type"] = df_hits["product_type"].replace(DB_TO_UI)
+            st.dataframe(df_hits, use_container_width=True, hide_index=True)
+        if unit_hits:
+            st.dataframe(pd.DataFrame(unit_hits).drop(columns=["id"]), use_container_width=True, hide_index=True)
+
+
 # ==========================================
 # ปุ่มรีเซ็ต
 # ==========================================
 st.divider()
 st.markdown("### ⚠️ การจัดการระบบ")
-if st.session_state.get("logged_in"):
+if READ_ONLY:
+    st.info("อินสแตนซ์นี้เป็นจอแสดงผล (replica อ่านอย่างเดียว)")
+elif st.session_state.get("logged_in"):
     if st.button("🧹 รีเซ็ตเลือดทั้งหมดเป็นศูนย์", type="primary", use_container_width=True):
         reset_all_stock(st.session_state.get("username", "admin"))
         flash("รีเซ็ตจำนวนเลือดทั้งหมดแล้ว ✅", "warning")
         _safe_rerun()
 else:
     st.info("ต้องเข้าสู่ระบบก่อนจึงจะใช้งานปุ่มรีเซ็ตได้")
+
+
+# ปิดโปรไฟล์ของ rerun นี้ (ถ้าเปิดไว้)
+_profile_end()
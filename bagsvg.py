@@ -0,0 +1,139 @@
+# bagsvg.py
+"""
+ถุงเลือด SVG + เกณฑ์สี ใช้ร่วมกันระหว่าง app.py (หน้าแอป) และ signage.py (ไฟล์ static สำหรับจอแสดงผล)
+ไม่ import streamlit จึงเรียกจาก process อื่นได้
+"""
+
+BAG_MAX = 20
+CRITICAL_MAX = 4
+YELLOW_MAX = 15
+
+
+def compute_bag(total: int, max_cap=BAG_MAX):
+    t = max(0, int(total))
+    if t <= CRITICAL_MAX:
+        status, label = "red", "วิกฤตใกล้หมด"
+    elif t <= YELLOW_MAX:
+        status, label = "yellow", "เพียงพอ"
+    else:
+        status, label = "green", "ปกติ"
+    pct = max(0, min(100, int(round(100 * min(t, max_cap) / max_cap))))
+    return status, label, pct
+
+
+def bag_color(status: str) -> str:
+    return {"green": "#22c55e", "yellow": "#f59e0b", "red": "#ef4444"}[status]
+
+
+def bag_svg_element(blood_type: str, total: int) -> str:
+    """แท็ก <svg> ของถุงเลือด (มี xmlns เปิดเป็นไฟล์ .svg เดี่ยว ๆ ได้)"""
+    status, _label, pct = compute_bag(total, BAG_MAX)
+    fill = bag_color(status)
+    letter_fill = {
+        "A": "#facc15",
+        "B": "#f472b6",
+        "O": "#60a5fa",
+        "AB": "#ffffff",
+    }.get(blood_type, "#ffffff")
+
+    inner_h = 148.0
+    inner_y0 = 40.0
+    water_h = inner_h * pct / 100.0
+    water_y = inner_y0 + (inner_h - water_h)
+    gid = f"g_{blood_type}"
+
+    base_y = 20.0
+    amp1 = 5 + 6 * (pct / 100.0)
+    amp2 = amp1 * 0.6
+
+    wave1_d = (
+        f"M0 {base_y:.1f} "
+        f"Q20 {base_y-amp1:.1f} 40 {base_y:.1f} "
+        f"T80 {base_y:.1f} T120 {base_y:.1f} T160 {base_y:.1f} "
+        "V40 H0 Z"
+    )
+    wave2_d = (
+        f"M0 {base_y+2:.1f} "
+        f"Q20 {base_y+2-amp2:.1f} 40 {base_y+2:.1f} "
+        f"T80 {base_y+2:.1f} T120 {base_y+2:.1f} T160 {base_y+2:.1f} "
+        "V42 H0 Z"
+    )
+
+    wave_speed1 = 5.0
+    wave_speed2 = 7.5
+
+    if total <= 0:
+        water_y = inner_y0 + inner_h - 1
+
+    return f"""<svg class="bag" width="170" height="230" viewBox="0 0 168 206"
+     xmlns="http://www.w3.org/2000/svg">
+  <defs>
+    <clipPath id="clip-{gid}">
+      <path d="M24,40 C24,24 38,14 58,14 L110,14 C130,14 144,24 144,40
+               L144,172 C144,191 128,202 108,204 L56,204 C36,202 24,191 24,172 Z"/>
+    </clipPath>
+    <linearGradient id="liquid-{gid}" x1="0" y1="0" x2="0" y2="1">
+      <stop offset="0%"  stop-color="{fill}" stop-opacity=".98"/>
+      <stop offset="55%" stop-color="{fill}" stop-opacity=".94"/>
+      <stop offset="100%" stop-color="{fill}" stop-opacity=".88"/>
+    </linearGradient>
+    <linearGradient id="liquid-soft-{gid}" x1="0" y1="0" x2="0" y2="1">
+      <stop offset="0%"  stop-color="{fill}" stop-opacity=".75"/>
+      <stop offset="100%" stop-color="{fill}" stop-opacity=".6"/>
+    </linearGradient>
+    <path id="wave1-{gid}" d="{wave1_d}" />
+    <path id="wave2-{gid}" d="{wave2_d}" />
+  </defs>
+
+  <!-- หูถุง -->
+  <circle cx="84" cy="10" r="7.5"
+          fill="#eef2ff" stroke="#dbe0ea" stroke-width="3"/>
+  <rect x="77.5" y="14" width="13" height="8" rx="3" fill="#e5e7eb"/>
+
+  <!-- ตัวถุง -->
+  <path d="M16,34 C16,18 32,8 52,8 L116,8 C136,8 152,18 152,34
+           L152,176 C152,195 136,206 116,206 L52,206 C32,206 16,195 16,176 Z"
+        fill="#ffffff" stroke="#800000" stroke-width="3"/>
+
+  <!-- ของเหลว + คลื่น -->
+  <g clip-path="url(#clip-{gid})">
+    <g transform="translate(24,{water_y:.1f})">
+      <g class="wave-layer" style="animation:wave-move-1 {wave_speed1}s linear infinite;">
+        <use href="#wave1-{gid}" fill="url(#liquid-{gid})" x="0"/>
+        <use href="#wave1-{gid}" fill="url(#liquid-{gid})" x="80"/>
+        <use href="#wave1-{gid}" fill="url(#liquid-{gid})" x="160"/>
+      </g>
+      <g class="wave-layer" style="animation:wave-move-2 {wave_speed2}s linear infinite;">
+        <use href="#wave2-{gid}" fill="url(#liquid-soft-{gid})" x="0"/>
+        <use href="#wave2-{gid}" fill="url(#liquid-soft-{gid})" x="80"/>
+        <use href="#wave2-{gid}" fill="url(#liquid-soft-{gid})" x="160"/>
+      </g>
+      <rect y="{base_y+4:.1f}" width="220" height="220" fill="url(#liquid-{gid})"/>
+    </g>
+  </g>
+
+  <!-- ป้าย max -->
+  <rect x="98" y="24" rx="10" ry="10" width="54" height="22"
+        fill="#ffffff" stroke="#e5e7eb"/>
+  <text x="125" y="40" text-anchor="middle"
+        font-size="12" fill="#374151">{BAG_MAX} max</text>
+
+  <!-- ตัวอักษรกำกับกรุ๊ปเลือด -->
+  <text x="84" y="126" text-anchor="middle" font-size="32" font-weight="900"
+        style="paint-order: stroke fill"
+        stroke="#111827" stroke-width="4"
+        fill="{letter_fill}">{blood_type}</text>
+</svg>
+"""
+
+
+def bag_svg(blood_type: str, total: int, css: str = "") -> str:
+    """ถุงเลือดใน <div class="bag-wrap"> (สไตล์จาก bag.css) css: แท็ก <link> / <style> ที่จะแทรกไว้ด้านหน้า"""
+    return f"""
+<div>
+  {css}
+  <div class="bag-wrap">
+    {bag_svg_element(blood_type, total)}
+  </div>
+</div>
+"""
@@ -0,0 +1,93 @@
+# coherence.py
+"""
+cache ระดับ process ที่ไม่ค้างเมื่อ process อื่นเขียน DB (หลาย `streamlit run app.py` หลัง load balancer)
+
+ทุก process เปิด connection เฝ้าดู 1 เส้น แล้วอ่าน PRAGMA data_version ก่อนใช้ค่าใน cache
+ค่านี้เปลี่ยนทันทีที่ connection อื่นใด (process อื่น หรือ connection อื่นใน process เดียวกัน) commit
+จึงรู้ว่าต้องโหลดใหม่ตั้งแต่ rerun แรกหลัง commit โดยไม่ต้องมี thread / ตั้งเวลา
+ไฟล์ DB ถูกแทนที่ทั้งไฟล์ (เช่น replica.py เผยแพร่ snapshot ด้วย os.replace) ตรวจจากเลข inode แล้วเปิดใหม่
+"""
+import os
+import sqlite3
+import threading
+
+
+class DataVersionWatcher:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._ident = None
+        self._data_version = None
+        self.generation = 0  # เพิ่มทุกครั้งที่เห็น commit ใหม่
+
+    def _file_ident(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino)
+
+    def _open(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        self._ident = self._file_ident()
+        self._data_version = None
+
+    def check(self) -> int:
+        """อ่าน data_version (ไม่กี่ไมโครวินาที) คืน generation ปัจจุบัน"""
+        with self._lock:
+            try:
+                if self._conn is None or self._file_ident() != self._ident:
+                    self._open()
+                    self.generation += 1
+                dv = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            except sqlite3.Error:
+                # DB ยังไม่มี / เปิดไม่ได้ชั่วคราว: ถือว่าเปลี่ยนทุกครั้ง (ไม่ใช้ cache)
+                self._conn = None
+                self.generation += 1
+                return self.generation
+            if dv != self._data_version:
+                if self._data_version is not None:
+                    self.generation += 1
+                self._data_version = dv
+            return self.generation
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class CoherentCache:
+    """
+    cache ค่าอ่านจาก DB ต่อ key ใช้ได้ตราบที่ generation ของ watcher ยังเท่าเดิม
+    ใช้ร่วมทุกเซสชันใน process (เก็บผ่าน st.cache_resource) ค่าที่คืนต้องถือเป็นอ่านอย่างเดียว
+    """
+
+    def __init__(self, watcher: DataVersionWatcher):
+        self.watcher = watcher
+        self._lock = threading.Lock()
+        self._items = {}  # key -> (generation, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        gen = self.watcher.check()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] == gen:
+                self.hits += 1
+                return item[1]
+        value = loader()
+        with self._lock:
+            self.misses += 1
+            # commit ที่เกิดระหว่างโหลดจะทำให้ generation ถัดไปต่างจาก gen ที่เก็บ -> โหลดใหม่ครั้งหน้า
+            self._items[key] = (gen, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,104 @@
+# compat.py
+"""
+Substitution engine: หากรุ๊ปเลือดทดแทนที่เข้ากันได้ (ABO) เมื่อกรุ๊ปที่ขอมีไม่พอ
+
+ตาราง compatibility คำนวณไว้ล่วงหน้าต่อผลิตภัณฑ์ (ชื่อแบบ UI):
+- เม็ดเลือดแดง (LPRC, PRC): ผู้รับ AB รับได้ทุกกรุ๊ป, O ให้ได้ทุกกรุ๊ป
+- พลาสมา (FFP) และเกล็ดเลือด (PC, ใช้กฎฝั่งพลาสมาที่ติดมากับเกล็ดเลือด): กลับด้านกับเม็ดเลือดแดง
+  ผู้รับ O รับได้ทุกกรุ๊ป, AB ให้ได้ทุกกรุ๊ป
+ลำดับในแต่ละรายการ = ความเหมาะสมทางคลินิก (กรุ๊ปเดียวกันมาก่อนเสมอ)
+"""
+
+BLOOD_GROUPS = ("A", "B", "O", "AB")
+
+_RED_CELL = {
+    "O": ("O",),
+    "A": ("A", "O"),
+    "B": ("B", "O"),
+    "AB": ("AB", "A", "B", "O"),
+}
+_PLASMA = {
+    "O": ("O", "A", "B", "AB"),
+    "A": ("A", "AB"),
+    "B": ("B", "AB"),
+    "AB": ("AB",),
+}
+
+# {component: {recipient_group: (donor_group, ...)}}
+COMPAT = {
+    "LPRC": _RED_CELL,
+    "PRC": _RED_CELL,
+    "FFP": _PLASMA,
+    "PC": _PLASMA,
+}
+
+# {component: {(donor, recipient): bool}} สำหรับตรวจแบบ O(1)
+CAN_GIVE = {
+    comp: {(d, r): d in table[r] for d in BLOOD_GROUPS for r in BLOOD_GROUPS}
+    for comp, table in COMPAT.items()
+}
+
+
+def rank_candidates(group, component, snapshot, qty: int = 1, earliest_exp=None):
+    """
+    จัดอันดับกรุ๊ปที่ใช้แทนได้สำหรับคำขอ (group, component, qty) จาก snapshot ปัจจุบัน
+    snapshot: {(group, component): units}
+    earliest_exp: {(group, component): date} วันหมดอายุใกล้สุดของหน่วยพร้อมจ่าย (ถ้ามี)
+    ลำดับ: กรุ๊ปเดียวกัน -> ครอบคลุมจำนวนที่ขอได้ทั้งหมด -> หมดอายุเร็วกว่า (ใช้ก่อนเสีย) -> มีมากกว่า
+    คืน list ของ dict { group, units, earliest_exp, covers, identical }
+    """
+    earliest_exp = earliest_exp or {}
+    out = []
+    for donor in COMPAT.get(component, {}).get(group, ()):
+        units = int(snapshot.get((donor, component), 0))
+        if units <= 0:
+            continue
+        out.append(
+            {
+                "group": donor,
+                "units": units,
+                "earliest_exp": earliest_exp.get((donor, component)),
+                "covers": units >= qty,
+                "identical": donor == group,
+            }
+        )
+    out.sort(
+        key=lambda c: (
+            not c["identical"],
+            not c["covers"],
+            c["earliest_exp"] is None,
+            c["earliest_exp"] or 0,
+            -c["units"],
+        )
+    )
+    return out
+
+
+def plan_order(lines, snapshot, earliest_exp=None):
+    """
+    วางแผนจ่ายหลายบรรทัดพร้อมกัน โดยหักยอดจาก snapshot สำเนาเพื่อไม่ให้แต่ละบรรทัดนับหน่วยซ้ำ
+    lines: [(group, component, qty), ...]
+    คืน list ต่อบรรทัด: { group, component, qty, allocations: [(donor_group, n), ...], short }
+    """
+    left = dict(snapshot)
+    plan = []
+    for group, component, qty in lines:
+        need = int(qty)
+        allocations = []
+        for cand in rank_candidates(group, component, left, need, earliest_exp):
+            if need <= 0:
+                break
+            n = min(need, cand["units"])
+            allocations.append((cand["group"], n))
+            left[(cand["group"], component)] = cand["units"] - n
+            need -= n
+        plan.append(
+            {
+                "group": group,
+                "component": component,
+                "qty": int(qty),
+                "allocations": allocations,
+                "short": max(need, 0),
+            }
+        )
+    return plan
@@ -1,22 +1,152 @@
 # db.py
+import functools
+import itertools
 import os
+import random
 import sqlite3
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+
+from isbt import normalize_unit_number
 
 DB_PATH = os.environ.get("BLOOD_DB_PATH", "blood.db")
+# จอแสดงผลที่ชี้ไปยัง replica (ดู replica.py) เปิด DB แบบอ่านอย่างเดียว
+READ_ONLY = os.environ.get("BLOOD_DB_READONLY", "") == "1"
+
+# storage backend: "sqlite" (ค่าเริ่มต้น, production) หรือ "memory" (ทดสอบ / simulation, ดู memstore.py)
+# backend แทนเฉพาะฟังก์ชันสต็อกที่มี @_pluggable; หน่วยเลือด / lease / ค้นหา / รายงาน ใช้ SQLite เสมอ
+BACKEND = os.environ.get("BLOOD_DB_BACKEND", "sqlite").strip().lower()
+
+# compare-and-swap: จำนวนครั้งที่ลองซ้ำเมื่อชนกับผู้เขียนอื่น และ backoff ตั้งต้น (วินาที)
+CAS_RETRIES = 5
+CAS_BACKOFF_S = 0.005
+
+
+class InsufficientStockError(ValueError):
+    """ยอดคงเหลือไม่พอ; shortages = [(blood_type, product_type, requested, available), ...]"""
+
+    def __init__(self, shortages):
+        self.shortages = list(shortages)
+        detail = ", ".join(f"{bt}/{pt} ต้องการ {req} มี {avail}" for bt, pt, req, avail in self.shortages)
+        super().__init__(f"Insufficient stock: {detail}")
+
+
+class UnitsConflictError(RuntimeError):
+    """บันทึกตาราง units ทั้งตารางไม่สำเร็จ: มีผู้อื่น (เซสชันอื่น / scheduler) แก้ก่อน"""
+
+    def __init__(self, expected_version, current_version):
+        self.expected_version = expected_version
+        self.current_version = current_version
+        super().__init__(f"Units changed concurrently (expected version {expected_version}, current {current_version})")
+
+
+class StockConflictError(RuntimeError):
+    """CAS ไม่สำเร็จ: แถวสต็อกถูกผู้อื่นแก้ไขก่อน (version ไม่ตรง)"""
+
+    def __init__(self, blood_type, product_type, expected_version, current_version):
+        self.blood_type = blood_type
+        self.product_type = product_type
+        self.expected_version = expected_version
+        self.current_version = current_version
+        super().__init__(
+            f"Concurrent update on {blood_type}/{product_type} "
+            f"(expected version {expected_version}, current {current_version})"
+        )
+
+
+# ------------ Backend selection ------------
+
+_backend = None
+
+
+def get_backend():
+    """คืน backend ที่ไม่ใช่ SQLite ที่กำลังใช้อยู่ หรือ None ถ้าใช้ SQLite"""
+    global _backend
+    if _backend is None and BACKEND == "memory":
+        from memstore import MemoryBackend
+
+        _backend = MemoryBackend()
+    return _backend
+
+
+def set_backend(backend):
+    """
+    สลับ backend ระหว่างรัน: "sqlite", "memory" หรือ instance ของ backend (เช่น MemoryBackend)
+    คืน backend ที่ใช้งาน (None = SQLite)
+    """
+    global BACKEND, _backend
+    if isinstance(backend, str):
+        BACKEND = backend.strip().lower()
+        _backend = None
+        return get_backend()
+    BACKEND = "custom"
+    _backend = backend
+    return _backend
+
+
+def _pluggable(fn):
+    """ฟังก์ชันที่ทุก backend ต้องมี: ถ้าไม่ได้ใช้ SQLite ให้เรียกเมธอดชื่อเดียวกันของ backend แทน"""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        backend = get_backend()
+        if backend is not None:
+            return getattr(backend, name)(*args, **kwargs)
+        return fn(*args, **kwargs)
+
+    return wrapper
 
 
 def _get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    if READ_ONLY:
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def init_db():
-    """สร้างตารางพื้นฐาน ถ้ายังไม่มี"""
-    conn = _get_conn()
-    cur = conn.cursor()
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _stamp():
+    """(ts ข้อความไว้อ่าน, ts_epoch วินาที UTC ไว้ query ช่วงเวลา) จากเวลาเดียวกัน"""
+    now = datetime.now()
+    return now.strftime("%Y-%m-%d %H:%M:%S"), int(now.timestamp())
+
+
+def to_epoch(value) -> int:
+    """แปลง datetime / date / ข้อความ 'YYYY-MM-DD[ HH:MM:SS]' (เวลาท้องถิ่น) เป็น epoch สำหรับเทียบกับ ts_epoch"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, datetime):
+        if hasattr(value, "year"):
+            value = datetime(value.year, value.month, value.day)
+        else:
+            value = datetime.fromisoformat(str(value).strip())
+    return int(value.timestamp())
+
+
+def _scope_where(blood_type=None, product_type=None):
+    """สร้าง WHERE สำหรับจำกัดขอบเขตตามกรุ๊ป / product_type (None = ทั้งหมด)"""
+    clauses, params = [], []
+    if blood_type is not None:
+        clauses.append("blood_type = ?")
+        params.append(blood_type)
+    if product_type is not None:
+        clauses.append("product_type = ?")
+        params.append(product_type)
+    return clauses, params
 
+
+# ------------ Schema migrations ------------
+# แต่ละ migration รันครั้งเดียวต่อ DB ตามลำดับเวอร์ชัน บันทึกไว้ในตาราง schema_version
+# เพิ่มโครงสร้างใหม่ให้ต่อท้าย MIGRATIONS เสมอ (ห้ามแก้ของเดิมที่ปล่อยไปแล้ว)
+
+def _m001_base(cur):
+    """โครงสร้างเดิมก่อนมีระบบ migration (idempotent: DB เก่าที่มีบางส่วนอยู่แล้วผ่านได้)"""
     # ตารางสต็อกเลือด (เก็บเป็นยอดรวมตามกรุ๊ป / product_type)
     cur.execute(
         """
@@ -25,10 +155,15 @@ def init_db():
             blood_type TEXT NOT NULL,
             product_type TEXT NOT NULL,
             units INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,
             UNIQUE(blood_type, product_type)
         )
         """
     )
+    # DB เดิมที่สร้างก่อนมี version (ใช้กับ compare-and-swap)
+    cols = {r["name"] for r in cur.execute("PRAGMA table_info(stock)")}
+    if "version" not in cols:
+        cur.execute("ALTER TABLE stock ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
 
     # ตาราง log การเปลี่ยนแปลง (ไม่จำเป็นต่อหน้าจอ แต่เก็บไว้เป็น history)
     cur.execute(
@@ -36,6 +171,7 @@ def init_db():
         CREATE TABLE IF NOT EXISTS stock_log (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             ts TEXT NOT NULL,
+            ts_epoch INTEGER,
             actor TEXT,
             blood_type TEXT,
             product_type TEXT,
@@ -44,13 +180,439 @@ def init_db():
         )
         """
     )
+    # DB เดิม: เพิ่ม ts_epoch แล้วแปลงจาก ts ครั้งเดียว (ts เป็นเวลาท้องถิ่น)
+    cols = {r["name"] for r in cur.execute("PRAGMA table_info(stock_log)")}
+    if "ts_epoch" not in cols:
+        cur.execute("ALTER TABLE stock_log ADD COLUMN ts_epoch INTEGER")
+        cur.execute("UPDATE stock_log SET ts_epoch = CAST(strftime('%s', ts, 'utc') AS INTEGER)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stock_log_ts_epoch ON stock_log(ts_epoch)")
 
-    conn.commit()
+    # หน่วยเลือดรายถุง (ตารางกรอกเลือด) ใช้ร่วมทุกเซสชัน; วันที่เก็บเป็น ISO 'YYYY-MM-DD'
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS units (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT,
+            exp_date TEXT,
+            unit_number TEXT,
+            blood_group TEXT,
+            component TEXT,
+            status TEXT,
+            note TEXT
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_units_status_created ON units(status, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_units_status_exp ON units(status, exp_date)")
+    # ตัวนับเวอร์ชัน (เพิ่มทุกครั้งที่เขียน) ให้เซสชันรู้ว่าต้องโหลดใหม่หรือไม่
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """
+    )
+    # lease ของงานตามรอบ (scheduler.py): หลาย process ใช้ DB เดียวกันแต่งานรันครั้งเดียวต่อรอบ
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS job_lease (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+    # ประวัติการเปลี่ยนสถานะรายหน่วย (สำหรับรายงาน reports.py) เขียนด้วย trigger ทุกเส้นทางที่แก้ units
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS unit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts_epoch INTEGER NOT NULL,
+            unit_id INTEGER,
+            blood_group TEXT,
+            component TEXT,
+            old_status TEXT,
+            new_status TEXT
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_unit_log_ts_epoch ON unit_log(ts_epoch)")
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_units_insert AFTER INSERT ON units
+        BEGIN
+            INSERT INTO unit_log(ts_epoch, unit_id, blood_group, component, old_status, new_status)
+            VALUES (CAST(strftime('%s', 'now') AS INTEGER), new.id, new.blood_group, new.component, NULL, new.status);
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_units_status AFTER UPDATE OF status ON units
+        WHEN old.status IS NOT new.status
+        BEGIN
+            INSERT INTO unit_log(ts_epoch, unit_id, blood_group, component, old_status, new_status)
+            VALUES (CAST(strftime('%s', 'now') AS INTEGER), new.id, new.blood_group, new.component, old.status, new.status);
+        END
+        """
+    )
+    # ผลรายงานของงวดที่ปิดแล้ว (ไม่เปลี่ยนอีก) ไม่ต้องคำนวณซ้ำ
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS report_cache (
+            kind TEXT NOT NULL,
+            period TEXT NOT NULL,
+            computed_at TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (kind, period)
+        )
+        """
+    )
+
+    _init_fts(cur)
+
+
+def _m002_reference_tables(cur):
+    """ตารางอ้างอิงจาก schema.sql ที่ DB ซึ่งสร้างด้วย init_db() ยังไม่มี (ไม่ seed ยอด stock)"""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS thresholds (
+            blood_type TEXT PRIMARY KEY,
+            critical_min INTEGER NOT NULL,
+            low_min INTEGER NOT NULL
+        )
+        """
+    )
+    cur.executemany(
+        "INSERT OR IGNORE INTO thresholds (blood_type, critical_min, low_min) VALUES (?, ?, ?)",
+        [("O", 30, 60), ("A", 25, 50), ("B", 25, 50), ("AB", 15, 30)],
+    )
+    cur.execute("CREATE TABLE IF NOT EXISTS products (product_type TEXT PRIMARY KEY)")
+    cur.executemany(
+        "INSERT OR IGNORE INTO products (product_type) VALUES (?)",
+        [("PRC",), ("Platelets",), ("Plasma",), ("Cryo",)],
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts TEXT NOT NULL,
+            actor TEXT,
+            blood_type TEXT NOT NULL,
+            product_type TEXT NOT NULL,
+            qty_change INTEGER NOT NULL,
+            note TEXT
+        )
+        """
+    )
+
+
+def _m003_hot_indexes(cur):
+    """index ของ query ที่รันบ่อย (ดู HOT_QUERIES)"""
+    # กรุ๊ป/ผลิตภัณฑ์ + ช่วงเวลา (ค้นหา, replay เฉพาะกรุ๊ป) และครอบคลุม delta ให้ find_stock_drift
+    # รวมยอดต่อกรุ๊ปจาก index อย่างเดียว ไม่ต้องอ่านแถวจริง
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_stock_log_bt_pt_epoch
+        ON stock_log(blood_type, product_type, ts_epoch, delta)
+        """
+    )
+    # ประวัติรายหน่วย (unit_log) ตามหน่วย
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_unit_log_unit ON unit_log(unit_id, ts_epoch)")
+
+
+def _m004_unit_key(cur):
+    """คีย์ค้นหา Unit number (normalize_unit_number) + index ใช้หาหน่วยตอนสแกนโดยไม่ไล่ทั้งตาราง"""
+    cur.execute("ALTER TABLE units ADD COLUMN unit_key TEXT")
+    # ไม่ใช่ UNIQUE: DIN เดียวกันใช้กับทุก component ที่แยกจากการบริจาคครั้งเดียว
+    # และแถวที่ยังไม่มี Unit number (ค่าว่าง) มีได้หลายแถว
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_units_unit_key ON units(unit_key)")
+    # คีย์คำนวณใน Python (ตัด '=' / flag ของ DIN) จึงใช้ trigger แค่ล้างค่าเมื่อ Unit number เปลี่ยน
+    # แล้วให้ _fill_unit_keys เติมใหม่ใน transaction เดียวกับที่เขียน
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS units_unit_key_reset AFTER UPDATE OF unit_number ON units
+        WHEN old.unit_number IS NOT new.unit_number
+        BEGIN
+            UPDATE units SET unit_key = NULL WHERE id = new.id;
+        END
+        """
+    )
+    _fill_unit_keys(cur)
+
+
+MIGRATIONS = [
+    (1, "base", _m001_base),
+    (2, "reference tables from schema.sql", _m002_reference_tables),
+    (3, "hot-path indexes", _m003_hot_indexes),
+    (4, "unit number lookup key", _m004_unit_key),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _schema_version(conn) -> int:
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:  # ยังไม่มีตาราง schema_version
+        return 0
+    return int(row[0] or 0)
+
+
+def get_schema_version() -> int:
+    conn = _get_conn()
+    try:
+        return _schema_version(conn)
+    finally:
+        conn.close()
+
+
+def migrate():
+    """
+    apply migration ที่ยังไม่ได้รันตามลำดับ ใน transaction เดียว คืนรายการเวอร์ชันที่เพิ่ง apply
+    DB ที่เป็นเวอร์ชันล่าสุดแล้วเสียแค่ SELECT เดียว; หลาย process เริ่มพร้อมกันได้ (BEGIN IMMEDIATE แล้วตรวจซ้ำ)
+    """
+    conn = _get_conn()
+    cur = conn.cursor()
+    try:
+        if _schema_version(conn) >= SCHEMA_VERSION:
+            return []
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+            """
+        )
+        current = _schema_version(conn)
+        applied = []
+        for version, name, fn in MIGRATIONS:
+            if version <= current:
+                continue
+            fn(cur)
+            cur.execute(
+                "INSERT INTO schema_version(version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, _now()),
+            )
+            applied.append(version)
+        conn.commit()
+        return applied
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def init_db():
+    """
+    สร้าง / อัปเกรดโครงสร้าง DB เป็นเวอร์ชันล่าสุด (ดู MIGRATIONS)
+    backend อื่น (เช่น memory) แทนเฉพาะ API สต็อก ตารางหน่วยเลือด / counters / job_lease / unit_log
+    ยังอยู่ใน SQLite จึง migrate ไฟล์ DB_PATH เสมอ
+    """
+    backend = get_backend()
+    if backend is not None:
+        backend.init_db()
+    return migrate()
+
+
+# ------------ Full-text search (FTS5) ------------
+# ดัชนีแบบ external content: เก็บแค่ token ชี้กลับ rowid ของตารางจริง ข้อความไม่ซ้ำสองที่
+# ข้อความไทยไม่มีช่องว่างคั่นคำ จึงใช้ tokenizer trigram (ค้นส่วนใดของข้อความก็ได้ ขั้นต่ำ 3 ตัวอักษร)
+_FTS_TABLES = {
+    # ชื่อดัชนี: (ตารางจริง, คอลัมน์ที่ค้น)
+    "stock_log_fts": ("stock_log", ("actor", "note")),
+    "units_fts": ("units", ("unit_number", "note")),
+}
+FTS_MIN_CHARS = 3
+
+
+def _init_fts(cur):
+    """สร้างดัชนี FTS5 + trigger ให้ sync ทุกครั้งที่เขียน (ทุกเส้นทาง ไม่ต้องแก้ฟังก์ชันเขียนทีละจุด)"""
+    have = {r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for fts, (table, cols) in _FTS_TABLES.items():
+        if fts in have:
+            continue
+        col_list = ", ".join(cols)
+        new_vals = ", ".join(f"new.{c}" for c in cols)
+        old_vals = ", ".join(f"old.{c}" for c in cols)
+        try:
+            cur.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({col_list}, content='{table}', content_rowid='id', "
+                "tokenize='trigram')"
+            )
+        except sqlite3.OperationalError:
+            # SQLite เก่า (< 3.34) ไม่มี trigram หรือไม่มี FTS5 เลย: ข้ามไป ค้นหาจะใช้ LIKE แทน
+            continue
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_ai AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals});
+            END
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_ad AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals});
+            END
+            """
+        )
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_au AFTER UPDATE OF {col_list} ON {table}
+            BEGIN
+                INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals});
+                INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals});
+            END
+            """
+        )
+        # แถวที่มีอยู่ก่อนสร้างดัชนี
+        cur.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _fts_ready(conn, fts: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone() is not None
+
+
+def _text_filter(conn, fts: str, alias: str, cols, text: str):
+    """
+    เงื่อนไขค้นข้อความ คืน (join, where, params, order_by)
+    - มีดัชนีและข้อความยาวพอ: JOIN จากผล FTS5 MATCH (วลีตรงตัว) ให้ดัชนีเป็นตัวนำ ไม่ต้องไล่ทั้งตาราง
+      และเรียงด้วย rowid ของดัชนีเอง (FTS5 คืนผลจากใหม่ไปเก่าแล้วหยุดที่ LIMIT ได้ ไม่ต้อง sort ผลทั้งหมด)
+    - สั้นกว่านั้น (trigram ค้นไม่ได้) หรือไม่มีดัชนี: LIKE บนตารางจริง
+    """
+    text = str(text or "").strip()
+    if len(text) >= FTS_MIN_CHARS and _fts_ready(conn, fts):
+        phrase = '"' + text.replace('"', '""') + '"'
+        return f"JOIN {fts} ON {fts}.rowid = {alias}.id", f"{fts} MATCH ?", [phrase], f"{fts}.rowid DESC"
+    like = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    where = "(" + " OR ".join(f"{alias}.{c} LIKE ? ESCAPE '\\'" for c in cols) + ")"
+    return "", where, [like] * len(cols), f"{alias}.id DESC"
+
+
+def _search_stock_log_sql(join: str, where: str, order: str) -> str:
+    return f"""
+        SELECT l.id, l.ts, l.actor, l.blood_type, l.product_type, l.delta, l.note
+        FROM stock_log l
+        {join}
+        {where}
+        ORDER BY {order}
+        LIMIT ?
+        """
+
+
+def search_stock_log(text: str = "", since=None, until=None, blood_type=None, product_type=None, limit: int = 200):
+    """
+    ค้น stock_log จากข้อความใน actor / note พร้อมกรองช่วงเวลา [since, until) กรุ๊ป และ product_type
+    คืน list ของ dict เรียงใหม่ -> เก่า (สูงสุด limit แถว)
+    """
+    conn = _get_conn()
+    clauses, params = _scope_where(blood_type, product_type)
+    clauses = [f"l.{c}" for c in clauses]
+    join, order = "", "l.id DESC"
+    if str(text or "").strip():
+        join, sql, p, order = _text_filter(conn, "stock_log_fts", "l", _FTS_TABLES["stock_log_fts"][1], text)
+        clauses.append(sql)
+        params += p
+    if since is not None:
+        clauses.append("l.ts_epoch >= ?")
+        params.append(to_epoch(since))
+    if until is not None:
+        clauses.append("l.ts_epoch < ?")
+        params.append(to_epoch(until))
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    rows = conn.execute(_search_stock_log_sql(join, where, order), (*params, int(limit))).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+
+def search_units(text: str = "", since=None, until=None, blood_group=None, component=None, limit: int = 200):
+    """
+    ค้นหน่วยเลือดจาก Unit number / บันทึก (note) กรองตามวันที่รับเข้า (created_at) กรุ๊ป และผลิตภัณฑ์แบบ UI
+    คืน list ของ dict (id + UNIT_COLS) เรียงใหม่ -> เก่า
+    """
+    conn = _get_conn()
+    clauses, params, join, order = [], [], "", "u.id DESC"
+    if blood_group is not None:
+        clauses.append("u.blood_group = ?")
+        params.append(blood_group)
+    if component is not None:
+        clauses.append("u.component = ?")
+        params.append(component)
+    if str(text or "").strip():
+        join, sql, p, order = _text_filter(conn, "units_fts", "u", _FTS_TABLES["units_fts"][1], text)
+        clauses.append(sql)
+        params += p
+    if since is not None:
+        clauses.append("u.created_at >= ?")
+        params.append(str(since)[:10])
+    if until is not None:
+        clauses.append("u.created_at < ?")
+        params.append(str(until)[:10])
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    rows = conn.execute(
+        f"SELECT u.id, {', '.join('u.' + c for c in UNIT_COLS)} FROM units u {join} {where} ORDER BY {order} LIMIT ?",
+        (*params, int(limit)),
+    ).fetchall()
     conn.close()
+    return [dict(r) for r in rows]
+
+
+# ------------ History (ยอดคงเหลือย้อนหลังจาก stock_log) ------------
+
+def _level_history_sql(since: bool) -> str:
+    """ผลรวม delta ต่อวินาทีของ (กรุ๊ป, product_type) เรียงตามเวลา (since=True: มีเงื่อนไข ts_epoch >= ?)"""
+    where = "blood_type = ? AND product_type = ?" + (" AND ts_epoch >= ?" if since else "")
+    return f"SELECT ts_epoch, SUM(delta) FROM stock_log WHERE {where} GROUP BY ts_epoch ORDER BY ts_epoch"
+
+
+@_pluggable
+def get_level_history(blood_type: str, since=None):
+    """
+    ยอดคงเหลือย้อนหลังของทุก product_type ในกรุ๊ปนี้ ตั้งแต่ since (None = ทั้งหมด)
+    คืน { product_type: {"start": ยอดก่อน since, "ts": [ts_epoch, ...], "units": [ยอดหลังเปลี่ยน, ...]} }
+    ความเคลื่อนไหวในวินาทีเดียวกันรวมเป็นจุดเดียว ยอดนับย้อนจากยอดปัจจุบันในตาราง stock
+    (จุดสุดท้ายตรงกับที่หน้าจอแสดงเสมอ แม้ log เก่าจะไม่ครบ) อ่านจาก index อย่างเดียว
+    """
+    since_epoch = to_epoch(since) if since is not None else None
+    conn = _get_conn()
+    try:
+        current = {
+            r["product_type"]: int(r["units"] or 0)
+            for r in conn.execute(_STOCK_BY_BLOOD_SQL, (blood_type,))
+        }
+        # ช่วงยาวมีได้หลายแสนแถว: tuple ธรรมดาเร็วกว่า sqlite3.Row
+        cur = conn.cursor()
+        cur.row_factory = None
+        out = {}
+        sql = _level_history_sql(since_epoch is not None)
+        for pt, units in current.items():
+            params = [blood_type, pt] + ([since_epoch] if since_epoch is not None else [])
+            # GROUP BY ตามลำดับ index ได้เลย (ไม่ sort) ผลรวมสะสมทำใน Python เร็วกว่า window function หลายเท่า
+            rows = cur.execute(sql, params).fetchall()
+            ts = [t for t, _d in rows]
+            running = list(itertools.accumulate(d or 0 for _t, d in rows))
+            # ยอด = ยอดปัจจุบัน - ผลรวม delta หลังจุดนั้น
+            start = units - (running[-1] if running else 0)
+            out[pt] = {"start": start, "ts": ts, "units": [start + r for r in running]}
+    finally:
+        conn.close()
+    return out
 
 
 # ------------ Query helper ------------
 
+_STOCK_ROW_SQL = "SELECT units, version FROM stock WHERE blood_type = ? AND product_type = ?"
+_STOCK_BY_BLOOD_SQL = "SELECT product_type, units FROM stock WHERE blood_type = ?"
+
+
+@_pluggable
 def get_all_status():
     """
     คืนค่า list ของ dict:
@@ -71,6 +633,7 @@ def get_all_status():
     return rows
 
 
+@_pluggable
 def get_stock_by_blood(blood_type: str):
     """
     คืน list ของ dict:
@@ -78,95 +641,891 @@ def get_stock_by_blood(blood_type: str):
     """
     conn = _get_conn()
     cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT product_type, units
-        FROM stock
-        WHERE blood_type = ?
-        """,
-        (blood_type,),
-    )
+    cur.execute(_STOCK_BY_BLOOD_SQL, (blood_type,))
     rows = [dict(r) for r in cur.fetchall()]
     conn.close()
     return rows
 
 
-def adjust_stock(blood_type: str, product_type: str, qty: int, actor: str = "", note: str = ""):
+@_pluggable
+def get_stock_row(blood_type: str, product_type: str):
+    """คืน { "units": 5, "version": 12 } ของแถวนั้น หรือ None ถ้ายังไม่มี"""
+    conn = _get_conn()
+    row = conn.execute(_STOCK_ROW_SQL, (blood_type, product_type)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+@_pluggable
+def get_stock_version() -> int:
+    """
+    ตัวเลขที่เปลี่ยนทุกครั้งที่ตาราง stock ถูกแก้ (ผลรวม version ทุกแถว + จำนวนแถว)
+    ใช้เช็กถูก ๆ ว่าต้องอ่านยอดใหม่หรือไม่ (ไม่ต้องดึงทุกแถว)
     """
-    ปรับสต็อก + เพิ่ม log
+    conn = _get_conn()
+    row = conn.execute("SELECT COUNT(*) + COALESCE(SUM(version), 0) FROM stock").fetchone()
+    conn.close()
+    return int(row[0])
+
+
+@_pluggable
+def adjust_stock(blood_type: str, product_type: str, qty: int, actor: str = "", note: str = "",
+                 expected_version=None, retries: int = CAS_RETRIES):
+    """
+    ปรับสต็อก + เพิ่ม log (compare-and-swap ตาม version ของแถว)
     qty > 0 = รับเข้า, qty < 0 = จ่ายออก
+    - จ่ายเกินยอดคงเหลือ -> InsufficientStockError (ไม่ clamp เงียบ ๆ, log จึงตรงกับตารางเสมอ)
+    - expected_version: ถ้าระบุ และแถวถูกแก้ไปแล้ว -> StockConflictError ทันที
+    - ไม่ระบุ: ชนกับผู้เขียนอื่นจะอ่านใหม่แล้วลองซ้ำ (backoff) สูงสุด retries ครั้ง
+    คืน { "units": คงเหลือใหม่, "version": เวอร์ชันใหม่ }
     """
     if not qty:
-        return
+        return None
+    qty = int(qty)
 
     conn = _get_conn()
     cur = conn.cursor()
+    try:
+        for attempt in range(retries + 1):
+            row = cur.execute(_STOCK_ROW_SQL, (blood_type, product_type)).fetchone()
+            if row is None:
+                # ถ้าไม่มี row ให้สร้างก่อน
+                cur.execute(
+                    """
+                    INSERT OR IGNORE INTO stock(blood_type, product_type, units)
+                    VALUES (?, ?, 0)
+                    """,
+                    (blood_type, product_type),
+                )
+                conn.commit()
+                continue
 
-    # ถ้าไม่มี row ให้สร้างก่อน
-    cur.execute(
-        """
-        INSERT OR IGNORE INTO stock(blood_type, product_type, units)
-        VALUES (?, ?, 0)
-        """,
-        (blood_type, product_type),
-    )
+            units, version = int(row["units"]), int(row["version"])
+            if expected_version is not None and version != expected_version:
+                raise StockConflictError(blood_type, product_type, expected_version, version)
+            if units + qty < 0:
+                raise InsufficientStockError([(blood_type, product_type, -qty, units)])
 
-    # อัปเดตจำนวน
+            # อัปเดตเฉพาะเมื่อ version ยังเป็นค่าที่อ่านมา
+            cur.execute(
+                """
+                UPDATE stock
+                SET units = ?, version = version + 1
+                WHERE blood_type = ? AND product_type = ? AND version = ?
+                """,
+                (units + qty, blood_type, product_type, version),
+            )
+            if cur.rowcount != 1:
+                conn.rollback()
+                if expected_version is not None:
+                    raise StockConflictError(blood_type, product_type, expected_version, None)
+                time.sleep(CAS_BACKOFF_S * (2 ** attempt) * random.random())
+                continue
+
+            # บันทึก log (transaction เดียวกับการอัปเดต)
+            cur.execute(
+                """
+                INSERT INTO stock_log(ts, ts_epoch, actor, blood_type, product_type, delta, note)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (*_stamp(), actor or "", blood_type, product_type, qty, note or ""),
+            )
+            conn.commit()
+            return {"units": units + qty, "version": version + 1}
+
+        raise StockConflictError(blood_type, product_type, expected_version, None)
+    finally:
+        conn.close()
+
+
+_STOCK_DRIFT_SQL = """
+    SELECT s.blood_type, s.product_type, s.units, COALESCE(l.logged, 0) AS logged
+    FROM stock s
+    LEFT JOIN (
+        SELECT blood_type, product_type, SUM(delta) AS logged
+        FROM stock_log
+        GROUP BY blood_type, product_type
+    ) l ON l.blood_type = s.blood_type AND l.product_type = s.product_type
+    WHERE s.units != COALESCE(l.logged, 0)
+    """
+
+
+@_pluggable
+def find_stock_drift():
+    """
+    ตรวจหาแถวที่ยอดในตาราง stock ไม่ตรงกับผลรวม delta ใน stock_log
+    (เช่นจากการ clamp แบบเดิม) ใช้ได้กับ DB ที่ log ครอบคลุมตั้งแต่ยอดเป็นศูนย์
+    คืน list ของ { blood_type, product_type, units, logged }
+    """
+    conn = _get_conn()
+    rows = conn.execute(_STOCK_DRIFT_SQL).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+
+@_pluggable
+def reset_all_stock(actor: str = "admin"):
+    """รีเซ็ต stock ทุกตัวเป็นศูนย์ + log"""
+    return reset_stock(actor=actor, note="reset_all_stock")
+
+
+# ------------ Bulk operations (set-based, 1 transaction) ------------
+
+@_pluggable
+def reset_stock(actor: str = "admin", blood_type=None, product_type=None, note: str = "reset_stock"):
+    """
+    รีเซ็ตสต็อกเป็นศูนย์ตามขอบเขต (ทั้งหมด / ตามกรุ๊ป / ตาม product_type)
+    log ค่าเดิมด้วย INSERT ... SELECT แล้ว UPDATE ครั้งเดียว
+    คืนจำนวนแถวที่ถูกรีเซ็ต
+    """
+    clauses, params = _scope_where(blood_type, product_type)
+    where = " AND ".join(["units != 0"] + clauses)
+
+    conn = _get_conn()
+    cur = conn.cursor()
     cur.execute(
-        """
-        UPDATE stock
-        SET units = MAX(units + ?, 0)
-        WHERE blood_type = ? AND product_type = ?
+        f"""
+        INSERT INTO stock_log(ts, ts_epoch, actor, blood_type, product_type, delta, note)
+        SELECT ?, ?, ?, blood_type, product_type, -units, ?
+        FROM stock
+        WHERE {where}
         """,
-        (qty, blood_type, product_type),
+        [*_stamp(), actor or "", note or ""] + params,
     )
+    cur.execute(f"UPDATE stock SET units = 0, version = version + 1 WHERE {where}", params)
+    n = cur.rowcount
+    conn.commit()
+    conn.close()
+    return n
+
+
+@_pluggable
+def transfer_stock(src_blood_type: str, dst_blood_type: str, product_type: str, qty: int,
+                   actor: str = "", note: str = "transfer"):
+    """
+    โอนสต็อก product_type จากกรุ๊ปต้นทางไปกรุ๊ปปลายทาง (ทั้งคู่ใน transaction เดียว)
+    ถ้ายอดต้นทางไม่พอ -> InsufficientStockError และไม่มีอะไรเปลี่ยน
+    """
+    qty = int(qty)
+    if qty <= 0:
+        raise ValueError("qty must be positive")
+    if src_blood_type == dst_blood_type:
+        return
+
+    conn = _get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            INSERT OR IGNORE INTO stock(blood_type, product_type, units)
+            VALUES (?, ?, 0)
+            """,
+            (dst_blood_type, product_type),
+        )
+        # ตัดต้นทางแบบมีเงื่อนไข (กันยอดติดลบโดยไม่ต้องอ่านก่อน)
+        cur.execute(
+            """
+            UPDATE stock SET units = units - ?, version = version + 1
+            WHERE blood_type = ? AND product_type = ? AND units >= ?
+            """,
+            (qty, src_blood_type, product_type, qty),
+        )
+        if cur.rowcount != 1:
+            row = cur.execute(
+                "SELECT units FROM stock WHERE blood_type = ? AND product_type = ?",
+                (src_blood_type, product_type),
+            ).fetchone()
+            raise InsufficientStockError(
+                [(src_blood_type, product_type, qty, int(row["units"]) if row else 0)]
+            )
+        cur.execute(
+            """
+            UPDATE stock SET units = units + ?, version = version + 1
+            WHERE blood_type = ? AND product_type = ?
+            """,
+            (qty, dst_blood_type, product_type),
+        )
+        ts, ts_epoch = _stamp()
+        cur.executemany(
+            """
+            INSERT INTO stock_log(ts, ts_epoch, actor, blood_type, product_type, delta, note)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (ts, ts_epoch, actor or "", src_blood_type, product_type, -qty, note or ""),
+                (ts, ts_epoch, actor or "", dst_blood_type, product_type, qty, note or ""),
+            ],
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
 
-    # บันทึก log
+@_pluggable
+def set_stock_levels(levels, actor: str = "", note: str = "stock_take"):
+    """
+    ตรวจนับสต็อก (stock-take): เขียนทับยอดด้วยค่าที่นับได้
+    levels: iterable ของ (blood_type, product_type, units)
+    log เฉพาะแถวที่ยอดเปลี่ยน (delta = ใหม่ - เดิม) คืนจำนวนแถวที่เปลี่ยน
+    """
+    rows = [(bt, pt, max(int(u), 0)) for bt, pt, u in levels]
+    if not rows:
+        return 0
+
+    conn = _get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS stock_take (
+                blood_type TEXT NOT NULL,
+                product_type TEXT NOT NULL,
+                units INTEGER NOT NULL,
+                PRIMARY KEY (blood_type, product_type)
+            )
+            """
+        )
+        cur.execute("DELETE FROM stock_take")
+        cur.executemany("INSERT OR REPLACE INTO stock_take VALUES (?, ?, ?)", rows)
+
+        cur.execute(
+            """
+            INSERT INTO stock_log(ts, ts_epoch, actor, blood_type, product_type, delta, note)
+            SELECT ?, ?, ?, t.blood_type, t.product_type, t.units - COALESCE(s.units, 0), ?
+            FROM stock_take t
+            LEFT JOIN stock s
+              ON s.blood_type = t.blood_type AND s.product_type = t.product_type
+            WHERE t.units != COALESCE(s.units, 0)
+            """,
+            (*_stamp(), actor or "", note or ""),
+        )
+        n = cur.rowcount
+        cur.execute(
+            """
+            INSERT OR IGNORE INTO stock(blood_type, product_type, units)
+            SELECT blood_type, product_type, 0 FROM stock_take
+            """
+        )
+        cur.execute(
+            """
+            UPDATE stock
+            SET units = (
+                SELECT t.units FROM stock_take t
+                WHERE t.blood_type = stock.blood_type AND t.product_type = stock.product_type
+            ),
+            version = version + 1
+            WHERE EXISTS (
+                SELECT 1 FROM stock_take t
+                WHERE t.blood_type = stock.blood_type AND t.product_type = stock.product_type
+                  AND t.units != stock.units
+            )
+            """
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return n
+
+
+@_pluggable
+def issue_order(lines, actor: str = "", note: str = "order"):
+    """
+    จ่ายออกหลายรายการในคำสั่งเดียว (เช่น MTP: 6 PRC + 6 FFP + 1 PC)
+    lines: iterable ของ (blood_type, product_type, qty) โดย qty > 0 = จำนวนที่จ่าย
+    ตรวจยอดทุกบรรทัดก่อน แล้วตัดสต็อก + log ทั้งหมดใน transaction เดียว (all-or-nothing)
+    ถ้าบรรทัดใดไม่พอ -> InsufficientStockError และไม่มีอะไรเปลี่ยน
+    คืน dict {(blood_type, product_type): units คงเหลือหลังจ่าย}
+    """
+    wanted = {}
+    for bt, pt, qty in lines:
+        qty = int(qty)
+        if qty < 0:
+            raise ValueError("order quantities must be positive")
+        if qty:
+            wanted[(bt, pt)] = wanted.get((bt, pt), 0) + qty
+    if not wanted:
+        return {}
+
+    keys = list(wanted)
+    values_sql = ", ".join(["(?, ?)"] * len(keys))
+    key_params = [v for k in keys for v in k]
+
+    conn = _get_conn()
+    cur = conn.cursor()
+    try:
+        # จองสิทธิ์เขียนตั้งแต่ก่อนอ่าน ให้การตรวจยอดกับการตัดยอดเห็นข้อมูลชุดเดียวกัน
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(
+            f"""
+            SELECT blood_type, product_type, units
+            FROM stock
+            WHERE (blood_type, product_type) IN (VALUES {values_sql})
+            """,
+            key_params,
+        )
+        have = {(r["blood_type"], r["product_type"]): int(r["units"]) for r in cur.fetchall()}
+        shortages = [
+            (bt, pt, qty, have.get((bt, pt), 0))
+            for (bt, pt), qty in wanted.items()
+            if have.get((bt, pt), 0) < qty
+        ]
+        if shortages:
+            raise InsufficientStockError(shortages)
+
+        cur.executemany(
+            """
+            UPDATE stock SET units = units - ?, version = version + 1
+            WHERE blood_type = ? AND product_type = ?
+            """,
+            [(qty, bt, pt) for (bt, pt), qty in wanted.items()],
+        )
+        ts, ts_epoch = _stamp()
+        cur.executemany(
+            """
+            INSERT INTO stock_log(ts, ts_epoch, actor, blood_type, product_type, delta, note)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(ts, ts_epoch, actor or "", bt, pt, -qty, note or "") for (bt, pt), qty in wanted.items()],
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return {k: have[k] - wanted[k] for k in keys}
+
+
+# ------------ Units (หน่วยเลือดรายถุง) ------------
+
+UNIT_COLS = ("created_at", "exp_date", "unit_number", "blood_group", "component", "status", "note")
+
+# ชื่อผลิตภัณฑ์แบบ UI (คอลัมน์ component ในตาราง units) <-> product_type ในตาราง stock
+# Cryo ไม่มีในตาราง stock แยกกรุ๊ป จึงไม่อยู่ในแผนที่นี้
+UI_TO_DB = {
+    "LPRC": "LPRC",
+    "PRC": "PRC",
+    "FFP": "Plasma",
+    "PC": "Platelets",
+}
+DB_TO_UI = {v: k for k, v in UI_TO_DB.items()}
+
+# สถานะพร้อมจ่าย (ตรงกับ fefo.AVAILABLE_STATUSES) หน่วย "จอง" ก็นับอยู่ในสต็อก (fefo.IN_STOCK_STATUSES)
+# แต่ไม่ตั้ง Exp ระหว่างที่จองอยู่ จะหมดอายุหลังหลุดจองแล้ว
+_UNIT_AVAILABLE = ("ว่าง", "หลุดจอง")
+
+_FIND_UNITS_SQL = f"SELECT id, {', '.join(UNIT_COLS)} FROM units WHERE unit_key = ? ORDER BY id"
+_STALE_BOOKINGS_SQL = "UPDATE units SET status = 'หลุดจอง' WHERE status = 'จอง' AND created_at <= ?"
+_EXPIRED_UNITS_SQL = (
+    f"SELECT id, blood_group, component FROM units WHERE status IN ({', '.join('?' * len(_UNIT_AVAILABLE))}) "
+    "AND exp_date < ?"
+)
+
+
+def _bump(cur, name: str) -> int:
     cur.execute(
         """
-        INSERT INTO stock_log(ts, actor, blood_type, product_type, delta, note)
-        VALUES (?, ?, ?, ?, ?, ?)
+        INSERT INTO counters(name, value) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1
         """,
-        (
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            actor or "",
-            blood_type,
-            product_type,
-            int(qty),
-            note or "",
-        ),
+        (name,),
     )
+    return int(cur.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0])
 
-    conn.commit()
+
+def _today_iso(today=None) -> str:
+    return (today or datetime.now().date()).isoformat()
+
+
+def get_units_version() -> int:
+    """เวอร์ชันของตาราง units (0 = ยังไม่เคยเขียน) อ่านแถวเดียว ใช้เช็กก่อนโหลดทั้งตาราง"""
+    conn = _get_conn()
+    row = conn.execute("SELECT value FROM counters WHERE name = 'units'").fetchone()
     conn.close()
+    return int(row[0]) if row else 0
 
 
-def reset_all_stock(actor: str = "admin"):
-    """รีเซ็ต stock ทุกตัวเป็นศูนย์ + log"""
+def get_units():
+    """คืน (version, [ {id, created_at, exp_date, ...}, ... ]) อ่านใน transaction เดียวกัน"""
+    conn = _get_conn()
+    try:
+        conn.execute("BEGIN")
+        row = conn.execute("SELECT value FROM counters WHERE name = 'units'").fetchone()
+        rows = conn.execute(f"SELECT id, {', '.join(UNIT_COLS)} FROM units ORDER BY id").fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+    return (int(row[0]) if row else 0), [dict(r) for r in rows]
+
+
+def _fill_unit_keys(cur):
+    """เติม unit_key ให้แถวที่ยังไม่มี (แถวใหม่ / แถวที่เพิ่งแก้ Unit number) ใช้ idx_units_unit_key หาแถว"""
+    rows = cur.execute("SELECT id, unit_number FROM units WHERE unit_key IS NULL").fetchall()
+    cur.executemany(
+        "UPDATE units SET unit_key = ? WHERE id = ?", [(normalize_unit_number(u), i) for i, u in rows]
+    )
+
+
+def find_units(unit_number):
+    """
+    หน่วยที่ Unit number ตรงกัน (เทียบด้วย normalize_unit_number) คืน list ของ dict เรียงตาม id
+    DIN เดียวกันมีได้หลายหน่วย (คนละ component) ผู้เรียกต้องเลือกเองเมื่อได้หลายแถว
+    """
+    key = normalize_unit_number(unit_number)
+    if not key:
+        return []
+    conn = _get_conn()
+    try:
+        rows = conn.execute(_FIND_UNITS_SQL, (key,)).fetchall()
+    finally:
+        conn.close()
+    return [dict(r) for r in rows]
+
+
+def insert_units(rows):
+    """
+    เพิ่มหน่วยใหม่ rows: iterable ของ tuple ตามลำดับ UNIT_COLS
+    คืน (ids ของแถวใหม่, version ใหม่)
+    """
+    rows = [tuple(r) for r in rows]
+    conn = _get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        ids = []
+        for r in rows:
+            cur.execute(
+                f"INSERT INTO units({', '.join(UNIT_COLS)}) VALUES ({', '.join('?' * len(UNIT_COLS))})", r
+            )
+            ids.append(cur.lastrowid)
+        _fill_unit_keys(cur)
+        ver = _bump(cur, "units")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return ids, ver
+
+
+def update_unit_status(ids, status: str) -> int:
+    """เปลี่ยนสถานะหลายหน่วยตาม id (ไม่ปรับสต็อก ผู้เรียกปรับเอง) คืน version ใหม่"""
+    ids = [int(i) for i in ids]
     conn = _get_conn()
     cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.executemany("UPDATE units SET status = ? WHERE id = ?", [(status, i) for i in ids])
+        ver = _bump(cur, "units")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return ver
 
-    # log ก่อนรีเซ็ต (เก็บค่าเดิม)
-    cur.execute("SELECT blood_type, product_type, units FROM stock")
-    rows = cur.fetchall()
-    for r in rows:
-        if r["units"]:
+
+def replace_units(rows, expected_version=None) -> int:
+    """
+    บันทึกทั้งตาราง units (ใช้กับการแก้ในตาราง / นำเข้าไฟล์)
+    rows: tuple (id หรือ None, *UNIT_COLS) — id เดิม = แก้แถวนั้น, None = แถวใหม่, id ที่ไม่อยู่ใน rows = ลบ
+    (คง id เดิมไว้ unit_log จึงเห็นเฉพาะสถานะที่เปลี่ยนจริง)
+    expected_version: ถ้าตารางถูกแก้ไปแล้วตั้งแต่ผู้เรียกโหลดมา -> UnitsConflictError ไม่เขียนทับ
+    คืน version ใหม่
+    """
+    rows = [tuple(r) for r in rows]
+    cols = ", ".join(UNIT_COLS)
+    marks = ", ".join("?" * len(UNIT_COLS))
+    conn = _get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        row = cur.execute("SELECT value FROM counters WHERE name = 'units'").fetchone()
+        current = int(row[0]) if row else 0
+        if expected_version is not None and int(expected_version) != current:
+            raise UnitsConflictError(expected_version, current)
+        cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS units_in (id INTEGER, {cols})")
+        cur.execute("DELETE FROM units_in")
+        cur.executemany(f"INSERT INTO units_in VALUES (?, {marks})", rows)
+        cur.execute("DELETE FROM units WHERE id NOT IN (SELECT id FROM units_in WHERE id IS NOT NULL)")
+        changed = cur.rowcount
+        # แก้เฉพาะแถวที่ค่าต่างจากเดิม: editor ส่งทั้งตารางกลับมา แต่ต้นทุน (รวม trigger FTS / unit_log)
+        # ควรโตตามจำนวนแถวที่แก้จริง ไม่ใช่ขนาดคลัง
+        differs = " OR ".join(f"i.{c} IS NOT units.{c}" for c in UNIT_COLS)
+        cur.execute(
+            f"""
+            UPDATE units SET ({cols}) = (SELECT {cols} FROM units_in i WHERE i.id = units.id)
+            WHERE EXISTS (SELECT 1 FROM units_in i WHERE i.id = units.id AND ({differs}))
+            """
+        )
+        changed += cur.rowcount
+        cur.execute(f"INSERT INTO units({cols}) SELECT {cols} FROM units_in WHERE id IS NULL")
+        changed += cur.rowcount
+        cur.execute("DELETE FROM units_in")
+        _fill_unit_keys(cur)
+        # บันทึกโดยไม่มีอะไรเปลี่ยน: ไม่เพิ่มเวอร์ชัน (เซสชันอื่นไม่ต้องโหลดใหม่)
+        ver = _bump(cur, "units") if changed else current
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return ver
+
+
+def import_units(rows, stock_in=None, actor: str = "", note: str = "import", replace: bool = False,
+                 reset_note: str = "import_replace"):
+    """
+    นำเข้าหน่วยจากไฟล์ทั้งชุดใน transaction เดียว (สำเร็จทั้งหมดหรือไม่เปลี่ยนอะไรเลย)
+    rows: tuple ตามลำดับ UNIT_COLS; แถวเดิมที่ (unit_number, blood_group, component) ตรงกันถูกแทนที่
+    stock_in: {(blood_type, product_type): qty} รับเข้าสต็อกพร้อม log
+    replace: ลบ units ทั้งหมดและรีเซ็ตสต็อกเป็นศูนย์ (log ค่าเดิม) ก่อนนำเข้า
+    reset_note: note ของ log การรีเซ็ตนั้น (แยกจาก 'reset_all_stock' ที่ผู้ใช้กดรีเซ็ตเอง)
+    backend อื่น (เช่น memory): หน่วยเขียนลง SQLite ส่วนสต็อกเขียนผ่าน backend หลัง commit (ไม่อยู่ใน transaction เดียวกัน)
+    คืน (ids ของแถวใหม่, version ใหม่)
+    """
+    rows = [tuple(r) for r in rows]
+    stock_in = {k: int(v) for k, v in (stock_in or {}).items() if int(v)}
+    backend = get_backend()
+    conn = _get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        ts, ts_epoch = _stamp()
+        if replace:
+            cur.execute("DELETE FROM units")
+        if replace and backend is None:
             cur.execute(
                 """
-                INSERT INTO stock_log(ts, actor, blood_type, product_type, delta, note)
-                VALUES (?, ?, ?, ?, ?, ?)
+                INSERT INTO stock_log(ts, ts_epoch, actor, blood_type, product_type, delta, note)
+                SELECT ?, ?, ?, blood_type, product_type, -units, ?
+                FROM stock
+                WHERE units != 0
                 """,
-                (
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    actor,
-                    r["blood_type"],
-                    r["product_type"],
-                    -int(r["units"]),
-                    "reset_all_stock",
-                ),
-            )
-
-    # set = 0
-    cur.execute("UPDATE stock SET units = 0")
-    conn.commit()
-    conn.close()
+                (ts, ts_epoch, actor or "", reset_note),
+            )
+            cur.execute("UPDATE stock SET units = 0, version = version + 1 WHERE units != 0")
+        if not replace and rows:
+            cur.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS import_keys (unit_number TEXT, blood_group TEXT, component TEXT)"
+            )
+            cur.execute("DELETE FROM import_keys")
+            cur.execute(
+                "CREATE INDEX IF NOT EXISTS temp.idx_import_keys ON import_keys(unit_number, blood_group, component)"
+            )
+            i_un, i_bg, i_comp = (UNIT_COLS.index(c) for c in ("unit_number", "blood_group", "component"))
+            cur.executemany(
+                "INSERT INTO import_keys VALUES (?, ?, ?)",
+                [(r[i_un] or "", r[i_bg], r[i_comp]) for r in rows],
+            )
+            cur.execute(
+                """
+                DELETE FROM units
+                WHERE EXISTS (
+                    SELECT 1 FROM import_keys k
+                    WHERE k.unit_number = COALESCE(units.unit_number, '')
+                      AND k.blood_group IS units.blood_group
+                      AND k.component IS units.component
+                )
+                """
+            )
+        ids = []
+        for r in rows:
+            cur.execute(
+                f"INSERT INTO units({', '.join(UNIT_COLS)}) VALUES ({', '.join('?' * len(UNIT_COLS))})", r
+            )
+            ids.append(cur.lastrowid)
+        if stock_in and backend is None:
+            cur.executemany(
+                """
+                INSERT INTO stock(blood_type, product_type, units) VALUES (?, ?, 0)
+                ON CONFLICT(blood_type, product_type) DO NOTHING
+                """,
+                list(stock_in),
+            )
+            cur.executemany(
+                """
+                UPDATE stock SET units = units + ?, version = version + 1
+                WHERE blood_type = ? AND product_type = ?
+                """,
+                [(qty, bt, pt) for (bt, pt), qty in stock_in.items()],
+            )
+            cur.executemany(
+                """
+                INSERT INTO stock_log(ts, ts_epoch, actor, blood_type, product_type, delta, note)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(ts, ts_epoch, actor or "", bt, pt, qty, note or "") for (bt, pt), qty in stock_in.items()],
+            )
+        _fill_unit_keys(cur)
+        ver = _bump(cur, "units")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if backend is not None:
+        if replace:
+            backend.reset_stock(actor=actor, note=reset_note)
+        for (bt, pt), qty in stock_in.items():
+            backend.adjust_stock(bt, pt, qty, actor=actor, note=note)
+    return ids, ver
+
+
+def release_stale_bookings(days: int = 3, today=None) -> int:
+    """
+    หน่วย "จอง" ที่ created_at เก่ากว่า days วัน -> "หลุดจอง" (ใช้ index (status, created_at))
+    ไม่ปรับสต็อก: การจองไม่ตัดสต็อกตั้งแต่แรก (ทั้งฟอร์มบันทึกและโหมดสแกน) คืนจำนวนหน่วยที่เปลี่ยน
+    """
+    cutoff_iso = ((today or datetime.now().date()) - timedelta(days=int(days))).isoformat()
+    conn = _get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(_STALE_BOOKINGS_SQL, (cutoff_iso,))
+        n = cur.rowcount
+        if n:
+            _bump(cur, "units")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return n
+
+
+def expire_units(today=None, product_map=None, actor: str = "scheduler", note: str = "auto-expire") -> int:
+    """
+    หน่วยพร้อมจ่ายที่ exp_date < วันนี้ -> "Exp" และตัดสต็อกของ (กรุ๊ป, ผลิตภัณฑ์) นั้นใน transaction เดียวกัน
+    product_map: แปลงชื่อผลิตภัณฑ์ในตาราง units เป็น product_type ในตาราง stock (เช่น FFP -> Plasma)
+    ตัดได้ไม่เกินยอดที่มี (ยอดรวมกับรายถุงอาจไม่ตรงกัน) และ log เท่าที่ตัดจริง คืนจำนวนหน่วยที่เปลี่ยน
+    backend อื่น (เช่น memory): ตัดสต็อกผ่าน backend หลัง commit สถานะหน่วยใน SQLite
+    """
+    product_map = product_map or {}
+    backend = get_backend()
+    counts = {}
+    conn = _get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        rows = cur.execute(_EXPIRED_UNITS_SQL, (*_UNIT_AVAILABLE, _today_iso(today))).fetchall()
+        if not rows:
+            conn.commit()
+            return 0
+        cur.executemany("UPDATE units SET status = 'Exp' WHERE id = ?", [(r["id"],) for r in rows])
+        _bump(cur, "units")
+
+        for r in rows:
+            key = (r["blood_group"], product_map.get(r["component"], r["component"]))
+            counts[key] = counts.get(key, 0) + 1
+        ts, ts_epoch = _stamp()
+        for (bt, pt), n in (counts.items() if backend is None else ()):
+            have = cur.execute(
+                "SELECT units FROM stock WHERE blood_type = ? AND product_type = ?", (bt, pt)
+            ).fetchone()
+            take = min(n, int(have["units"])) if have else 0
+            if not take:
+                continue
+            cur.execute(
+                """
+                UPDATE stock SET units = units - ?, version = version + 1
+                WHERE blood_type = ? AND product_type = ?
+                """,
+                (take, bt, pt),
+            )
+            cur.execute(
+                """
+                INSERT INTO stock_log(ts, ts_epoch, actor, blood_type, product_type, delta, note)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (ts, ts_epoch, actor or "", bt, pt, -take, note or ""),
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if backend is not None:
+        for (bt, pt), n in counts.items():
+            have = backend.get_stock_row(bt, pt)
+            take = min(n, int(have["units"])) if have else 0
+            if take:
+                backend.adjust_stock(bt, pt, -take, actor=actor, note=note)
+    return len(rows)
+
+
+def acquire_lease(name: str, owner: str, ttl_s: float) -> bool:
+    """
+    ขอ lease ของงาน name เป็นเวลา ttl_s วินาที สำเร็จเมื่อยังไม่มีใครถือ หรือ lease เดิมหมดอายุแล้ว
+    (ใช้เป็น "รันได้ครั้งเดียวต่อรอบ" ข้ามทุก process ที่ใช้ DB เดียวกัน)
+    """
+    now = time.time()
+    conn = _get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            INSERT INTO job_lease(name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE job_lease.expires_at <= ?
+            """,
+            (name, owner, now + float(ttl_s), now),
+        )
+        ok = cur.rowcount == 1
+        conn.commit()
+    finally:
+        conn.close()
+    return ok
+
+
+# ------------ Reports ------------
+# ยอดรายเดือน (reports.py) อยู่ที่นี่เพื่อให้ HOT_QUERIES ตรวจข้อความเดียวกับที่รายงานรันจริง
+
+MONTH_UNIT_LOG_SQL = """
+    SELECT blood_group, component,
+           SUM(new_status = 'จ่ายแล้ว') AS issued,
+           SUM(new_status = 'Exp') AS wasted,
+           SUM(new_status = 'หลุดจอง' AND old_status = 'จอง') AS released,
+           SUM(new_status = 'จอง') AS booked
+    FROM unit_log
+    WHERE ts_epoch >= ? AND ts_epoch < ?
+    GROUP BY blood_group, component
+    """
+MONTH_STOCK_LOG_SQL = """
+    SELECT blood_type, product_type,
+           SUM(CASE WHEN delta > 0 THEN delta ELSE 0 END) AS inbound,
+           SUM(CASE WHEN delta < 0 THEN -delta ELSE 0 END) AS outbound
+    FROM stock_log
+    WHERE ts_epoch >= ? AND ts_epoch < ?
+    GROUP BY blood_type, product_type
+    """
+
+
+# ------------ Query plans ------------
+
+# query ที่รันบ่อย: (ชื่อ, SQL, พารามิเตอร์ตัวอย่าง, index ที่ต้องใช้) ตรวจด้วย check_query_plans()
+# SQL มาจากค่าคงที่ / ฟังก์ชันสร้าง SQL ตัวเดียวกับที่ฟังก์ชันจริงใช้ แก้ query แล้วตรวจได้ทันที
+HOT_QUERIES = [
+    (
+        "stock row (adjust_stock / get_stock_row)",
+        _STOCK_ROW_SQL,
+        ("A", "PRC"),
+        "sqlite_autoindex_stock_1",
+    ),
+    (
+        "stock by blood (get_stock_by_blood / get_level_history)",
+        _STOCK_BY_BLOOD_SQL,
+        ("A",),
+        "sqlite_autoindex_stock_1",
+    ),
+    (
+        "log by group + time (search_stock_log)",
+        _search_stock_log_sql(
+            "", "WHERE l.blood_type = ? AND l.product_type = ? AND l.ts_epoch >= ?", "l.id DESC"
+        ),
+        ("A", "PRC", 0, 200),
+        "idx_stock_log_bt_pt_epoch",
+    ),
+    (
+        "log time range (search_stock_log)",
+        _search_stock_log_sql("", "WHERE l.ts_epoch >= ? AND l.ts_epoch < ?", "l.id DESC"),
+        (0, 1, 200),
+        "idx_stock_log_ts_epoch",
+    ),
+    (
+        "level history (get_level_history)",
+        _level_history_sql(since=True),
+        ("A", "PRC", 0),
+        "COVERING INDEX idx_stock_log_bt_pt_epoch",
+    ),
+    (
+        "drift totals (find_stock_drift)",
+        _STOCK_DRIFT_SQL,
+        (),
+        "COVERING INDEX idx_stock_log_bt_pt_epoch",
+    ),
+    (
+        "unit status changes by month (reports)",
+        MONTH_UNIT_LOG_SQL,
+        (0, 1),
+        "idx_unit_log_ts_epoch",
+    ),
+    (
+        "stock movement by month (reports)",
+        MONTH_STOCK_LOG_SQL,
+        (0, 1),
+        "idx_stock_log_ts_epoch",
+    ),
+    (
+        "stale bookings (release_stale_bookings)",
+        _STALE_BOOKINGS_SQL,
+        ("2000-01-01",),
+        "idx_units_status_created",
+    ),
+    (
+        "unit by number (find_units / scan)",
+        _FIND_UNITS_SQL,
+        ("W000000000000",),
+        "idx_units_unit_key",
+    ),
+    (
+        "expired units (expire_units)",
+        _EXPIRED_UNITS_SQL,
+        (*_UNIT_AVAILABLE, "2000-01-01"),
+        "idx_units_status_exp",
+    ),
+]
+
+
+def check_query_plans():
+    """
+    EXPLAIN QUERY PLAN ของทุก HOT_QUERIES คืน list ของ dict { name, index, ok, plan }
+    ok = แผนอ้างถึง index ที่คาดไว้ (ไม่ตกไปเป็น SCAN ทั้งตาราง)
+    """
+    conn = _get_conn()
+    out = []
+    try:
+        for name, sql, params, index in HOT_QUERIES:
+            plan = " | ".join(r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+            out.append({"name": name, "index": index, "ok": index in plan, "plan": plan})
+    finally:
+        conn.close()
+    return out
+
+
+def main(argv=None):
+    import argparse
+
+    global DB_PATH
+    p = argparse.ArgumentParser(description="อัปเกรด schema ของ DB และตรวจว่า query ที่รันบ่อยใช้ index")
+    p.add_argument("--db", default=DB_PATH, help="ไฟล์ DB")
+    p.add_argument("--check", action="store_true", help="ตรวจ query plan ของ HOT_QUERIES (ผิด -> exit code 1)")
+    args = p.parse_args(argv)
+
+    DB_PATH = args.db
+    before = get_schema_version()
+    applied = init_db()
+    print(f"schema version {before} -> {get_schema_version()} (applied: {applied or 'none'})")
+    if args.check:
+        bad = 0
+        for r in check_query_plans():
+            bad += not r["ok"]
+            print(f"[{'ok' if r['ok'] else 'FAIL'}] {r['name']}: {r['plan']}")
+        raise SystemExit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
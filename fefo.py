@@ -0,0 +1,149 @@
+# fefo.py
+"""
+FEFO (First-Expired, First-Out) allocation engine
+
+เก็บ heap ของหน่วยเลือดที่พร้อมจ่ายแยกตาม (group, component) เรียงตามวันหมดอายุ
+แนะนำ / จองหน่วยที่หมดอายุก่อนได้ใน O(log n) ต่อคำขอ
+การลบหน่วยออก (จ่าย / จอง / แก้สถานะ) ใช้ lazy deletion: ทำเครื่องหมายไว้
+แล้วทิ้งจริงตอนที่หน่วยนั้นขึ้นมาอยู่บนสุดของ heap
+"""
+import heapq
+from datetime import date, datetime
+
+from isbt import normalize_unit_number
+
+# สถานะที่ถือว่า "อยู่ในคลัง พร้อมจ่าย" (หน่วยที่ FEFO แนะนำ / จองได้)
+AVAILABLE_STATUSES = ("ว่าง", "หลุดจอง")
+# สถานะที่นับอยู่ในยอดสต็อก: การจองไม่ตัด / ไม่คืนสต็อก หน่วย "จอง" จึงยังนับอยู่ในคลัง
+IN_STOCK_STATUSES = AVAILABLE_STATUSES + ("จอง",)
+
+
+def _key(unit_number, group, component):
+    return normalize_unit_number(unit_number), str(group or "").strip(), str(component or "").strip()
+
+
+def _to_date(x):
+    if x is None or x != x:  # None / NaN / NaT
+        return None
+    if isinstance(x, datetime):
+        return x.date()
+    if isinstance(x, date):
+        return x
+    if hasattr(x, "to_pydatetime"):  # pandas.Timestamp
+        return x.to_pydatetime().date()
+    s = str(x or "").strip()
+    for fmt in ("%Y/%m/%d", "%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(s, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+class FefoIndex:
+    """
+    หน่วยหนึ่งระบุด้วย (unit_number, group, component): DIN เดียวกันใช้กับทุก component
+    ที่แยกจากการบริจาคครั้งเดียว จึงใช้ unit_number อย่างเดียวเป็นคีย์ไม่ได้
+    """
+
+    def __init__(self):
+        self._heaps = {}   # (group, component) -> [(exp_date, seq, unit_number), ...]
+        self._live = {}    # (unit_number (normalize_unit_number), group, component) -> (exp_date, seq)
+        self._seq = 0
+
+    @classmethod
+    def from_entries(cls, df):
+        """สร้างจากตาราง entries (ใช้เฉพาะแถวที่สถานะพร้อมจ่ายและมี Unit number + Exp date)"""
+        idx = cls()
+        if df is None or df.empty:
+            return idx
+        avail = df[df["Status"].astype(str).isin(AVAILABLE_STATUSES)]
+        for unit, grp, comp, exp in zip(
+            avail["Unit number"], avail["Group"], avail["Blood Components"], avail["Exp date"]
+        ):
+            idx._push(_key(unit, grp, comp), _to_date(exp))
+        for heap in idx._heaps.values():
+            heapq.heapify(heap)
+        return idx
+
+    def __len__(self):
+        return len(self._live)
+
+    def __contains__(self, item):
+        """item = (unit_number, group, component)"""
+        return _key(*item) in self._live
+
+    # ------------ internal ------------
+
+    def _push(self, key, exp):
+        """เพิ่มท้าย list (ยังไม่ heapify) ใช้ตอนสร้างทีละมาก"""
+        unit, group, component = key
+        if not unit or exp is None:
+            return False
+        self._seq += 1
+        self._live[key] = (exp, self._seq)
+        self._heaps.setdefault((group, component), []).append((exp, self._seq, unit))
+        return True
+
+    def _is_live(self, gc, item):
+        exp, seq, unit = item
+        cur = self._live.get((unit, *gc))
+        return cur is not None and cur[1] == seq
+
+    def _top(self, gc):
+        heap = self._heaps.get(gc)
+        while heap and not self._is_live(gc, heap[0]):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    # ------------ API ------------
+
+    def add(self, unit_number, group, component, exp_date):
+        """เพิ่ม / อัปเดตหน่วยพร้อมจ่าย (ถ้ามีอยู่แล้วจะแทนที่ข้อมูลเดิม)"""
+        key = _key(unit_number, group, component)
+        exp = _to_date(exp_date)
+        if not key[0] or exp is None:
+            return False
+        self._seq += 1
+        self._live[key] = (exp, self._seq)
+        heapq.heappush(self._heaps.setdefault(key[1:], []), (exp, self._seq, key[0]))
+        return True
+
+    def discard(self, unit_number, group, component):
+        """เอาหน่วยออกจากรายการพร้อมจ่าย (O(1), ลบจาก heap ภายหลัง)"""
+        return self._live.pop(_key(unit_number, group, component), None) is not None
+
+    def suggest(self, group, component, k: int = 1, today=None):
+        """
+        คืน k หน่วยแรกที่หมดอายุก่อน [(unit_number, exp_date), ...] โดยไม่ตัดออกจาก index
+        หน่วยที่หมดอายุแล้ว (exp < today) จะถูกข้าม
+        """
+        today = today or date.today()
+        key = (str(group or "").strip(), str(component or "").strip())
+        taken = []
+        out = []
+        while len(out) < k:
+            top = self._top(key)
+            if top is None:
+                break
+            taken.append(heapq.heappop(self._heaps[key]))
+            if top[0] >= today:
+                out.append((top[2], top[0]))
+        for item in taken:
+            heapq.heappush(self._heaps[key], item)
+        return out
+
+    def reserve(self, group, component, today=None):
+        """จองหน่วยที่หมดอายุก่อนที่สุด (ยังไม่หมดอายุ) แล้วตัดออกจาก index คืน (unit_number, exp_date) หรือ None"""
+        picked = self.suggest(group, component, k=1, today=today)
+        if not picked:
+            return None
+        self.discard(picked[0][0], group, component)
+        return picked[0]
+
+    def expired(self, today=None):
+        """หน่วยที่ยังอยู่ในสถานะพร้อมจ่ายแต่เลยวันหมดอายุแล้ว [(unit_number, group, component, exp_date)]"""
+        today = today or date.today()
+        return sorted(
+            (u, g, c, e) for (u, g, c), (e, _s) in self._live.items() if e < today
+        )
@@ -0,0 +1,261 @@
+# importer.py
+"""
+อ่านไฟล์นำเข้า (Excel / CSV) เป็นตาราง entries พร้อม cache บนดิสก์ตามเนื้อหาไฟล์
+
+- ตัวตนของไฟล์ = hash ของเนื้อหา (อ่านทีละก้อน ไม่โหลดทั้งไฟล์ซ้ำ) ไม่ใช่ชื่อ + ขนาด
+  ไฟล์ต่างกันที่ชื่อและขนาดเท่ากันจึงไม่ถูกข้าม
+- ผล parse + normalize (ชื่อคอลัมน์, สถานะอังกฤษ -> ไทย) เก็บใน BLOOD_IMPORT_CACHE_DIR ตาม hash
+  อัปโหลดไฟล์เดิมซ้ำ (เซสชันไหนก็ได้ ใน process ไหนก็ได้ที่ใช้โฟลเดอร์เดียวกัน) ไม่ต้อง parse ใหม่
+- เกินขนาดที่กำหนด (BLOOD_IMPORT_CACHE_MB) ลบไฟล์ที่ไม่ได้ใช้นานสุดก่อน (LRU ตาม mtime)
+- นำเข้าหลายไฟล์ (load_many): ไฟล์ที่ไม่อยู่ใน cache parse พร้อมกันใน process pool
+  (openpyxl ใช้ CPU ล้วน thread ช่วยไม่ได้เพราะ GIL) จำนวน worker = BLOOD_IMPORT_WORKERS หรือจำนวนคอร์
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+CACHE_DIR = os.environ.get("BLOOD_IMPORT_CACHE_DIR", ".import_cache")
+CACHE_MAX_BYTES = int(float(os.environ.get("BLOOD_IMPORT_CACHE_MB", "256")) * 1024 * 1024)
+# เปลี่ยนเมื่อกติกา normalize เปลี่ยน (cache เก่าจะไม่ถูกใช้)
+PARSER_VERSION = "2"
+CHUNK = 1 << 20
+MAX_WORKERS = int(os.environ.get("BLOOD_IMPORT_WORKERS", "0") or 0) or (os.cpu_count() or 1)
+
+IMPORT_COLS = ["created_at", "Exp date", "Unit number", "Group", "Blood Components", "Status", "บันทึก"]
+
+COL_MAP = {
+    "created_at": "created_at",
+    "Created": "created_at",
+    "Created at": "created_at",
+    "Exp date": "Exp date",
+    "Exp": "Exp date",
+    "exp_date": "Exp date",
+    "Unit": "Unit number",
+    "Unit number": "Unit number",
+    "Group": "Group",
+    "Blood Components": "Blood Components",
+    "Components": "Blood Components",
+    "Status": "Status",
+    "Note": "บันทึก",
+    "Remarks": "บันทึก",
+    "บันทึก": "บันทึก",
+}
+
+# แถวที่ key ซ้ำกันถือเป็นหน่วยเดียวกัน (ไฟล์ / แถวที่มาทีหลังชนะ)
+DEDUP_KEY = ["Unit number", "Group", "Blood Components"]
+
+STATUS_MAP_EN2TH = {
+    "Available": "ว่าง",
+    "ReadyToIssue": "จอง",
+    "Released": "จ่ายแล้ว",
+    "Expired": "Exp",
+    "ReleasedExpired": "Exp",
+    "Out": "จ่ายแล้ว",
+}
+
+
+def file_kind(name: str) -> str:
+    return "csv" if str(name).lower().endswith(".csv") else "excel"
+
+
+def hash_upload(fileobj) -> str:
+    """blake2b ของเนื้อหาไฟล์ (อ่านทีละ CHUNK) แล้วกรอกลับตำแหน่งเดิม"""
+    h = hashlib.blake2b(digest_size=20)
+    pos = fileobj.tell()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(CHUNK), b""):
+        h.update(block)
+    fileobj.seek(pos)
+    return h.hexdigest()
+
+
+def normalize(df_file):
+    """ชื่อคอลัมน์ตาม COL_MAP, สถานะอังกฤษ -> ไทย, คอลัมน์ครบตาม IMPORT_COLS (ไม่แปลงชนิด)"""
+    df_file = df_file.rename(columns={c: COL_MAP.get(str(c).strip(), c) for c in df_file.columns})
+    if "Status" in df_file.columns:
+        # ช่องว่าง (NaN) คงเป็นค่าว่าง ไม่ใช่ข้อความ "nan" ให้ผู้เรียกใส่ค่าเริ่มต้นได้
+        status = df_file["Status"].fillna("").astype(str).str.strip()
+        df_file["Status"] = status.map(lambda s: STATUS_MAP_EN2TH.get(s, s))
+    for c in IMPORT_COLS:
+        if c not in df_file.columns:
+            df_file[c] = ""
+    return df_file[IMPORT_COLS].copy()
+
+
+def parse_upload(fileobj, name: str):
+    """อ่าน + normalize (ไม่ใช้ cache) อ่าน Excel ไม่ได้ (เช่นไม่มี openpyxl) จะ raise ต่อให้ผู้เรียก"""
+    fileobj.seek(0)
+    if file_kind(name) == "csv":
+        df_file = pd.read_csv(fileobj)
+    else:
+        df_file = pd.read_excel(fileobj)
+    if df_file.empty:
+        return df_file
+    return normalize(df_file)
+
+
+def parse_bytes(data: bytes, name: str):
+    """parse_upload สำหรับ worker ใน process pool (รับ / คืนค่าที่ pickle ได้)"""
+    return parse_upload(io.BytesIO(data), name)
+
+
+class UploadCache:
+    """ผล parse ต่อ hash เป็นไฟล์ pickle ในโฟลเดอร์เดียว (เขียนแบบ atomic)"""
+
+    def __init__(self, directory: str = None, max_bytes: int = None):
+        self.directory = directory or CACHE_DIR
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            df = pd.read_pickle(path)
+        except (OSError, EOFError, ValueError):
+            return None
+        try:
+            os.utime(path)  # ใช้ล่าสุด (LRU)
+        except OSError:
+            pass
+        return df
+
+    def put(self, key: str, df):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                df.to_pickle(f)
+            os.replace(tmp, self._path(key))
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        """ลบไฟล์ที่ใช้ล่าสุดนานที่สุดจนขนาดรวมไม่เกิน max_bytes"""
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(".pkl")]
+        except OSError:
+            return
+        files = []
+        for n in names:
+            path = os.path.join(self.directory, n)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _m, size, _p in files)
+        for _mtime, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def load_upload(fileobj, name: str, digest: str = None, cache: UploadCache = None):
+    """
+    คืน (digest, df, from_cache): df คือผล parse + normalize ของไฟล์ (ห้ามแก้ไข ให้ copy ก่อนถ้าจะแก้)
+    digest ส่งมาได้ถ้าคำนวณไว้แล้ว
+    """
+    digest = digest or hash_upload(fileobj)
+    cache = cache or UploadCache()
+    key = f"v{PARSER_VERSION}-{file_kind(name)}-{digest}"
+    df = cache.get(key)
+    if df is not None:
+        return digest, df, True
+    df = parse_upload(fileobj, name)
+    try:
+        cache.put(key, df)
+    except OSError:
+        pass  # เขียน cache ไม่ได้ (ดิสก์เต็ม / อ่านอย่างเดียว) ไม่กระทบการนำเข้า
+    return digest, df, False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """process pool ของ process นี้ (สร้างครั้งแรกที่ใช้ แล้วใช้ซ้ำ: ไม่ต้องเสียเวลา import pandas ทุกครั้ง)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: ไม่ fork process ของเซิร์ฟเวอร์ที่มีหลาย thread
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def load_many(files, cache: UploadCache = None, digests=None):
+    """
+    อ่านหลายไฟล์ files: [(name, bytes), ...] คืน list ตามลำดับเดิม
+    [(name, digest, df หรือ Exception, from_cache), ...] ไฟล์ที่อ่านไม่ได้ไม่ทำให้ไฟล์อื่นล้ม
+    digests: hash ที่คำนวณไว้แล้ว (ลำดับเดียวกับ files) ถ้ามี
+    """
+    cache = cache or UploadCache()
+    out = []
+    misses = []  # (ตำแหน่งใน out, key)
+    for i, (name, data) in enumerate(files):
+        digest = (digests[i] if digests else None) or hash_upload(io.BytesIO(data))
+        key = f"v{PARSER_VERSION}-{file_kind(name)}-{digest}"
+        df = cache.get(key)
+        out.append([name, digest, df, df is not None])
+        if df is None:
+            misses.append((i, key))
+
+    results = []
+    if len(misses) == 1 or MAX_WORKERS <= 1:
+        for i, _key in misses:
+            try:
+                results.append(parse_bytes(files[i][1], files[i][0]))
+            except Exception as e:
+                results.append(e)
+    elif misses:
+        futures = [_get_pool().submit(parse_bytes, files[i][1], files[i][0]) for i, _key in misses]
+        for f in futures:
+            try:
+                results.append(f.result())
+            except Exception as e:
+                results.append(e)
+
+    for (i, key), res in zip(misses, results):
+        out[i][2] = res
+        if not isinstance(res, Exception):
+            try:
+                cache.put(key, res)
+            except OSError:
+                pass
+    return [tuple(r) for r in out]
+
+
+def merge_batch(results):
+    """
+    รวมผลจาก load_many เป็นชุดเดียว: เรียงตามชื่อไฟล์ (export รายวันตั้งชื่อตามวันที่) แล้วตามลำดับแถว
+    ไฟล์เนื้อหาซ้ำกันนับครั้งเดียว แถว key ซ้ำ (DEDUP_KEY) เก็บแถวหลังสุด
+    คืน (df, จำนวนแถวก่อน dedupe)
+    """
+    seen, frames = set(), []
+    for name, digest, df, _hit in sorted(results, key=lambda r: str(r[0])):
+        if isinstance(df, Exception) or df is None or df.empty or digest in seen:
+            continue
+        seen.add(digest)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=IMPORT_COLS), 0
+    batch = pd.concat(frames, ignore_index=True)
+    n_raw = len(batch)
+    key = batch[DEDUP_KEY].fillna("").astype(str).apply(lambda c: c.str.strip())
+    batch = batch[~key.duplicated(keep="last")].reset_index(drop=True)
+    return batch, n_raw
@@ -0,0 +1,77 @@
+# isbt.py
+"""
+แปลงข้อความจากเครื่องสแกนบาร์โค้ด (รูปแบบ ISBT 128) เป็นข้อมูลหน่วยเลือด
+
+รองรับ data structure ที่พบบนฉลากบ่อย:
+    =ppppyynnnnnnff   Donation Identification Number (DIN) 13 ตัว + flag 2 ตัว
+    =%ggre            ABO / RhD
+    =<ccccc dd        Product code
+    =>cyyjjj          วันหมดอายุ (ปีแบบ 3 หลัก + วันจูเลียน)
+    &>cyyjjjhhmm      วันและเวลาหมดอายุ
+ข้อความที่ไม่ใช่ ISBT 128 จะถือว่าเป็นเลข Unit number ของหน่วยงานทั้งข้อความ
+"""
+import re
+from datetime import date, timedelta
+
+# ABO/RhD 2 ตัวแรกของ =%ggre
+ABO_RH_CODES = {
+    "95": ("O", "-"),
+    "51": ("O", "+"),
+    "06": ("A", "-"),
+    "62": ("A", "+"),
+    "17": ("B", "-"),
+    "73": ("B", "+"),
+    "28": ("AB", "-"),
+    "84": ("AB", "+"),
+}
+
+_DIN_RE = re.compile(r"^=?([A-NP-Z][0-9]{4}[0-9]{2}[0-9]{6})([0-9A-Z*]{2})?$")
+_ABO_RE = re.compile(r"^=%([0-9]{2})([0-9A-Z]{2})$")
+_PRODUCT_RE = re.compile(r"^=<([A-Z][0-9]{4})([0-9A-Z]{3})$")
+_EXP_RE = re.compile(r"^(=>|&>)([0-9])([0-9]{2})([0-9]{3})([0-9]{4})?$")
+
+
+def normalize_unit_number(text) -> str:
+    """คีย์มาตรฐานของ Unit number: ตัวพิมพ์ใหญ่ ไม่มีช่องว่าง (DIN ISBT ตัด '=' และ flag ออก)"""
+    s = re.sub(r"\s+", "", str(text or "")).upper()
+    m = _DIN_RE.match(s)
+    if m and (s.startswith("=") or len(s) in (13, 15)):
+        return m.group(1)
+    return s
+
+
+def _julian(c, yy, jjj):
+    # ISBT ใช้ปี 3 หลัก (cyy): ศตวรรษ c=0 -> 2000
+    year = 2000 + int(c) * 100 + int(yy)
+    return date(year, 1, 1) + timedelta(days=int(jjj) - 1)
+
+
+def parse_scan(text) -> dict:
+    """
+    แยกข้อความสแกน (1 หรือหลาย data structure ต่อกัน คั่นด้วยช่องว่าง / ขึ้นบรรทัดใหม่)
+    คืน dict: unit_number, group, rh, product_code, exp_date, isbt (bool)
+    """
+    out = {"unit_number": "", "group": None, "rh": None, "product_code": None, "exp_date": None, "isbt": False}
+    parts = [p for p in re.split(r"[\s\r\n]+", str(text or "").strip().upper()) if p]
+    for p in parts:
+        if p.startswith("=%") and _ABO_RE.match(p):
+            grp = ABO_RH_CODES.get(_ABO_RE.match(p).group(1))
+            if grp:
+                out["group"], out["rh"] = grp
+            out["isbt"] = True
+        elif p.startswith("=<") and _PRODUCT_RE.match(p):
+            out["product_code"] = _PRODUCT_RE.match(p).group(1)
+            out["isbt"] = True
+        elif p[:2] in ("=>", "&>") and _EXP_RE.match(p):
+            _di, c, yy, jjj, _hhmm = _EXP_RE.match(p).groups()
+            try:
+                out["exp_date"] = _julian(c, yy, jjj)
+                out["isbt"] = True
+            except ValueError:
+                pass
+        elif p.startswith("=") and _DIN_RE.match(p):
+            out["unit_number"] = _DIN_RE.match(p).group(1)
+            out["isbt"] = True
+        elif not out["unit_number"]:
+            out["unit_number"] = normalize_unit_number(p)
+    return out
@@ -0,0 +1,263 @@
+# loadtest.py
+"""
+ทดสอบโหลดฐานข้อมูล: จำลองจอแดชบอร์ด N จอ (ผู้อ่าน) + จุดสแกน/บันทึก M จุด (ผู้เขียน)
+ทำงานพร้อมกันบน "สำเนาชั่วคราว" ของ blood.db แล้วรายงาน
+throughput, tail latency, lock-wait error และขนาด WAL ที่โตขึ้น
+
+ตัวอย่าง:
+    python loadtest.py --readers 20 --writers 4 --duration 30
+    python loadtest.py --apptest 6 --writers 2 --duration 60 --json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import db
+
+BLOOD_TYPES = ["A", "B", "O", "AB"]
+PRODUCT_TYPES = ["LPRC", "PRC", "Plasma", "Platelets"]
+
+
+# ------------ Helpers ------------
+
+def _percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def _is_lock_error(exc) -> bool:
+    msg = str(exc).lower()
+    return isinstance(exc, sqlite3.OperationalError) and ("locked" in msg or "busy" in msg)
+
+
+def _wal_size(path: str) -> int:
+    try:
+        return os.path.getsize(path + "-wal")
+    except OSError:
+        return 0
+
+
+def prepare_db_copy(source: str, workdir: str, journal_mode: str = "") -> str:
+    """คัดลอก DB ต้นทางแบบ consistent ด้วย backup API ไปไว้ในโฟลเดอร์ชั่วคราว"""
+    target = os.path.join(workdir, "blood_loadtest.db")
+    if os.path.exists(source):
+        src = sqlite3.connect(source)
+        dst = sqlite3.connect(target)
+        src.backup(dst)
+        src.close()
+        dst.close()
+
+    # ชี้ db.py ไปที่สำเนา (ทั้ง module และ env สำหรับ app.py ใน AppTest)
+    db.DB_PATH = target
+    os.environ["BLOOD_DB_PATH"] = target
+    db.init_db()
+
+    if journal_mode:
+        conn = sqlite3.connect(target)
+        conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+        conn.close()
+    return target
+
+
+class Recorder:
+    """เก็บ latency / error ของแต่ละบทบาท (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def ok(self, role, seconds):
+        with self._lock:
+            self.latencies.setdefault(role, []).append(seconds)
+
+    def fail(self, role, exc):
+        kind = "lock_wait" if _is_lock_error(exc) else type(exc).__name__
+        with self._lock:
+            bucket = self.errors.setdefault(role, {})
+            bucket[kind] = bucket.get(kind, 0) + 1
+
+
+# ------------ Workers ------------
+
+def render_once():
+    """รูปแบบการอ่านของการเรนเดอร์แดชบอร์ด 1 รอบ: ยอดรวมทุกกรุ๊ป + รายละเอียดแต่ละกรุ๊ป"""
+    db.get_all_status()
+    for bt in BLOOD_TYPES:
+        db.get_stock_by_blood(bt)
+
+
+def reader_loop(rec, stop, think_s):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            render_once()
+            rec.ok("reader", time.perf_counter() - t0)
+        except Exception as e:
+            rec.fail("reader", e)
+        if think_s:
+            time.sleep(think_s)
+
+
+def writer_loop(rec, stop, think_s, seed):
+    rnd = random.Random(seed)
+    while not stop.is_set():
+        bt = rnd.choice(BLOOD_TYPES)
+        pt = rnd.choice(PRODUCT_TYPES)
+        qty = rnd.choice([1, 1, 1, -1])
+        t0 = time.perf_counter()
+        try:
+            db.adjust_stock(bt, pt, qty, actor="loadtest", note="loadtest")
+            rec.ok("writer", time.perf_counter() - t0)
+        except Exception as e:
+            rec.fail("writer", e)
+        if think_s:
+            time.sleep(think_s)
+
+
+def apptest_loop(rec, stop, think_s, app_path):
+    """เซสชัน Streamlit แบบ headless (AppTest) ที่รีรันหน้าแดชบอร์ดซ้ำ ๆ"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app_path, default_timeout=60)
+    at.session_state["logged_in"] = True
+    at.session_state["page"] = "แดชบอร์ดคลังเลือด"
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            at.run()
+            if at.exception:
+                raise RuntimeError(at.exception[0].message)
+            rec.ok("apptest", time.perf_counter() - t0)
+        except Exception as e:
+            rec.fail("apptest", e)
+        if think_s:
+            time.sleep(think_s)
+
+
+# ------------ Runner ------------
+
+def run_load(readers=8, writers=2, apptest=0, duration=10.0, think_ms=0.0,
+             source=None, journal_mode="", app_path="app.py", seed=0):
+    """รันโหลดทดสอบแล้วคืน dict ผลลัพธ์ (ไม่แตะไฟล์ DB ต้นทาง)"""
+    source = source or os.environ.get("BLOOD_DB_PATH", "blood.db")
+    workdir = tempfile.mkdtemp(prefix="blood_loadtest_")
+    old_path, old_env = db.DB_PATH, os.environ.get("BLOOD_DB_PATH")
+    try:
+        target = prepare_db_copy(source, workdir, journal_mode)
+        conn = sqlite3.connect(target)
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.close()
+
+        rec = Recorder()
+        stop = threading.Event()
+        think_s = think_ms / 1000.0
+        threads = []
+        for _ in range(readers):
+            threads.append(threading.Thread(target=reader_loop, args=(rec, stop, think_s)))
+        for i in range(writers):
+            threads.append(threading.Thread(target=writer_loop, args=(rec, stop, think_s, seed + i)))
+        for _ in range(apptest):
+            threads.append(threading.Thread(target=apptest_loop, args=(rec, stop, think_s, app_path)))
+
+        wal_start = wal_peak = _wal_size(target)
+        t0 = time.perf_counter()
+        for t in threads:
+            t.daemon = True
+            t.start()
+        while time.perf_counter() - t0 < duration:
+            time.sleep(0.1)
+            wal_peak = max(wal_peak, _wal_size(target))
+        stop.set()
+        elapsed = time.perf_counter() - t0
+        for t in threads:
+            t.join(timeout=30)
+        wal_end = _wal_size(target)
+
+        roles = {}
+        for role in sorted(set(rec.latencies) | set(rec.errors)):
+            lat = sorted(rec.latencies.get(role, []))
+            roles[role] = {
+                "ops": len(lat),
+                "ops_per_s": round(len(lat) / elapsed, 1) if elapsed else 0.0,
+                "p50_ms": round(_percentile(lat, 50) * 1000, 2),
+                "p95_ms": round(_percentile(lat, 95) * 1000, 2),
+                "p99_ms": round(_percentile(lat, 99) * 1000, 2),
+                "max_ms": round((lat[-1] if lat else 0.0) * 1000, 2),
+                "errors": rec.errors.get(role, {}),
+            }
+        return {
+            "readers": readers,
+            "writers": writers,
+            "apptest_sessions": apptest,
+            "duration_s": round(elapsed, 2),
+            "journal_mode": mode,
+            "wal_bytes": {"start": wal_start, "peak": wal_peak, "end": wal_end},
+            "roles": roles,
+        }
+    finally:
+        db.DB_PATH = old_path
+        if old_env is None:
+            os.environ.pop("BLOOD_DB_PATH", None)
+        else:
+            os.environ["BLOOD_DB_PATH"] = old_env
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_report(res: dict) -> str:
+    lines = [
+        f"readers={res['readers']} writers={res['writers']} apptest={res['apptest_sessions']} "
+        f"duration={res['duration_s']}s journal_mode={res['journal_mode']}",
+        f"{'role':<8} {'ops':>8} {'ops/s':>9} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'maxms':>8}  errors",
+    ]
+    for role, r in res["roles"].items():
+        errs = ", ".join(f"{k}={v}" for k, v in r["errors"].items()) or "-"
+        lines.append(
+            f"{role:<8} {r['ops']:>8} {r['ops_per_s']:>9} {r['p50_ms']:>8} "
+            f"{r['p95_ms']:>8} {r['p99_ms']:>8} {r['max_ms']:>8}  {errs}"
+        )
+    wal = res["wal_bytes"]
+    lines.append(f"WAL bytes: start={wal['start']} peak={wal['peak']} end={wal['end']}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Load test สำหรับ Blood Stock Real-time Monitor")
+    p.add_argument("--readers", type=int, default=8, help="จำนวนผู้อ่าน (จอแดชบอร์ด) พร้อมกัน")
+    p.add_argument("--writers", type=int, default=2, help="จำนวนผู้เขียน (adjust_stock) พร้อมกัน")
+    p.add_argument("--apptest", type=int, default=0, help="จำนวนเซสชัน streamlit.testing AppTest")
+    p.add_argument("--duration", type=float, default=10.0, help="ระยะเวลาทดสอบ (วินาที)")
+    p.add_argument("--think-ms", type=float, default=0.0, help="เวลาพักระหว่างแต่ละ operation (ms)")
+    p.add_argument("--source", default=None, help="ไฟล์ DB ต้นทาง (ค่าเริ่มต้น BLOOD_DB_PATH / blood.db)")
+    p.add_argument("--journal-mode", default="", help="บังคับ journal mode ของสำเนา เช่น wal / delete")
+    p.add_argument("--app", default="app.py", help="ไฟล์แอปสำหรับโหมด AppTest")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--json", action="store_true", help="พิมพ์ผลเป็น JSON")
+    args = p.parse_args(argv)
+
+    res = run_load(
+        readers=args.readers,
+        writers=args.writers,
+        apptest=args.apptest,
+        duration=args.duration,
+        think_ms=args.think_ms,
+        source=args.source,
+        journal_mode=args.journal_mode,
+        app_path=args.app,
+        seed=args.seed,
+    )
+    print(json.dumps(res, ensure_ascii=False, indent=2) if args.json else format_report(res))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# lttb.py
+"""
+ลดจำนวนจุดของกราฟเส้นด้วย Largest-Triangle-Three-Buckets (Steinarsson, 2013)
+
+แบ่งจุดกลางเป็น n_out - 2 ช่วงเท่า ๆ กัน แต่ละช่วงเลือกจุดเดียวที่ทำสามเหลี่ยมใหญ่สุดกับ
+จุดที่เลือกในช่วงก่อนหน้าและค่าเฉลี่ยของช่วงถัดไป จุดแรก / จุดสุดท้ายเก็บไว้เสมอ
+ผลคือรูปร่างของกราฟ (รวมถึงยอดแหลม / ดิ่งวูบ) ยังอยู่ ขณะที่จำนวนจุดคงที่ไม่ว่าข้อมูลจะยาวเท่าไร
+"""
+import numpy as np
+
+
+def lttb_indices(x, y, n_out: int):
+    """
+    ตำแหน่งของจุดที่เลือก (เรียงจากน้อยไปมาก) จาก x, y ที่เรียงตาม x แล้ว
+    จุดน้อยกว่า / เท่ากับ n_out (หรือ n_out < 3) คืนทุกตำแหน่ง
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (n_out - 2)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0] = a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        # ช่วงสุดท้ายใช้จุดสุดท้ายเป็นจุดอ้างอิงถัดไป
+        avg_x = x[end:nxt_end].mean() if nxt_end > end else x[-1]
+        avg_y = y[end:nxt_end].mean() if nxt_end > end else y[-1]
+        # พื้นที่ x2 ของสามเหลี่ยม (จุดก่อนหน้า, จุดในช่วงนี้, ค่าเฉลี่ยช่วงถัดไป)
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        out[i + 1] = a
+    out[-1] = n - 1
+    return out
+
+
+def lttb(x, y, n_out: int):
+    """คืน (x, y) ที่ลดเหลือไม่เกิน n_out จุดเป็น numpy array"""
+    idx = lttb_indices(x, y, n_out)
+    return np.asarray(x)[idx], np.asarray(y)[idx]
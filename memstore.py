@@ -0,0 +1,226 @@
+# memstore.py
+"""
+Storage backend แบบ in-memory (ไม่มี disk I/O) สำหรับเทส / benchmark / simulation
+
+มีเมธอดชุดเดียวกับฟังก์ชัน @_pluggable ใน db.py และให้ผลลัพธ์ / error เหมือน SQLite:
+    get_all_status, get_stock_by_blood, get_stock_row, get_stock_version, adjust_stock,
+    find_stock_drift, reset_all_stock, reset_stock, transfer_stock,
+    set_stock_levels, issue_order, get_level_history
+(init_db ของ backend ถูกเรียกจาก db.init_db ก่อน migrate SQLite)
+
+ครอบคลุมเฉพาะ API สต็อก: ตารางหน่วยเลือด (units / unit_log), counters, job_lease (scheduler),
+การค้นหา FTS และรายงาน ยังอ่าน / เขียนไฟล์ SQLite ที่ BLOOD_DB_PATH เสมอ
+db.import_units / db.expire_units เขียนหน่วยลง SQLite แล้วปรับสต็อกผ่าน backend นี้
+
+เลือกใช้ทั้ง process ด้วย BLOOD_DB_BACKEND=memory หรือ db.set_backend(MemoryBackend(...))
+"""
+import itertools
+import sqlite3
+import threading
+
+from db import InsufficientStockError, StockConflictError, _now, to_epoch
+
+
+class MemoryBackend:
+    """
+    สต็อกเก็บใน dict {(blood_type, product_type): [units, version]}
+    log เป็น list แบบ append-only ของ tuple เรียงตามคอลัมน์ stock_log
+    (id, ts, actor, blood_type, product_type, delta, note)
+    """
+
+    def __init__(self, levels=None):
+        self._lock = threading.RLock()
+        self._stock = {}
+        self._log = []
+        for bt, pt, units in levels or []:
+            self._stock[(bt, pt)] = [max(int(units), 0), 0]
+
+    @classmethod
+    def from_sqlite(cls, path: str, at=None):
+        """
+        โหลดยอดสต็อกจากไฟล์ SQLite (ไม่โหลด log)
+        at: ยอด ณ เวลานั้น (ยอดปัจจุบัน - ผลรวม delta ที่ log ตั้งแต่ at) แบบเดียวกับ db.get_level_history
+        None = ยอดปัจจุบัน
+        """
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            if at is None:
+                rows = conn.execute("SELECT blood_type, product_type, units FROM stock").fetchall()
+            else:
+                rows = conn.execute(
+                    """
+                    SELECT s.blood_type, s.product_type, s.units - COALESCE(l.after, 0)
+                    FROM stock s
+                    LEFT JOIN (
+                        SELECT blood_type, product_type, SUM(delta) AS after
+                        FROM stock_log
+                        WHERE ts_epoch >= ?
+                        GROUP BY blood_type, product_type
+                    ) l ON l.blood_type = s.blood_type AND l.product_type = s.product_type
+                    """,
+                    (to_epoch(at),),
+                ).fetchall()
+        finally:
+            conn.close()
+        return cls(rows)
+
+    # ------------ internal ------------
+
+    def _append_log(self, ts, actor, bt, pt, delta, note):
+        self._log.append((len(self._log) + 1, ts, actor or "", bt, pt, int(delta), note or ""))
+
+    def _set(self, key, units):
+        row = self._stock.setdefault(key, [0, 0])
+        row[0] = units
+        row[1] += 1
+
+    def log_rows(self):
+        """log ทั้งหมด (สำเนา) เรียงตาม id"""
+        with self._lock:
+            return list(self._log)
+
+    # ------------ backend API ------------
+
+    def init_db(self):
+        return None
+
+    def get_all_status(self):
+        with self._lock:
+            totals = {}
+            for (bt, _pt), (units, _v) in self._stock.items():
+                totals[bt] = totals.get(bt, 0) + units
+        return [{"blood_type": bt, "total": totals[bt]} for bt in sorted(totals)]
+
+    def get_stock_by_blood(self, blood_type: str):
+        with self._lock:
+            return [
+                {"product_type": pt, "units": units}
+                for (bt, pt), (units, _v) in sorted(self._stock.items())
+                if bt == blood_type
+            ]
+
+    def get_stock_row(self, blood_type: str, product_type: str):
+        with self._lock:
+            row = self._stock.get((blood_type, product_type))
+            return {"units": row[0], "version": row[1]} if row else None
+
+    def get_stock_version(self) -> int:
+        with self._lock:
+            return len(self._stock) + sum(v for _u, v in self._stock.values())
+
+    def adjust_stock(self, blood_type: str, product_type: str, qty: int, actor: str = "", note: str = "",
+                     expected_version=None, retries: int = 0):
+        if not qty:
+            return None
+        qty = int(qty)
+        key = (blood_type, product_type)
+        with self._lock:
+            units, version = self._stock.get(key, (0, 0))
+            if expected_version is not None and version != expected_version:
+                raise StockConflictError(blood_type, product_type, expected_version, version)
+            if units + qty < 0:
+                raise InsufficientStockError([(blood_type, product_type, -qty, units)])
+            self._set(key, units + qty)
+            self._append_log(_now(), actor, blood_type, product_type, qty, note)
+            return {"units": units + qty, "version": version + 1}
+
+    def get_level_history(self, blood_type: str, since=None):
+        since_epoch = to_epoch(since) if since is not None else None
+        with self._lock:
+            current = {pt: units for (bt, pt), (units, _v) in self._stock.items() if bt == blood_type}
+            log = [(to_epoch(ts), pt, d) for _id, ts, _a, bt, pt, d, _n in self._log if bt == blood_type]
+        out = {}
+        for pt, units in current.items():
+            per_ts = {}
+            for t, p, d in log:
+                if p == pt and (since_epoch is None or t >= since_epoch):
+                    per_ts[t] = per_ts.get(t, 0) + d
+            ts = sorted(per_ts)
+            running = list(itertools.accumulate(per_ts[t] for t in ts))
+            start = units - (running[-1] if running else 0)
+            out[pt] = {"start": start, "ts": ts, "units": [start + r for r in running]}
+        return out
+
+    def find_stock_drift(self):
+        with self._lock:
+            logged = {}
+            for _id, _ts, _a, bt, pt, delta, _n in self._log:
+                logged[(bt, pt)] = logged.get((bt, pt), 0) + delta
+            return [
+                {"blood_type": bt, "product_type": pt, "units": units, "logged": logged.get((bt, pt), 0)}
+                for (bt, pt), (units, _v) in self._stock.items()
+                if units != logged.get((bt, pt), 0)
+            ]
+
+    def reset_all_stock(self, actor: str = "admin"):
+        return self.reset_stock(actor=actor, note="reset_all_stock")
+
+    def reset_stock(self, actor: str = "admin", blood_type=None, product_type=None, note: str = "reset_stock"):
+        ts = _now()
+        n = 0
+        with self._lock:
+            for (bt, pt), (units, _v) in self._stock.items():
+                if not units:
+                    continue
+                if blood_type is not None and bt != blood_type:
+                    continue
+                if product_type is not None and pt != product_type:
+                    continue
+                self._append_log(ts, actor, bt, pt, -units, note)
+                self._set((bt, pt), 0)
+                n += 1
+        return n
+
+    def transfer_stock(self, src_blood_type: str, dst_blood_type: str, product_type: str, qty: int,
+                       actor: str = "", note: str = "transfer"):
+        qty = int(qty)
+        if qty <= 0:
+            raise ValueError("qty must be positive")
+        if src_blood_type == dst_blood_type:
+            return
+        src, dst = (src_blood_type, product_type), (dst_blood_type, product_type)
+        with self._lock:
+            have = self._stock.get(src, (0, 0))[0]
+            if have < qty:
+                raise InsufficientStockError([(src_blood_type, product_type, qty, have)])
+            self._set(src, have - qty)
+            self._set(dst, self._stock.get(dst, (0, 0))[0] + qty)
+            ts = _now()
+            self._append_log(ts, actor, src_blood_type, product_type, -qty, note)
+            self._append_log(ts, actor, dst_blood_type, product_type, qty, note)
+
+    def set_stock_levels(self, levels, actor: str = "", note: str = "stock_take"):
+        target = {(bt, pt): max(int(u), 0) for bt, pt, u in levels}
+        ts = _now()
+        n = 0
+        with self._lock:
+            for key, units in target.items():
+                old = self._stock.get(key, (0, 0))[0]
+                if units != old:
+                    self._append_log(ts, actor, key[0], key[1], units - old, note)
+                    self._set(key, units)
+                    n += 1
+                else:
+                    self._stock.setdefault(key, [0, 0])
+        return n
+
+    def issue_order(self, lines, actor: str = "", note: str = "order"):
+        wanted = {}
+        for bt, pt, qty in lines:
+            qty = int(qty)
+            if qty < 0:
+                raise ValueError("order quantities must be positive")
+            if qty:
+                wanted[(bt, pt)] = wanted.get((bt, pt), 0) + qty
+        if not wanted:
+            return {}
+        with self._lock:
+            have = {k: self._stock.get(k, (0, 0))[0] for k in wanted}
+            shortages = [(bt, pt, q, have[(bt, pt)]) for (bt, pt), q in wanted.items() if have[(bt, pt)] < q]
+            if shortages:
+                raise InsufficientStockError(shortages)
+            ts = _now()
+            for (bt, pt), q in wanted.items():
+                self._set((bt, pt), have[(bt, pt)] - q)
+                self._append_log(ts, actor, bt, pt, -q, note)
+        return {k: have[k] - wanted[k] for k in wanted}
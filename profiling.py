@@ -0,0 +1,231 @@
+# profiling.py
+"""
+โปรไฟล์ rerun ของ app.py แบบเลือกเปิด (ปกติปิด ไม่มีค่าใช้จ่ายเพิ่ม)
+
+เปิดได้ 2 ทาง:
+- env BLOOD_PROFILE_RERUNS=N : N rerun แรกของ process (นับรวมทุกเซสชัน) เหมาะกับเครื่องที่ช้าเฉพาะหน้างาน
+- ปุ่มในเมนู (ต้องเข้าสู่ระบบ) : N rerun ถัดไปของเซสชันนั้น
+
+ผลแต่ละ rerun เขียนไว้ที่ BLOOD_PROFILE_DIR (ค่าเริ่มต้น profiles/):
+    <ชื่อ>.prof    pstats ดิบ (เปิดด้วย snakeviz / tuna / python -m pstats)
+    <ชื่อ>.folded  collapsed stacks หน่วยไมโครวินาที (flamegraph.pl, speedscope, inferno)
+    <ชื่อ>.txt     สรุปเวลาแยก db / render / app + ฟังก์ชันที่ใช้เวลามากสุด
+"""
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+PROFILE_DIR = os.environ.get("BLOOD_PROFILE_DIR", "profiles")
+TOP_N = 25
+MAX_DEPTH = 200
+MIN_FRAME_S = 1e-5  # ตัด stack ที่สั้นกว่านี้ออกจาก .folded (ไฟล์ไม่บวม)
+
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+_DB_FILES = {"db.py", "memstore.py"}
+_RENDER_PACKAGES = ("streamlit", "altair")
+
+# cProfile ทำงานได้ทีละตัวต่อ process อย่างปลอดภัย: rerun ที่ชนกันข้ามไป ไม่รอ
+# เจ้าของปัจจุบันเก็บพร้อมเวลาเริ่ม: rerun ที่ถูกขัดจังหวะแล้วเซสชันไม่กลับมาอีก (ปิดแท็บ) ไม่ถึง end / abandon
+# ถือครองเกิน STALE_S วินาทีจึงถือว่าค้าง ให้ rerun อื่นโปรไฟล์ต่อได้ ไม่ต้องรีสตาร์ต process
+STALE_S = float(os.environ.get("BLOOD_PROFILE_STALE_S", "120") or 120)
+_owner = None  # (profile, เวลาเริ่มจาก time.monotonic())
+_owner_lock = threading.Lock()
+_env_lock = threading.Lock()
+_env_left = int(os.environ.get("BLOOD_PROFILE_RERUNS", "0") or 0)
+
+
+def begin(session_left: int = 0):
+    """
+    เริ่มโปรไฟล์ rerun นี้ถ้ามีโควตา (ของเซสชัน หรือของ env) คืน (profile, source)
+    source: "session" / "env"; ไม่ได้โปรไฟล์คืน (None, None)
+    """
+    global _env_left
+    if session_left > 0:
+        source = "session"
+    else:
+        with _env_lock:
+            if _env_left <= 0:
+                return None, None
+            _env_left -= 1
+        source = "env"
+    prof = cProfile.Profile()
+    if not _claim(prof):
+        if source == "env":
+            with _env_lock:
+                _env_left += 1
+        return None, None
+    prof.t0 = time.perf_counter()
+    try:
+        prof.enable()
+    except ValueError:
+        # โปรไฟล์ที่ค้าง (ถูกยึดเพราะเกิน STALE_S) ยังเปิดอยู่ ใน Python ที่มีตัวโปรไฟล์ได้ทีละตัวต่อ process
+        _release(prof)
+        return None, None
+    return prof, source
+
+
+def abandon(prof):
+    """ทิ้งโปรไฟล์ที่ค้าง (rerun ก่อนหน้าจบด้วย exception ก่อนถึง end)"""
+    try:
+        prof.disable()
+    finally:
+        _release(prof)
+
+
+def _claim(prof) -> bool:
+    """เป็นเจ้าของโปรไฟล์ของ process ถ้าว่างอยู่ หรือเจ้าของเดิมค้างเกิน STALE_S"""
+    global _owner
+    now = time.monotonic()
+    with _owner_lock:
+        if _owner is not None and now - _owner[1] < STALE_S:
+            return False
+        _owner = (prof, now)
+        return True
+
+
+def _release(prof):
+    """คืนความเป็นเจ้าของ เฉพาะถ้ายังเป็นของ prof (โปรไฟล์ที่ถูกยึดไปแล้วคืนไม่ได้)"""
+    global _owner
+    with _owner_lock:
+        if _owner is not None and _owner[0] is prof:
+            _owner = None
+
+
+def _bucket(func):
+    """หมวดของเฟรม: db / render / app หรือ None (ไลบรารีอื่น / builtin: นับตามเฟรมที่เรียก)"""
+    path = func[0]
+    if path in ("~", "") or path.startswith("<"):
+        return None
+    parts = os.path.normpath(path).split(os.sep)
+    if os.path.basename(path) in _DB_FILES and os.path.dirname(os.path.abspath(path)) == _REPO_DIR:
+        return "db"
+    if any(p in _RENDER_PACKAGES for p in parts):
+        return "render"
+    if os.path.dirname(os.path.abspath(path)) == _REPO_DIR:
+        return "app"
+    return None
+
+
+def _label(func) -> str:
+    path, line, name = func
+    if path == "~":
+        return name.replace(";", ",")
+    return f"{name} ({os.path.basename(path)}:{line})".replace(";", ",")
+
+
+def fold(stats):
+    """
+    แปลง pstats เป็น collapsed stacks + เวลาแยกหมวด
+    cProfile เก็บแค่คู่ caller -> callee จึงไล่จาก root แล้วแบ่งเวลาตามสัดส่วนของแต่ละเส้นทาง
+    (วิธีเดียวกับ flameprof) คืน ({"a;b;c": วินาที}, {"db": วินาที, "render": ..., "app": ..., "other": ...})
+    เวลารวมทุก stack = เวลาที่โปรไฟล์ได้ทั้งหมด (ส่วนที่ตัดทิ้งเพราะสั้น / ลึกเกิน / recursion นับเป็นของเฟรมแม่)
+    """
+    children = {}
+    seeds = []
+    for func, (_cc, _nc, tt, ct, callers) in stats.items():
+        known = [c for c in callers if c in stats]
+        for caller in known:
+            e_tt, e_ct = callers[caller][2], callers[caller][3]
+            children.setdefault(caller, []).append((func, e_tt, e_ct))
+        # ส่วนที่ถูกเรียกจากเฟรมที่เริ่มก่อน enable (เช่นโค้ดระดับบนสุดของ app.py) เป็น root
+        rest_tt = tt - sum(callers[c][2] for c in known)
+        rest_ct = ct - sum(callers[c][3] for c in known)
+        if rest_ct > MIN_FRAME_S or not known:
+            seeds.append((func, max(rest_tt, 0.0), max(rest_ct, 0.0)))
+
+    folded = {}
+    buckets = {"db": 0.0, "render": 0.0, "app": 0.0, "other": 0.0}
+
+    def walk(func, path, on_path, self_t, incl_t, bucket):
+        bucket = _bucket(func) or bucket
+        total = stats[func][3]
+        if len(path) >= MAX_DEPTH or total <= 0:
+            self_t = incl_t
+        else:
+            frac = incl_t / total
+            for callee, e_tt, e_ct in children.get(func, ()):
+                if callee in on_path:
+                    self_t += e_tt * frac
+                    continue
+                if e_ct * frac < MIN_FRAME_S:
+                    self_t += e_ct * frac
+                    continue
+                on_path.add(callee)
+                walk(callee, path + [_label(callee)], on_path, e_tt * frac, e_ct * frac, bucket)
+                on_path.discard(callee)
+        buckets[bucket] += self_t
+        key = ";".join(path)
+        folded[key] = folded.get(key, 0.0) + self_t
+
+    for func, tt, ct in seeds:
+        walk(func, [_label(func)], {func}, tt, ct, "other")
+    return folded, buckets
+
+
+def _write_folded(path, folded):
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, secs in folded.items():
+            us = int(round(secs * 1e6))
+            if us > 0:
+                f.write(f"{stack} {us}\n")
+
+
+def end(prof, label: str = "rerun", out_dir: str = None):
+    """
+    หยุดโปรไฟล์แล้วเขียนไฟล์ .prof / .folded / .txt
+    คืน dict: path (ไม่มีนามสกุล), wall_s, buckets {หมวด: วินาที}, top [(ฟังก์ชัน, tottime, cumtime), ...]
+    """
+    try:
+        prof.disable()
+        wall = time.perf_counter() - getattr(prof, "t0", time.perf_counter())
+    finally:
+        _release(prof)
+
+    out_dir = out_dir or PROFILE_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}"
+    safe = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in label)[:40] or "rerun"
+    base = os.path.join(out_dir, f"{stamp}-{safe}")
+
+    prof.dump_stats(base + ".prof")
+    st = pstats.Stats(prof)
+    folded, buckets = fold(st.stats)
+    _write_folded(base + ".folded", folded)
+
+    top = sorted(st.stats.items(), key=lambda kv: kv[1][2], reverse=True)[:TOP_N]
+    top = [(_label(func), tt, ct) for func, (_cc, _nc, tt, ct, _callers) in top]
+
+    buf = io.StringIO()
+    buf.write(f"{label}  wall {wall * 1000:.1f} ms\n")
+    for name in ("db", "render", "app", "other"):
+        buf.write(f"  {name:<7}{buckets[name] * 1000:9.1f} ms\n")
+    buf.write("\n")
+    pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(TOP_N)
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        f.write(buf.getvalue())
+
+    return {"path": base, "wall_s": wall, "buckets": buckets, "top": top}
+
+
+def main(argv=None):
+    import argparse
+
+    p = argparse.ArgumentParser(description="สรุปไฟล์ .prof: เวลาแยก db / render / app และ collapsed stacks")
+    p.add_argument("prof", help="ไฟล์ .prof")
+    p.add_argument("--folded", default=None, help="เขียน collapsed stacks ไปที่ไฟล์นี้")
+    args = p.parse_args(argv)
+
+    st = pstats.Stats(args.prof)
+    folded, buckets = fold(st.stats)
+    for name, secs in buckets.items():
+        print(f"{name:<7}{secs * 1000:9.1f} ms")
+    if args.folded:
+        _write_folded(args.folded, folded)
+    st.sort_stats("tottime").print_stats(TOP_N)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+# replay.py
+"""
+Replay / what-if simulation ของความเคลื่อนไหวสต็อก
+
+ป้อนแถวจาก stock_log (หรือ trace สังเคราะห์) ผ่านโมเดลสต็อกตามลำดับเวลา
+ด้วยความเร็วที่กำหนด (1 = เวลาจริง, 60 = เร็วขึ้น 60 เท่า, 0 = เร็วที่สุด)
+แล้วบันทึก timeline ของยอดและสถานะ (แดง/เหลือง/เขียว) ต่อกรุ๊ปและต่อผลิตภัณฑ์
+
+ตัวอย่าง:
+    # ลองเกณฑ์ใหม่กับความเคลื่อนไหวเดือนที่แล้ว (โมเดลใน memory ไม่แตะ DB จริง)
+    python replay.py --since 2026-09-01 --until 2026-10-01 --critical 6 --yellow 20
+
+    # ใช้เป็น load generator แบบ deterministic สำหรับ write path ของ SQLite
+    python replay.py --synthetic 50000 --seed 7 --target sqlite --out-db /tmp/bench.db
+
+    # เล่น stock_log จริงเข้า DB อีกไฟล์ (ห้ามเป็นไฟล์เดียวกับ --db)
+    python replay.py --since 2026-09-01 --target sqlite --out-db /tmp/replayed.db
+
+--target sqlite ต้องระบุ --out-db เสมอ (ไม่เขียนลง --db ซึ่งมักเป็น DB production)
+DB ต้นทางที่ยังไม่ได้ migrate (ไม่มี stock_log) จะถูก migrate ให้ถ้าเปิดเขียนได้
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import db
+from bagsvg import CRITICAL_MAX, YELLOW_MAX
+from db import InsufficientStockError
+from memstore import MemoryBackend
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# เกณฑ์เดียวกับหน้าแอป / signage (bagsvg.py) ปรับได้ด้วย --critical / --yellow
+DEFAULT_CRITICAL_MAX = CRITICAL_MAX
+DEFAULT_YELLOW_MAX = YELLOW_MAX
+
+
+def classify(units: int, critical_max: int = DEFAULT_CRITICAL_MAX, yellow_max: int = DEFAULT_YELLOW_MAX) -> str:
+    if units <= critical_max:
+        return "red"
+    if units <= yellow_max:
+        return "yellow"
+    return "green"
+
+
+# ------------ Event sources ------------
+
+def ensure_source_schema(path: str) -> None:
+    """
+    เตรียม DB ต้นทางให้อ่าน stock_log ได้: ถ้าเปิดเขียนได้ migrate เป็นเวอร์ชันล่าสุด (เหมือน init_db ของแอป)
+    อ่านอย่างเดียวและไม่มีตาราง stock_log -> ValueError พร้อมวิธีแก้
+    """
+    if not os.path.exists(path):
+        raise ValueError(f"ไม่พบไฟล์ DB: {path}")
+    if os.access(path, os.W_OK) and os.access(os.path.dirname(os.path.abspath(path)), os.W_OK):
+        saved = db.DB_PATH
+        db.DB_PATH = path
+        try:
+            db.migrate()
+        finally:
+            db.DB_PATH = saved
+        return
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        has_log = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_log'"
+        ).fetchone()
+    finally:
+        conn.close()
+    if not has_log:
+        raise ValueError(
+            f"{path} ยังไม่ได้ migrate (ไม่มีตาราง stock_log) และเปิดเขียนไม่ได้: "
+            "รัน db.init_db() กับไฟล์นี้ก่อน หรือใช้ --synthetic"
+        )
+
+
+def stream_stock_log(path: str, since=None, until=None, batch: int = 1000):
+    """
+    อ่าน stock_log ทีละ batch (ไม่โหลดทั้งตารางเข้าหน่วยความจำ) เรียงตาม id
+    ช่วงเวลาใช้ ts_epoch (มี index) ถ้ามี ไม่เช่นนั้นเทียบข้อความ ts (DB เก่าที่ยังไม่ได้ init_db)
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        has_epoch = "ts_epoch" in {r["name"] for r in conn.execute("PRAGMA table_info(stock_log)")}
+        col = "ts_epoch" if has_epoch else "ts"
+        conv = db.to_epoch if has_epoch else str
+        clauses, params = [], []
+        if since:
+            clauses.append(f"{col} >= ?")
+            params.append(conv(since))
+        if until:
+            clauses.append(f"{col} < ?")
+            params.append(conv(until))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        cur = conn.execute(
+            f"""
+            SELECT ts, {"ts_epoch" if has_epoch else "NULL AS ts_epoch"}, actor, blood_type, product_type, delta, note
+            FROM stock_log
+            {where}
+            ORDER BY id
+            """,
+            params,
+        )
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            for r in rows:
+                if not r["delta"]:
+                    continue
+                epoch = r["ts_epoch"]
+                yield {
+                    "ts": datetime.fromtimestamp(epoch) if epoch is not None else datetime.strptime(r["ts"], TS_FORMAT),
+                    "actor": r["actor"] or "",
+                    "blood_type": r["blood_type"],
+                    "product_type": r["product_type"],
+                    "delta": int(r["delta"]),
+                    "note": r["note"] or "",
+                }
+    finally:
+        conn.close()
+
+
+def synthetic_trace(n: int, seed: int = 0, start=None, mean_gap_s: float = 300.0,
+                    blood_types=("O", "A", "B", "AB"),
+                    product_types=("LPRC", "PRC", "Plasma", "Platelets"),
+                    issue_ratio: float = 0.45):
+    """trace สังเคราะห์แบบ deterministic (seed เดียวกัน = ลำดับเหตุการณ์เดียวกันเสมอ)"""
+    rnd = random.Random(seed)
+    ts = start or datetime(2026, 1, 1)
+    # กรุ๊ป O ใช้บ่อยที่สุด ตามสัดส่วนโดยประมาณ
+    weights = [0.45, 0.35, 0.15, 0.05][: len(blood_types)]
+    for _ in range(n):
+        ts = ts + timedelta(seconds=rnd.expovariate(1.0 / mean_gap_s))
+        issue = rnd.random() < issue_ratio
+        yield {
+            "ts": ts,
+            "actor": "synthetic",
+            "blood_type": rnd.choices(blood_types, weights=weights)[0],
+            "product_type": rnd.choice(product_types),
+            "delta": -rnd.randint(1, 2) if issue else rnd.randint(1, 3),
+            "note": "issue" if issue else "inbound",
+        }
+
+
+# ------------ Replay engine ------------
+
+class ReplayResult:
+    def __init__(self):
+        self.applied = 0
+        self.rejected = 0
+        self.elapsed_s = 0.0
+        # {(blood_type, product_type): [(ts, units, status), ...]}
+        self.timeline = {}
+        # {blood_type: [(ts, total, status), ...]} บันทึกเฉพาะเมื่อสถานะกรุ๊ปเปลี่ยน
+        self.group_timeline = {}
+        # {blood_type: {"red": วินาที, "yellow": ..., "green": ...}} (เวลาตาม trace)
+        self.time_in_status = {}
+
+    def summary(self) -> dict:
+        total = self.applied + self.rejected
+        return {
+            "events": total,
+            "applied": self.applied,
+            "rejected": self.rejected,
+            "elapsed_s": round(self.elapsed_s, 3),
+            "events_per_s": round(total / self.elapsed_s, 1) if self.elapsed_s else 0.0,
+            "group_transitions": {bt: max(len(tl) - 1, 0) for bt, tl in self.group_timeline.items()},
+            "time_in_status_h": {
+                bt: {k: round(v / 3600.0, 1) for k, v in d.items()}
+                for bt, d in self.time_in_status.items()
+            },
+        }
+
+
+def replay(events, target=None, speed: float = 0.0, critical_max: int = DEFAULT_CRITICAL_MAX,
+           yellow_max: int = DEFAULT_YELLOW_MAX, record_products: bool = True, strict: bool = False):
+    """
+    ป้อน events ผ่าน target.adjust_stock ตามลำดับ
+    target: backend ที่มี adjust_stock/get_all_status (MemoryBackend ใหม่ถ้าไม่ระบุ หรือโมดูล db)
+    speed: ตัวคูณความเร็วเทียบเวลาจริงของ trace (0 = ไม่หน่วงเวลาเลย)
+    strict: ถ้า True การจ่ายเกินยอดจะ raise แทนการนับเป็น rejected
+    """
+    target = target if target is not None else MemoryBackend()
+    res = ReplayResult()
+    totals = {r["blood_type"]: int(r["total"]) for r in target.get_all_status()}
+    group_status = {}
+    last_ts = {}
+
+    wall0 = time.perf_counter()
+    trace0 = None
+    for ev in events:
+        ts, bt, pt, delta = ev["ts"], ev["blood_type"], ev["product_type"], ev["delta"]
+
+        if speed and speed > 0:
+            trace0 = trace0 or ts
+            due = (ts - trace0).total_seconds() / speed
+            wait = due - (time.perf_counter() - wall0)
+            if wait > 0:
+                time.sleep(wait)
+
+        try:
+            row = target.adjust_stock(bt, pt, delta, actor=ev.get("actor", ""), note=ev.get("note", ""))
+        except InsufficientStockError:
+            if strict:
+                raise
+            res.rejected += 1
+            continue
+        res.applied += 1
+        units = int(row["units"]) if row else 0
+
+        if record_products:
+            res.timeline.setdefault((bt, pt), []).append((ts, units, classify(units, critical_max, yellow_max)))
+
+        # เวลาที่กรุ๊ปอยู่ในสถานะเดิม (ก่อนเหตุการณ์นี้)
+        if bt in group_status:
+            spent = res.time_in_status.setdefault(bt, {"red": 0.0, "yellow": 0.0, "green": 0.0})
+            spent[group_status[bt]] += (ts - last_ts[bt]).total_seconds()
+        totals[bt] = totals.get(bt, 0) + delta
+        status = classify(totals[bt], critical_max, yellow_max)
+        if group_status.get(bt) != status:
+            res.group_timeline.setdefault(bt, []).append((ts, totals[bt], status))
+            group_status[bt] = status
+        last_ts[bt] = ts
+
+    res.elapsed_s = time.perf_counter() - wall0
+    return res
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Replay stock_log / trace สังเคราะห์ผ่านโมเดลสต็อก")
+    p.add_argument("--db", default=os.environ.get("BLOOD_DB_PATH", "blood.db"), help="ไฟล์ DB")
+    p.add_argument("--since", default=None, help="เริ่มที่ ts (YYYY-MM-DD[ HH:MM:SS])")
+    p.add_argument("--until", default=None, help="ถึงก่อน ts")
+    p.add_argument("--synthetic", type=int, default=0, help="ใช้ trace สังเคราะห์ N เหตุการณ์แทน stock_log")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--speed", type=float, default=0.0, help="ตัวคูณความเร็ว (0 = เร็วที่สุด)")
+    p.add_argument("--critical", type=int, default=DEFAULT_CRITICAL_MAX, help="เกณฑ์แดง (<=)")
+    p.add_argument("--yellow", type=int, default=DEFAULT_YELLOW_MAX, help="เกณฑ์เหลือง (<=)")
+    p.add_argument("--target", choices=["memory", "sqlite"], default="memory",
+                   help="memory = what-if ไม่แตะ DB, sqlite = เขียนจริงลง --out-db (load generator)")
+    p.add_argument("--out-db", default=None,
+                   help="(sqlite) ไฟล์ที่เขียน ต้องระบุเสมอและต้องไม่ใช่ไฟล์เดียวกับ --db")
+    p.add_argument("--initial-from-db", action="store_true",
+                   help="(memory) เริ่มจากยอดใน --db ณ --since (ไม่ระบุ = ยอดปัจจุบัน) แทนศูนย์")
+    args = p.parse_args(argv)
+
+    out_db = args.out_db
+    if args.target == "sqlite":
+        # --db คือ DB production (ค่าเริ่มต้นจาก BLOOD_DB_PATH): load generator / replay ต้องเขียนลงไฟล์อื่นเสมอ
+        # replay stock_log กลับเข้า DB เดียวกันจะทำให้ทุก delta และทุกแถว log ซ้ำสองเท่า
+        if out_db is None:
+            p.error("--target sqlite ต้องระบุ --out-db (ไฟล์อื่นที่ไม่ใช่ --db)")
+        if os.path.realpath(out_db) == os.path.realpath(args.db):
+            p.error("--out-db ต้องเป็นคนละไฟล์กับ --db")
+
+    if not args.synthetic:
+        try:
+            ensure_source_schema(args.db)
+        except ValueError as e:
+            p.error(str(e))
+
+    if args.synthetic:
+        events = synthetic_trace(args.synthetic, seed=args.seed)
+    else:
+        events = stream_stock_log(args.db, since=args.since, until=args.until)
+
+    if args.target == "sqlite":
+        db.DB_PATH = out_db
+        db.set_backend("sqlite")
+        db.init_db()
+        target = db
+    elif args.initial_from_db:
+        # replay ช่วงอดีต: ยอดเริ่มต้นต้องเป็นยอด ณ since ไม่ใช่ยอดวันนี้
+        target = MemoryBackend.from_sqlite(args.db, at=None if args.synthetic else args.since)
+    else:
+        target = MemoryBackend()
+
+    res = replay(events, target=target, speed=args.speed, critical_max=args.critical,
+                 yellow_max=args.yellow, record_products=args.target == "memory")
+    s = res.summary()
+    print(
+        f"events={s['events']} applied={s['applied']} rejected={s['rejected']} "
+        f"elapsed={s['elapsed_s']}s ({s['events_per_s']} ev/s)"
+    )
+    for bt in sorted(s["time_in_status_h"]):
+        hrs = s["time_in_status_h"][bt]
+        print(
+            f"  {bt:<3} red={hrs['red']}h yellow={hrs['yellow']}h green={hrs['green']}h "
+            f"transitions={s['group_transitions'].get(bt, 0)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
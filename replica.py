@@ -0,0 +1,109 @@
+# replica.py
+"""
+เผยแพร่ snapshot แบบอ่านอย่างเดียวของ blood.db สำหรับจอแสดงผลตามชั้นต่าง ๆ
+
+ใช้ SQLite online backup API คัดลอก DB หลักแบบ consistent ไปยังไฟล์ชั่วคราว
+แล้ว os.replace() ทับไฟล์ปลายทางแบบ atomic (ผู้อ่านไม่เห็นไฟล์ครึ่ง ๆ กลาง ๆ)
+เผยแพร่ทุก ๆ interval หรือเฉพาะเมื่อ DB หลักมีการ commit ใหม่ (--on-change)
+
+ตัวอย่าง:
+    python replica.py --dest /srv/share/blood_replica.db --interval 5 --on-change
+
+ฝั่งจอแสดงผล:
+    BLOOD_DB_PATH=/srv/share/blood_replica.db BLOOD_DB_READONLY=1 streamlit run app.py
+"""
+import argparse
+import os
+import sqlite3
+import time
+
+
+def publish_snapshot(source: str, dest: str):
+    """คัดลอก source -> dest แบบ consistent + atomic คืนเวลาที่ใช้ (วินาที)"""
+    t0 = time.perf_counter()
+    tmp = f"{dest}.tmp-{os.getpid()}"
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(tmp)
+    try:
+        src.backup(dst)
+        # snapshot ไม่ใช้ WAL: ผู้อ่านเปิดแบบ read-only ได้โดยไม่ต้องสร้างไฟล์ -wal/-shm
+        dst.execute("PRAGMA journal_mode = DELETE")
+        dst.commit()
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp, dest)
+    return time.perf_counter() - t0
+
+
+class ReplicaPublisher:
+    """
+    เฝ้าดู DB หลักผ่าน PRAGMA data_version (เปลี่ยนเมื่อ connection อื่น commit)
+    แล้วเผยแพร่ snapshot ไปยังปลายทางทุกไฟล์
+    """
+
+    def __init__(self, source: str, dests, interval: float = 5.0, on_change: bool = True,
+                 poll: float = 0.5):
+        self.source = source
+        self.dests = list(dests)
+        self.interval = interval
+        self.on_change = on_change
+        self.poll = poll
+        self._watch = sqlite3.connect(source, check_same_thread=False)
+        self._last_version = None
+        self._last_publish = 0.0
+
+    def data_version(self) -> int:
+        return int(self._watch.execute("PRAGMA data_version").fetchone()[0])
+
+    def due(self) -> bool:
+        now = time.monotonic()
+        if now - self._last_publish < self.interval:
+            return False
+        if not self.on_change:
+            return True
+        return self._last_version is None or self.data_version() != self._last_version
+
+    def publish(self):
+        version = self.data_version()
+        took = 0.0
+        for dest in self.dests:
+            took += publish_snapshot(self.source, dest)
+        self._last_version = version
+        self._last_publish = time.monotonic()
+        return took
+
+    def run_forever(self, log=print):
+        while True:
+            if self.due():
+                took = self.publish()
+                log(f"[replica] published {len(self.dests)} snapshot(s) in {took * 1000:.1f} ms")
+            time.sleep(self.poll if self.on_change else self.interval)
+
+    def close(self):
+        self._watch.close()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="เผยแพร่ snapshot อ่านอย่างเดียวของ blood.db")
+    p.add_argument("--source", default=os.environ.get("BLOOD_DB_PATH", "blood.db"))
+    p.add_argument("--dest", action="append", required=True, help="ไฟล์ปลายทาง (ระบุซ้ำได้หลายไฟล์)")
+    p.add_argument("--interval", type=float, default=5.0, help="ระยะห่างขั้นต่ำระหว่างการเผยแพร่ (วินาที)")
+    p.add_argument("--on-change", action="store_true", help="เผยแพร่เฉพาะเมื่อ DB หลักมีการ commit ใหม่")
+    p.add_argument("--once", action="store_true", help="เผยแพร่ครั้งเดียวแล้วจบ")
+    args = p.parse_args(argv)
+
+    pub = ReplicaPublisher(args.source, args.dest, interval=args.interval, on_change=args.on_change)
+    try:
+        if args.once:
+            pub.publish()
+        else:
+            pub.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pub.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# reports.py
+"""
+รายงานรายเดือนสำหรับ QA: จำนวนจ่าย / หมดอายุทิ้ง (Exp) / ปล่อยจอง ต่อกรุ๊ปและผลิตภัณฑ์
+พร้อมยอดรับเข้า-จ่ายออกจาก stock_log
+
+- unit_log (ประวัติสถานะรายหน่วย) และ stock_log ถูก query ทีละเดือนผ่าน index ของ ts_epoch
+- เดือนที่ปิดแล้วเก็บผลไว้ใน report_cache ไม่คำนวณซ้ำ เดือนปัจจุบันคำนวณใหม่ทุกครั้ง
+
+ตัวอย่าง:
+    python reports.py --year 2026 --csv qa_2026.csv
+"""
+import argparse
+import io
+import json
+import os
+import sqlite3
+from datetime import date, datetime
+
+import pandas as pd
+
+import db
+
+REPORT_COLS = [
+    "period",
+    "blood_group",
+    "product",
+    "issued",
+    "wasted",
+    "released",
+    "booked",
+    "inbound",
+    "outbound",
+    "wastage_rate",
+    "issued_share",
+]
+
+CACHE_KIND = "monthly_v1"
+
+
+def _month_bounds(period: str):
+    """'YYYY-MM' -> (epoch ต้นเดือน, epoch ต้นเดือนถัดไป) ตามเวลาท้องถิ่น"""
+    y, m = (int(x) for x in period.split("-"))
+    start = date(y, m, 1)
+    end = date(y + (m == 12), m % 12 + 1, 1)
+    return db.to_epoch(start), db.to_epoch(end)
+
+
+def months_between(first: str, last: str):
+    """รายการ 'YYYY-MM' ตั้งแต่ first ถึง last (รวมทั้งสองด้าน)"""
+    y, m = (int(x) for x in first.split("-"))
+    ly, lm = (int(x) for x in last.split("-"))
+    out = []
+    while (y, m) <= (ly, lm):
+        out.append(f"{y:04d}-{m:02d}")
+        y, m = y + (m == 12), m % 12 + 1
+    return out
+
+
+def _compute_month(conn, period: str):
+    """คำนวณหนึ่งเดือน: [ {blood_group, product, issued, ...}, ... ] (ทุกแถวเป็นช่วง ts_epoch เดียว)"""
+    start, end = _month_bounds(period)
+    rows = {}
+
+    def slot(bg, product):
+        key = (bg, db.DB_TO_UI.get(product, product))
+        if key not in rows:
+            rows[key] = {"issued": 0, "wasted": 0, "released": 0, "booked": 0, "inbound": 0, "outbound": 0}
+        return rows[key]
+
+    for r in conn.execute(db.MONTH_UNIT_LOG_SQL, (start, end)):
+        d = slot(r[0], r[1])
+        d["issued"], d["wasted"], d["released"], d["booked"] = (int(x or 0) for x in r[2:6])
+
+    for r in conn.execute(db.MONTH_STOCK_LOG_SQL, (start, end)):
+        d = slot(r[0], r[1])
+        d["inbound"], d["outbound"] = int(r[2] or 0), int(r[3] or 0)
+
+    return [
+        {"blood_group": bg, "product": p, **v}
+        for (bg, p), v in sorted(rows.items(), key=lambda kv: (str(kv[0][0]), str(kv[0][1])))
+    ]
+
+
+def _connect(path, read_only):
+    if read_only:
+        return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    return sqlite3.connect(path)
+
+
+def monthly_rows(first: str, last: str, path: str = None, use_cache: bool = True, today=None):
+    """
+    คืน (rows, stats) ของทุกเดือนในช่วง
+    rows: [ {period, blood_group, product, issued, wasted, released, booked, inbound, outbound}, ... ]
+    stats: {"cached": จำนวนเดือนที่ใช้ผลเก่า, "computed": จำนวนเดือนที่คำนวณใหม่}
+    """
+    path = path or db.DB_PATH
+    current = (today or date.today()).strftime("%Y-%m")
+    conn = _connect(path, db.READ_ONLY)
+    stats = {"cached": 0, "computed": 0}
+    out = []
+    try:
+        periods = months_between(first, last)
+        cached = {}
+        if use_cache:
+            marks = ", ".join("?" * len(periods))
+            cached = {
+                p: json.loads(payload)
+                for p, payload in conn.execute(
+                    f"SELECT period, payload FROM report_cache WHERE kind = ? AND period IN ({marks})",
+                    (CACHE_KIND, *periods),
+                )
+            }
+        fresh = []
+        for p in periods:
+            if p > current:
+                continue
+            if p < current and p in cached:
+                month = cached[p]
+                stats["cached"] += 1
+            else:
+                month = _compute_month(conn, p)
+                stats["computed"] += 1
+                if p < current:
+                    fresh.append((p, month))
+            out.extend({"period": p, **r} for r in month)
+        if fresh and use_cache and not db.READ_ONLY:
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            conn.executemany(
+                "INSERT OR REPLACE INTO report_cache(kind, period, computed_at, payload) VALUES (?, ?, ?, ?)",
+                [(CACHE_KIND, p, now, json.dumps(m, ensure_ascii=False)) for p, m in fresh],
+            )
+            conn.commit()
+    finally:
+        conn.close()
+    return out, stats
+
+
+def monthly_report(first: str, last: str, path: str = None, use_cache: bool = True, today=None):
+    """
+    DataFrame รายงานรายเดือน (คอลัมน์ REPORT_COLS)
+    wastage_rate = wasted / (issued + wasted) ต่อแถว
+    issued_share = สัดส่วนจำนวนจ่ายของแถวนั้นในเดือนเดียวกัน (window: SUM OVER PARTITION BY period)
+    """
+    rows, stats = monthly_rows(first, last, path=path, use_cache=use_cache, today=today)
+    if not rows:
+        return pd.DataFrame(columns=REPORT_COLS), stats
+    # ใช้ SQLite ในหน่วยความจำทำ window function บนผลรวมรายเดือน (ข้อมูลเล็ก: เดือน x กรุ๊ป x ผลิตภัณฑ์)
+    mem = sqlite3.connect(":memory:")
+    try:
+        pd.DataFrame(rows).to_sql("m", mem, index=False)
+        df = pd.read_sql_query(
+            """
+            SELECT period, blood_group, product, issued, wasted, released, booked, inbound, outbound,
+                   ROUND(CASE WHEN issued + wasted > 0 THEN 1.0 * wasted / (issued + wasted) END, 3)
+                       AS wastage_rate,
+                   ROUND(CASE WHEN SUM(issued) OVER (PARTITION BY period) > 0
+                              THEN 1.0 * issued / SUM(issued) OVER (PARTITION BY period) END, 3)
+                       AS issued_share
+            FROM m
+            ORDER BY period, blood_group, product
+            """,
+            mem,
+        )
+    finally:
+        mem.close()
+    return df[REPORT_COLS], stats
+
+
+def summarize(df, by=("blood_group", "product")):
+    """รวมทั้งช่วง (เช่นทั้งปี) ตามคอลัมน์ที่เลือก"""
+    if df.empty:
+        return df
+    cols = ["issued", "wasted", "released", "booked", "inbound", "outbound"]
+    out = df.groupby(list(by), dropna=False)[cols].sum().reset_index()
+    total = out["issued"] + out["wasted"]
+    out["wastage_rate"] = (out["wasted"] / total.where(total > 0)).round(3)
+    return out
+
+
+def to_csv_bytes(df) -> bytes:
+    # utf-8-sig ให้ Excel เปิดภาษาไทยได้ถูกต้อง
+    return df.to_csv(index=False).encode("utf-8-sig")
+
+
+def to_excel_bytes(sheets: dict) -> bytes:
+    """{ชื่อชีต: DataFrame} -> ไฟล์ .xlsx (ต้องมี openpyxl)"""
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="openpyxl") as xw:
+        for name, df in sheets.items():
+            df.to_excel(xw, sheet_name=name[:31], index=False)
+    return buf.getvalue()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="รายงานรายเดือน: จ่าย / Exp / ปล่อยจอง / รับเข้า-จ่ายออก")
+    p.add_argument("--db", default=os.environ.get("BLOOD_DB_PATH", "blood.db"), help="ไฟล์ DB")
+    p.add_argument("--year", type=int, default=date.today().year)
+    p.add_argument("--no-cache", action="store_true", help="คำนวณใหม่ทุกเดือน")
+    p.add_argument("--csv", default=None, help="บันทึกผลเป็น CSV")
+    args = p.parse_args(argv)
+
+    db.DB_PATH = args.db
+    # DB เดิมที่ยังไม่ได้ migrate (เช่น blood.db ที่มากับ repo) ยังไม่มี report_cache / unit_log / stock_log
+    if not db.READ_ONLY and os.access(args.db, os.W_OK) and os.access(os.path.dirname(os.path.abspath(args.db)), os.W_OK):
+        db.init_db()
+    try:
+        df, stats = monthly_report(f"{args.year}-01", f"{args.year}-12", path=args.db, use_cache=not args.no_cache)
+    except sqlite3.OperationalError as e:
+        p.error(f"{args.db}: {e} (DB อ่านอย่างเดียวที่ยังไม่ได้ migrate: รัน db.init_db() กับไฟล์นี้ก่อน)")
+    print(f"months: cached={stats['cached']} computed={stats['computed']} rows={len(df)}")
+    print(summarize(df).to_string(index=False))
+    if args.csv:
+        with open(args.csv, "wb") as f:
+            f.write(to_csv_bytes(df))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# scheduler.py
+"""
+งานตามรอบระดับเซิร์ฟเวอร์ (แทนการทำซ้ำทุกเซสชันตอน render)
+
+- release_bookings: หน่วย "จอง" เกิน 3 วัน -> "หลุดจอง"
+- expire_units:     หน่วยพร้อมจ่ายที่เลยวันหมดอายุ -> "Exp" และตัดสต็อก
+
+แต่ละ process (streamlit / cron) มี Scheduler ของตัวเองได้ แต่ละงานต้องได้ lease ในตาราง job_lease ก่อน
+จึงรันครั้งเดียวต่อรอบทั้งคลัสเตอร์ที่ใช้ DB เดียวกัน
+
+ตัวอย่าง (รันจาก cron แทน thread ในแอป):
+    python scheduler.py --once
+"""
+import argparse
+import os
+import socket
+import threading
+import time
+
+import db
+
+BOOKING_HOLD_DAYS = 3
+RELEASE_INTERVAL_S = 300.0
+EXPIRE_INTERVAL_S = 900.0
+
+
+class Scheduler:
+    def __init__(self, owner: str = None, tick_s: float = 30.0):
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.tick_s = tick_s
+        self.jobs = []          # [(name, interval_s, fn), ...]
+        self.last_results = {}  # name -> (เวลา, ผลลัพธ์ หรือ exception)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_job(self, name: str, interval_s: float, fn):
+        """เพิ่มงาน fn() ให้รันทุก interval_s วินาที (ทั้งคลัสเตอร์)"""
+        self.jobs.append((name, float(interval_s), fn))
+        return self
+
+    def run_pending(self):
+        """รันงานที่ถึงรอบและได้ lease คืน {name: ผลลัพธ์} เฉพาะงานที่รันในรอบนี้"""
+        done = {}
+        for name, interval_s, fn in self.jobs:
+            if not db.acquire_lease(name, self.owner, interval_s):
+                continue
+            try:
+                res = fn()
+            except Exception as e:  # งานหนึ่งล้มไม่ทำให้ thread หยุด
+                res = e
+            self.last_results[name] = (time.time(), res)
+            done[name] = res
+        return done
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                pass
+            self._stop.wait(self.tick_s)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="blood-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def default_scheduler(**kwargs) -> Scheduler:
+    """Scheduler พร้อมงานมาตรฐานของระบบ"""
+    s = Scheduler(**kwargs)
+    s.add_job("release_bookings", RELEASE_INTERVAL_S, lambda: db.release_stale_bookings(BOOKING_HOLD_DAYS))
+    s.add_job("expire_units", EXPIRE_INTERVAL_S, lambda: db.expire_units(product_map=db.UI_TO_DB))
+    return s
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="รันงานตามรอบ (ปล่อยจอง / ตั้ง Exp)")
+    p.add_argument("--db", default=os.environ.get("BLOOD_DB_PATH", "blood.db"), help="ไฟล์ DB")
+    p.add_argument("--once", action="store_true", help="รันงานที่ถึงรอบครั้งเดียวแล้วจบ (เหมาะกับ cron)")
+    p.add_argument("--tick", type=float, default=30.0, help="ตรวจงานทุกกี่วินาที (โหมดวนรอบ)")
+    args = p.parse_args(argv)
+
+    db.DB_PATH = args.db
+    db.init_db()
+    sched = default_scheduler(tick_s=args.tick)
+    if args.once:
+        for name, res in sched.run_pending().items():
+            print(f"{name}: {res}")
+        return
+    try:
+        while True:
+            for name, res in sched.run_pending().items():
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {name}: {res}", flush=True)
+            time.sleep(args.tick)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,7 @@ CREATE TABLE IF NOT EXISTS stock (
   blood_type TEXT NOT NULL,
   product_type TEXT NOT NULL,
   units INTEGER NOT NULL DEFAULT 0,
+  version INTEGER NOT NULL DEFAULT 0,
   UNIQUE (blood_type, product_type)
 );
 
@@ -0,0 +1,224 @@
+# signage.py
+"""
+เผยแพร่หน้าจอถุงเลือดเป็นไฟล์ static (SVG / HTML / JSON) สำหรับจอตามล็อบบี้ / ทางเดิน
+
+จอแสดงผลไม่ต้องเปิดเซสชัน Streamlit: เว็บเซิร์ฟเวอร์ธรรมดา (nginx, python -m http.server)
+หรือแชร์ไฟล์เสิร์ฟโฟลเดอร์ปลายทางได้เลย เพิ่มจอกี่จอก็ไม่เพิ่มภาระให้แอป / DB
+ไฟล์ถูกเขียนใหม่เฉพาะเมื่อยอดสต็อกเปลี่ยน (ตรวจ PRAGMA data_version ทุก poll แล้วเทียบ get_stock_version)
+เขียนแบบ atomic (ไฟล์ชั่วคราว + os.replace) จอที่กำลังโหลดไม่เห็นไฟล์ครึ่ง ๆ กลาง ๆ
+
+ไฟล์ในโฟลเดอร์ปลายทาง:
+    index.html     ถุงเลือด 4 กรุ๊ป + ยอดรวม + ยอดแยกผลิตภัณฑ์ (CSS ฝังในไฟล์ รีเฟรชตัวเองตาม --refresh)
+    bag_<กรุ๊ป>.svg ถุงเลือดแต่ละกรุ๊ปเป็นรูปเดี่ยว (ใช้ใน signage player ที่รับแค่รูปได้)
+    status.json    ยอดรวม / สถานะ / ยอดแยกผลิตภัณฑ์ / เวอร์ชันสต็อก
+
+ตัวอย่าง:
+    python signage.py --out /srv/www/signage
+    python signage.py --db /srv/share/blood_replica.db --out /srv/www/signage --refresh 30
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import db
+from bagsvg import BAG_MAX, bag_svg, bag_svg_element, compute_bag
+from coherence import DataVersionWatcher
+
+BLOOD_TYPES = ["A", "B", "O", "AB"]
+# ผลิตภัณฑ์แบบ UI ที่มียอดแยกกรุ๊ปในตาราง stock (Cryo ไม่มี)
+PRODUCTS = list(db.UI_TO_DB)
+BAG_CSS = Path(__file__).parent / "frontend" / "bag.css"
+# จอสเปกต่ำเปิด 24 ชม.: ปิดคลื่น / blend แบบเดียวกับโหมด kiosk
+STILL_CSS = ".wave-layer{animation:none!important;mix-blend-mode:normal;opacity:1}"
+
+
+def _stock_version():
+    """
+    db.get_stock_version หรือ None ถ้า DB ยังไม่มีคอลัมน์ stock.version
+    (replica / ไฟล์อ่านอย่างเดียวที่ยังไม่ได้ migrate: เขียนไฟล์ใหม่ทุกครั้งที่ data_version เปลี่ยน)
+    """
+    try:
+        return db.get_stock_version()
+    except sqlite3.OperationalError:
+        return None
+
+
+def snapshot():
+    """อ่านยอดปัจจุบัน คืน dict: version (None = DB ยังไม่ได้ migrate), bags [{bt, total, status, label, pct, products}, ...]"""
+    version = _stock_version()
+    totals = {r["blood_type"]: int(r.get("total") or 0) for r in db.get_all_status()}
+    bags = []
+    for bt in BLOOD_TYPES:
+        products = {p: 0 for p in PRODUCTS}
+        for r in db.get_stock_by_blood(bt):
+            name = str(r.get("product_type", "")).strip()
+            ui = db.DB_TO_UI.get(name, name)
+            if ui in products:
+                products[ui] += int(r.get("units") or 0)
+        total = totals.get(bt, 0)
+        status, label, pct = compute_bag(total, BAG_MAX)
+        bags.append({"bt": bt, "total": total, "status": status, "label": label, "pct": pct, "products": products})
+    return {"version": version, "bags": bags}
+
+
+def render(snap: dict, generated_at: datetime, refresh_s: int = 60, animate: bool = False) -> dict:
+    """snapshot -> {ชื่อไฟล์: เนื้อหา} (ไม่แตะดิสก์)"""
+    files = {}
+    cards = []
+    for b in snap["bags"]:
+        svg = bag_svg_element(b["bt"], b["total"])
+        files[f"bag_{b['bt']}.svg"] = svg
+        cells = "".join(
+            f'<div class="p"><span>{p}</span><b>{n}</b></div>' for p, n in b["products"].items()
+        )
+        cards.append(
+            f"""
+<section class="card {b['status']}">
+  {bag_svg(b['bt'], b['total'])}
+  <div class="total">{b['total']} <small>unit</small></div>
+  <div class="label">{b['label']}</div>
+  <div class="products">{cells}</div>
+</section>"""
+        )
+
+    stamp = generated_at.strftime("%d/%m/%Y %H:%M:%S")
+    ver = f" (เวอร์ชันสต็อก {snap['version']})" if snap["version"] is not None else ""
+    css = BAG_CSS.read_text(encoding="utf-8") + ("" if animate else STILL_CSS)
+    files["index.html"] = f"""<!doctype html>
+<html lang="th">
+<head>
+<meta charset="utf-8">
+<meta http-equiv="refresh" content="{int(refresh_s)}">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>สถานะคลังเลือด</title>
+<style>
+{css}
+body{{margin:0;padding:24px;background:#f8fafc;color:#111827;
+      font-family:system-ui,-apple-system,"Segoe UI",sans-serif}}
+h1{{margin:0 0 16px;font-size:28px}}
+.grid{{display:grid;grid-template-columns:repeat(auto-fit,minmax(220px,1fr));gap:16px}}
+.card{{background:#fff;border-radius:16px;padding:16px;text-align:center;border-top:8px solid #22c55e}}
+.card.yellow{{border-top-color:#f59e0b}}
+.card.red{{border-top-color:#ef4444}}
+.total{{font-size:36px;font-weight:800}}
+.total small{{font-size:16px;font-weight:400;color:#6b7280}}
+.label{{font-size:18px;margin-bottom:8px}}
+.products{{display:flex;justify-content:center;gap:12px}}
+.p{{display:flex;flex-direction:column;font-size:14px;color:#374151}}
+.p b{{font-size:20px;color:#111827}}
+footer{{margin-top:16px;color:#6b7280;font-size:14px}}
+</style>
+</head>
+<body>
+<h1>สถานะคลังเลือด</h1>
+<div class="grid">{''.join(cards)}
+</div>
+<footer>ข้อมูล ณ {stamp}{ver}</footer>
+</body>
+</html>
+"""
+    files["status.json"] = json.dumps(
+        {"generated_at": generated_at.isoformat(timespec="seconds"), **snap}, ensure_ascii=False, indent=2
+    )
+    return files
+
+
+def _write_atomic(path: Path, text: str):
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.chmod(tmp, 0o644)  # mkstemp สร้างเป็น 0600: เว็บเซิร์ฟเวอร์ที่รันคนละ user ต้องอ่านได้
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def write_files(out_dir, files: dict):
+    """เขียนทุกไฟล์แบบ atomic: รูป / JSON ก่อน index.html ทีหลัง (หน้าเว็บไม่อ้างถึงรูปที่ยังไม่มี)"""
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    for name in sorted(files, key=lambda n: n == "index.html"):
+        _write_atomic(out / name, files[name])
+
+
+class SignagePublisher:
+    """
+    เฝ้าดู DB (db.DB_PATH) แล้วเขียนไฟล์ static ใหม่เมื่อยอดสต็อกเปลี่ยน
+    commit ที่ไม่แตะตาราง stock (เช่นแก้ตารางหน่วยเลือด) ไม่ทำให้เขียนไฟล์ใหม่
+    """
+
+    def __init__(self, out_dir, poll: float = 1.0, refresh_s: int = 60, animate: bool = False):
+        self.out_dir = out_dir
+        self.poll = poll
+        self.refresh_s = refresh_s
+        self.animate = animate
+        self._watcher = DataVersionWatcher(db.DB_PATH)
+        self._last_gen = None
+        self._last_version = None
+
+    def publish(self):
+        """เขียนไฟล์จากยอดปัจจุบัน คืนเวลาที่ใช้ (วินาที)"""
+        t0 = time.perf_counter()
+        snap = snapshot()
+        write_files(self.out_dir, render(snap, datetime.now(), self.refresh_s, self.animate))
+        self._last_version = snap["version"]
+        return time.perf_counter() - t0
+
+    def publish_if_changed(self):
+        """ตรวจ data_version (ไม่กี่ไมโครวินาที) แล้วเทียบเวอร์ชันสต็อกเมื่อมี commit ใหม่ คืนเวลาที่ใช้ หรือ None"""
+        gen = self._watcher.check()
+        if gen == self._last_gen:
+            return None
+        self._last_gen = gen
+        if self._last_version is not None and _stock_version() == self._last_version:
+            return None
+        return self.publish()
+
+    def run_forever(self, log=print):
+        while True:
+            took = self.publish_if_changed()
+            if took is not None:
+                log(f"[signage] version {self._last_version} published to {self.out_dir} in {took * 1000:.1f} ms")
+            time.sleep(self.poll)
+
+    def close(self):
+        self._watcher.close()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="เผยแพร่หน้าจอถุงเลือดเป็นไฟล์ static (SVG / HTML / JSON)")
+    p.add_argument("--db", default=os.environ.get("BLOOD_DB_PATH", "blood.db"), help="ไฟล์ DB (ใช้ replica ได้)")
+    p.add_argument("--out", required=True, help="โฟลเดอร์ปลายทางที่เว็บเซิร์ฟเวอร์ / แชร์ไฟล์เสิร์ฟ")
+    p.add_argument("--poll", type=float, default=1.0, help="ตรวจการเปลี่ยนแปลงทุกกี่วินาที")
+    p.add_argument("--refresh", type=int, default=60, help="หน้าเว็บโหลดตัวเองใหม่ทุกกี่วินาที")
+    p.add_argument("--animate", action="store_true", help="แสดงคลื่นเคลื่อนไหว (ค่าเริ่มต้นนิ่ง เหมาะกับจอสเปกต่ำ)")
+    p.add_argument("--once", action="store_true", help="เขียนครั้งเดียวแล้วจบ")
+    args = p.parse_args(argv)
+
+    db.DB_PATH = args.db
+    # DB เดิมที่ยังไม่ได้ migrate (เช่น blood.db ที่มากับ repo) ไม่มีคอลัมน์ stock.version: migrate ถ้าเขียนได้
+    # replica อ่านอย่างเดียว migrate ไม่ได้ จึงใช้ _stock_version ที่ทนคอลัมน์หายแทน
+    if not db.READ_ONLY and os.access(args.db, os.W_OK) and os.access(os.path.dirname(os.path.abspath(args.db)), os.W_OK):
+        db.init_db()
+    pub = SignagePublisher(args.out, poll=args.poll, refresh_s=args.refresh, animate=args.animate)
+    try:
+        if args.once:
+            pub.publish()
+        else:
+            pub.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pub.close()
+
+
+if __name__ == "__main__":
+    main()
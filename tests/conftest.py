@@ -0,0 +1,5 @@
+# โมดูลของแอปอยู่ที่รากของ repo (ไม่ได้เป็น package) ให้ import ได้ไม่ว่าจะรัน pytest จากที่ใด
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,57 @@
+# tests/test_fefo.py
+from datetime import date
+
+import pandas as pd
+
+from fefo import FefoIndex
+
+TODAY = date(2026, 1, 1)
+
+
+def _entries(rows):
+    return pd.DataFrame(rows, columns=["Unit number", "Group", "Blood Components", "Exp date", "Status"])
+
+
+def test_suggest_orders_by_expiry_and_skips_expired():
+    idx = FefoIndex.from_entries(
+        _entries(
+            [
+                ("W000126000001", "A", "PRC", "2026-03-01", "ว่าง"),
+                ("W000126000002", "A", "PRC", "2026-02-01", "หลุดจอง"),
+                ("W000126000003", "A", "PRC", "2025-12-01", "ว่าง"),
+                ("W000126000004", "A", "PRC", "2026-01-15", "จ่ายแล้ว"),
+            ]
+        )
+    )
+    assert [u for u, _e in idx.suggest("A", "PRC", k=5, today=TODAY)] == ["W000126000002", "W000126000001"]
+    assert [u for u, *_ in idx.expired(today=TODAY)] == ["W000126000003"]
+
+
+def test_components_sharing_a_din_are_separate_units():
+    din = "W123426123456"
+    idx = FefoIndex.from_entries(
+        _entries(
+            [
+                (f"={din}00", "A", "PRC", "2026-02-01", "ว่าง"),
+                (din, "A", "FFP", "2026-06-01", "ว่าง"),
+            ]
+        )
+    )
+    assert len(idx) == 2
+    assert (din, "A", "PRC") in idx and (din, "A", "FFP") in idx
+    assert (din, "B", "PRC") not in idx
+    assert idx.suggest("A", "PRC", today=TODAY) == [(din, date(2026, 2, 1))]
+
+    assert idx.discard(din, "A", "FFP")
+    assert (din, "A", "PRC") in idx
+    assert idx.suggest("A", "FFP", today=TODAY) == []
+    assert idx.reserve("A", "PRC", today=TODAY) == (din, date(2026, 2, 1))
+    assert len(idx) == 0
+
+
+def test_add_replaces_existing_unit():
+    idx = FefoIndex()
+    idx.add("W000126000001", "O", "PC", "2026-02-01")
+    idx.add("w000126000001", "O", "PC", "2026-01-10")
+    assert len(idx) == 1
+    assert idx.suggest("O", "PC", k=3, today=TODAY) == [("W000126000001", date(2026, 1, 10))]
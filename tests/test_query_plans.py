@@ -0,0 +1,33 @@
+# tests/test_query_plans.py
+import pytest
+
+import db
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "blood.db"))
+    monkeypatch.setattr(db, "_backend", None)
+    monkeypatch.setattr(db, "BACKEND", "sqlite")
+    db.migrate()
+    return db.DB_PATH
+
+
+def test_hot_queries_use_expected_indexes(fresh_db):
+    results = db.check_query_plans()
+    assert len(results) == len(db.HOT_QUERIES)
+    bad = [(r["name"], r["index"], r["plan"]) for r in results if not r["ok"]]
+    assert not bad
+
+
+def test_hot_query_functions_run(fresh_db):
+    # SQL ใน HOT_QUERIES เป็นตัวเดียวกับที่ฟังก์ชันเหล่านี้รัน: ต้องรันได้จริงบน DB ที่เพิ่ง migrate
+    db.adjust_stock("A", "PRC", 3, actor="test")
+    assert db.get_stock_row("A", "PRC")["units"] == 3
+    assert db.get_level_history("A", since="2000-01-01")["PRC"]["units"] == [3]
+    assert db.search_stock_log(blood_type="A", product_type="PRC", since="2000-01-01")
+    assert db.find_stock_drift() == []
+    db.insert_units([("2000-01-01", "2000-01-02", "=W123426123456 00", "A", "PRC", "ว่าง", "")])
+    assert [u["component"] for u in db.find_units("W123426123456")] == ["PRC"]
+    assert db.release_stale_bookings() == 0
+    assert db.expire_units(product_map={}) == 1
@@ -0,0 +1,44 @@
+# webassets.py
+"""
+ไฟล์ static (CSS) และ component หน้าแดชบอร์ดในโฟลเดอร์ frontend/
+
+เสิร์ฟผ่าน component handler ของ Streamlit (Content-Type ถูกต้อง + Cache-Control: public)
+URL แนบ ?v=<hash เนื้อหาไฟล์> เบราว์เซอร์จึงโหลดครั้งเดียวแล้วใช้ cache
+และโหลดใหม่เองเมื่อไฟล์เปลี่ยน แต่ละรอบ rerun ส่งแค่แท็ก <link> สั้น ๆ
+"""
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+
+import streamlit.components.v1 as components
+
+FRONTEND_DIR = Path(__file__).parent / "frontend"
+
+# ลงทะเบียนโฟลเดอร์ frontend/ กับ Streamlit เพื่อให้เสิร์ฟไฟล์ที่ /component/<name>/...
+_frontend = components.declare_component("frontend", path=str(FRONTEND_DIR))
+
+
+@lru_cache(maxsize=None)
+def asset_version(filename: str) -> str:
+    return hashlib.sha1((FRONTEND_DIR / filename).read_bytes()).hexdigest()[:10]
+
+
+def asset_url(filename: str) -> str:
+    # path แบบ relative: ใช้ได้ทั้งในหน้าแอปหลักและใน iframe (srcdoc ใช้ base URL เดียวกับหน้าแอป)
+    return f"component/{_frontend.name}/{filename}?v={asset_version(filename)}"
+
+
+def stylesheet_tag(filename: str) -> str:
+    return f'<link rel="stylesheet" href="{asset_url(filename)}">'
+
+
+def dashboard_grid(snapshot: dict, key: str, clickable: bool = True):
+    """
+    การ์ดถุงเลือดทุกกรุ๊ปใน iframe เดียว (frontend/index.html)
+    snapshot: { bag_max, critical_max, yellow_max, products, bags: [{bt, total, pct, color, dist}, ...] }
+    rerun ถัดไปส่งแค่ snapshot ใหม่ ฝั่งเบราว์เซอร์อัปเดตระดับ/สีเฉพาะส่วนที่เปลี่ยน
+    snapshot["kiosk"] = True: วาดสีทึบนิ่ง ไม่มีคลื่น / blend / filter (โหมด ?kiosk=1)
+    คืน {"bt": ..., "ts": ...} ของการ์ดที่ถูกคลิกล่าสุด (หรือ None)
+    """
+    snap = dict(snapshot, clickable=clickable, css_href=f"bag.css?v={asset_version('bag.css')}")
+    return _frontend(snapshot=snap, key=key, default=None)